@@ -1,188 +1,460 @@
+# first, so the time spent importing everything else is timed as startup
+from startup import Startup
 import os
-from shutil import move
-from tracemalloc import start
-from urllib import response
-from slack_bolt import App
-from slack_bolt.adapter.socket_mode import SocketModeHandler
-import re
-import logging
-from enum import Enum
+from slack_bolt import App, BoltResponse
+from slack_sdk import WebClient
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+import sqlite3
 import psycopg2
 
+from change_feed import (
+    CHANGE_FEED_ENABLED,
+    GAME_CHANGE,
+    ROSTER_CHANGE,
+    VOTE_BATCH_CHANGE,
+    VOTE_CHANGE,
+    WIN_CHANGE,
+    ChangeListener,
+    get_game_change_fields,
+    get_game_from_change,
+    notify_change,
+)
+from commands import (
+    BAD_BOARD_SIZE_MSG,
+    BAD_MOVE_FORMAT_MSG,
+    BOARD_HEIGHT,
+    BOARD_WIDTH,
+    BUSY_MSG,
+    DAY_IN_PROGRESS_MSG,
+    KILL_STR,
+    MAIN_CHANNEL_NAME,
+    MODERATOR_ONLY_MSG,
+    MODERATOR_USER_IDS,
+    NO_DAY_IN_PROGRESS_MSG,
+    NO_DAY_RESULTS_MSG,
+    NOT_ON_ROSTER_MSG,
+    OUT_OF_BOUNDS_MSG,
+    PHASE_NOT_CHANGED_MSG,
+    PRAYER_STR,
+    RESTARTED_MSG,
+    TIC_TAC_BOT_CHANNEL_NAMES,
+    TIC_TAC_CHANNEL_NAMES,
+    VOTE_JOURNAL_BUSY_MSG,
+    VOTE_NOT_RECORDED_MSG,
+    VOTE_RESULTS_CHANNEL_NAME,
+    VOTE_TALLY_HEADER,
+    VOTES_NOT_APPLIED_MSG,
+    WIN_LENGTH,
+    WRONG_CHANNEL_MSG,
+    VoteType,
+    apply_move,
+    collapse_vote_operations,
+    format_day_results,
+    format_day_started,
+    format_hint,
+    format_roster,
+    format_roster_change,
+    format_scoreboard,
+    format_vote_operations_result,
+    format_vote_tally,
+    get_kill_target,
+    get_prayer_target,
+    get_vote_type_str,
+    parse_board_size,
+    parse_day_num,
+    parse_page_num,
+    parse_roster_command,
+    parse_vote_import,
+    parse_vote_operations,
+)
+from db import DB_POOL_MAX_CONN, get_connection, get_pool_stats
+from leaderboard import Leaderboard
+from log import (
+    ContextThreadPoolExecutor,
+    collect_log_metrics,
+    configure_logging,
+    get_logger,
+    request_id_var,
+)
+from metrics import (
+    instrument_handler,
+    instrument_web_client,
+    registry,
+    start_summary_logging,
+)
+from migrate import migrate
+from request_dedup import (
+    REQUEST_DEDUP_DATABASE_ENABLED,
+    REQUEST_DEDUP_MAX_ENTRIES,
+    REQUEST_DEDUP_TTL_SECONDS,
+    RecentRequests,
+    claim_request_in_database,
+    get_request_key,
+    get_retry_reason,
+    record_repeated_request,
+)
+from roster import Roster
+from position_table import get_position_table
+from prepared_statements import (
+    ADD_PLAYER,
+    CAST_VOTES,
+    CLOSE_DAY,
+    COUNT_VOTES,
+    CREATE_GAME,
+    DAY_RESULTS,
+    DELETE_ALL_VOTES,
+    DELETE_VOTES,
+    END_DAY,
+    GET_GAME,
+    GET_OPEN_DAY,
+    LOAD_GAMES,
+    LOAD_PLAYERS,
+    LOAD_VOTES,
+    LOAD_WINS,
+    LOCK_GAME,
+    LOCK_OPEN_DAY,
+    PREPARED_STATEMENTS,
+    PRUNE_REQUESTS,
+    RECORD_WIN,
+    SAVE_GAME,
+    SET_PLAYER_ALIVE,
+    START_DAY,
+    execute_together,
+)
+import server
+from slack_files import download_text_file
+from tally_publisher import TallyPublisher
+from tic_tac_game import GameCache, TicTacGame, TicTacMove, convert_move_enum_to_str
+from user_directory import UserDirectory
+from vote_journal import (
+    VOTE_JOURNAL_BATCH_SIZE,
+    VOTE_JOURNAL_DRAIN_SECONDS,
+    VOTE_JOURNAL_MAX_RETRY_SECONDS,
+    VOTE_JOURNAL_PATH,
+    VoteJournal,
+    VoteRejectedError,
+    collect_vote_journal_metrics,
+)
+from vote_tally import VoteTally
+from worker_pool import (
+    WORKER_POOL_SIZE,
+    WORKER_QUEUE_SIZE,
+    KeyedWorkerPool,
+    collect_worker_pool_metrics,
+)
 
-class VoteType(Enum):
-    PRAYER = 1
-    KILL = 2
+startup = Startup()
+configure_logging()
+log = get_logger("app")
+registry.add_collector(collect_log_metrics)
 
+# how often the in-memory vote tally is checked against the votes table
+VOTE_TALLY_RECONCILE_SECONDS = float(
+    os.environ.get("VOTE_TALLY_RECONCILE_SECONDS", 600)
+)
 
-class TicTacMove(Enum):
-    OPEN = 1
-    X = 2
-    O = 3
+# record_win is the only writer of tic_tac_win, so the sorted leaderboard
+# is raised to each total it commits (set_wins) instead of re-reading the
+# table for every scoreboard
+leaderboard = Leaderboard()
 
-    @staticmethod
-    def get_opposite(e):
-        if e == TicTacMove.X:
-            return TicTacMove.O
-        elif e == TicTacMove.O:
-            return TicTacMove.X
-        else:
-            return TicTacMove.OPEN
+# cast_vote_to_database is the only writer of the votes table,
+# so this process can keep the tally itself
+vote_tally = VoteTally()
 
+# each channel's game as of its last committed move, for /tictachint
+game_cache = GameCache()
 
-logging.basicConfig(level=logging.INFO)
+# who's alive, so /kill and /prayto targets are checked before any write
+roster = Roster()
 
-# usernames are received by the server as <123ABC>
-USRNAME_PATTERN = "<.+>"
-USRNAME_REGEX = re.compile(USRNAME_PATTERN)
-KILL_CMD_PREFIX = "kill "
-KILL_PREFIX_LEN = len(KILL_CMD_PREFIX)
-KILL_COMMAND = KILL_CMD_PREFIX + USRNAME_PATTERN
 
-MAIN_CHANNEL_NAME = "main_chat"
-VOTE_RESULTS_CHANNEL_NAME = "vote-results"
+def upsert_votes(cur, rows):
+    """upsert rows of (target_name, voter_name, vote_type, voter_user_id,
+    cast_at) in one statement, returning (voter_user_id, vote_type,
+    target_name) for each vote that was applied"""
+    CAST_VOTES.execute(cur, [list(column) for column in zip(*rows)])
+    return cur.fetchall()
 
-PRAYER_STR = "prayer"
-KILL_STR = "kill"
 
-# for tic tac toe game
-BOARD_HEIGHT = 3
-BOARD_WIDTH = 3
-# backticks escape Slack markdown formatting (by formatting as "code")
-BLANK_BOARD_STR = "`_|_|_`\n`_|_|_`\n` | | `"
-TIC_TAC_CHANNEL_NAMES = ["tic-tac-toe-test", "tic-tac-tolympics"]
-TIE_STR = "TIE"
+def write_votes_to_database(votes):
+    """insert [(voter_id, target_name, vote_type, cast_at)] into the votes
+    table in one transaction, returning whether it committed - raises
+    VoteRejectedError if Postgres rejected the votes themselves"""
+    try:
+        # one statement can't upsert a row twice, and only a voter's latest
+        # vote counts anyway - the name lookup can call Slack, so it fails
+        # like the write does
+        latest_votes = {}
+        for voter_id, target_name, vote_type, cast_at in votes:
+            voter_user_id, voter_name = translate_user_id_to_name(voter_id)
+            latest_votes[voter_user_id] = (
+                target_name,
+                voter_name,
+                vote_type,
+                voter_user_id,
+                cast_at,
+            )
+        # borrow a connection from the shared pool
+        with get_connection() as conn:
+            cur = conn.cursor()
+            applied = upsert_votes(cur, list(latest_votes.values()))
+            for voter_user_id, vote_type, target_name in applied:
+                notify_change(cur, VOTE_CHANGE, voter_user_id, vote_type, target_name)
+            conn.commit()
+            cur.close()
+    except (psycopg2.DataError, psycopg2.IntegrityError) as error:
+        log.error("votes_rejected", error=error)
+        raise VoteRejectedError(error) from error
+    except (Exception, psycopg2.DatabaseError) as error:
+        log.error("votes_not_written", error=error)
+        return False
+    # only mirror votes that actually made it into the table - with the
+    # change feed on, the listener applies every process's votes
+    # (including this one) in commit order instead
+    if not CHANGE_FEED_ENABLED:
+        for voter_user_id, vote_type, target_name in applied:
+            vote_tally.record_vote(voter_user_id, target_name, vote_type)
+    return True
 
 
-def test_database_connection():
-    """Connect to the PostgreSQL database server"""
-    conn = None
+def cast_vote_to_database(voter_id, target_name, vote_type):
+    # convert from Python enum to PostGres enum
     try:
-        # connect to the PostgreSQL server
-        print("Connecting to the PostgreSQL database...")
-        conn = psycopg2.connect(os.environ["DATABASE_URL"], sslmode="require")
+        write_votes_to_database(
+            [(voter_id, target_name, get_vote_type_str(vote_type), time.time())]
+        )
+    except VoteRejectedError:
+        # already logged - without the journal there's nowhere to keep it
+        pass
 
-        # create a cursor
-        cur = conn.cursor()
 
-        # execute a statement
-        print("PostgreSQL database version:")
-        cur.execute("SELECT version()")
+def flush_journaled_votes(votes):
+    if not write_votes_to_database(votes):
+        return False
+    send_database_state_to_slack()
+    return True
 
-        # display the PostgreSQL database server version
-        db_version = cur.fetchone()
-        print(db_version)
 
-        # close the communication with the PostgreSQL
-        cur.close()
+def load_vote_tally_from_database():
+    """rebuild the in-memory vote tally from the votes table"""
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            LOAD_VOTES.execute(cur)
+            vote_tally.load(cur.fetchall())
+            cur.close()
+        log.info("vote_tally_loaded")
     except (Exception, psycopg2.DatabaseError) as error:
-        print(error)
-    finally:
-        if conn is not None:
-            conn.close()
-            print("Database connection closed.")
-
+        log.error("vote_tally_load_failed", error=error)
 
-def cast_vote_to_database(voter_id, target_name, vote_type):
-    voter_user_id, voter_name = translate_user_id_to_name(voter_id)
 
-    # convert from Python enum to PostGres enum
-    if vote_type == VoteType.KILL:
-        vote_type = KILL_STR
-    else:
-        assert vote_type == VoteType.PRAYER
-        vote_type = PRAYER_STR
-
-    """ insert a new vote into the votes table """
-    sql = """INSERT INTO votes(target_name, voter_name, vote_type, voter_user_id)
-             VALUES(%s, %s, %s, %s)
-             ON CONFLICT (voter_user_id)
-             DO UPDATE
-                SET target_name = excluded.target_name,
-                    vote_type = excluded.vote_type,
-                    votecast_time = excluded.votecast_time,
-                    voter_user_id = excluded.voter_user_id,
-                    voter_name = excluded.voter_name;"""
-    conn = None
+def reconcile_vote_tally():
+    """compare the in-memory tally with the database aggregate, reloading on mismatch"""
     try:
-        # connect to the PostgreSQL database
-        conn = psycopg2.connect(os.environ["DATABASE_URL"])
-        # create a new cursor
-        cur = conn.cursor()
-        # execute the INSERT statement
-        cur.execute(sql, (target_name, voter_name, vote_type, voter_user_id))
-        # commit the changes to the database
-        conn.commit()
-        # close communication with the database
-        cur.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            COUNT_VOTES.execute(cur)
+            rows = cur.fetchall()
+            cur.close()
     except (Exception, psycopg2.DatabaseError) as error:
-        print(error)
-    finally:
-        if conn is not None:
-            conn.close()
+        log.error("vote_tally_reconcile_failed", error=error)
+        return
 
+    for vote_type in [PRAYER_STR, KILL_STR]:
+        database_counts = {
+            target_name: count
+            for row_vote_type, target_name, count in rows
+            if row_vote_type == vote_type
+        }
+        if database_counts != vote_tally.get_counts(vote_type):
+            log.warning("vote_tally_drifted", vote_type=vote_type)
+            load_vote_tally_from_database()
+            return
+
+
+def reconcile_vote_tally_periodically():
+    while True:
+        time.sleep(VOTE_TALLY_RECONCILE_SECONDS)
+        reconcile_vote_tally()
+
+
+def get_vote_tally_str():
+    if not vote_tally.loaded:
+        load_vote_tally_from_database()
+    return format_vote_tally(vote_tally)
+
+
+# bursts of votes are folded into one edit of a single pinned tally message;
+# pass immediately=True (e.g. at the end of a phase) to skip the wait
+def send_database_state_to_slack(immediately=False):
+    if immediately:
+        tally_publisher.flush()
+    else:
+        tally_publisher.publish()
+
+
+# Initializes your app with your bot token - Bolt checks the token with
+# auth.test here, so this is one Slack round trip
+with startup.step("slack_app"):
+    app = App(
+        token=os.environ.get("SLACK_BOT_TOKEN"),
+        signing_secret=os.environ.get("SLACK_SIGNING_SECRET"),
+        # SLACK_API_URL points the Web API client somewhere else, e.g. the
+        # fake Slack server in loadtest.py
+        client=(
+            WebClient(
+                token=os.environ.get("SLACK_BOT_TOKEN"),
+                base_url=os.environ["SLACK_API_URL"],
+            )
+            if os.environ.get("SLACK_API_URL")
+            else None
+        ),
+        # Bolt's default executor, except listeners keep the request ID
+        listener_executor=ContextThreadPoolExecutor(max_workers=10),
+    )
+# every Web API call is counted and timed for /metrics
+instrument_web_client(app.client)
 
-def send_database_state_to_slack():
-    slack_msg = "=======VOTE TALLY UPDATE=======\n"
+# Slack retries a request when our ack is slow - the retry is acked here
+# without running its handler (and its queries and API calls) a second time
+recent_requests = RecentRequests(REQUEST_DEDUP_MAX_ENTRIES, REQUEST_DEDUP_TTL_SECONDS)
 
-    for vote_type in [PRAYER_STR, KILL_STR]:
-        slack_msg += f"-------*for vote type {vote_type.upper()}*-------\n"
-        conn = None
-        try:
-            """query data from the votes table"""
-            conn = psycopg2.connect(os.environ["DATABASE_URL"])
+
+def claim_request(key):
+    if not recent_requests.claim(key):
+        return False
+    if not REQUEST_DEDUP_DATABASE_ENABLED:
+        return True
+    try:
+        with get_connection() as conn:
             cur = conn.cursor()
-            cur.execute(
-                f"SELECT target_name, COUNT(*) as mycount, string_agg(voter_user_id, ', ') FROM votes WHERE vote_type = '{vote_type}' GROUP BY target_name ORDER BY mycount desc;"
-            )
+            claimed = claim_request_in_database(cur, key)
+            conn.commit()
+            cur.close()
+        return claimed
+    except (Exception, psycopg2.DatabaseError) as error:
+        # rather do a retry's work twice than drop a command
+        log.error("request_claim_failed", error=error)
+        return True
 
-            print(
-                f"Posting {vote_type.upper()} vote tally with total number of targets: ",
-                cur.rowcount,
-            )
 
-            row = cur.fetchone()
+@app.middleware
+def bind_request_id(body, next):
+    # every log line written while handling this request carries its ID
+    request_id_var.set(get_request_key(body) or uuid.uuid4().hex)
+    return next()
 
-            while row is not None:
-                target_str = f"*TARGET:* {row[0]}"
-                numvotes_str = f"| *VOTES:* {row[1]}"
-                slack_msg += target_str.ljust(30) + numvotes_str.rjust(14) + "\n"
-                user_id_list_str = ", ".join(
-                    ["<@" + str(player_id) + ">" for player_id in row[2].split(", ")]
-                )
-                slack_msg += f"    _brought to you by_: {user_id_list_str}\n"
-                row = cur.fetchone()
 
-            cur.close()
-        except (Exception, psycopg2.DatabaseError) as error:
-            print(error)
-        finally:
-            if conn is not None:
-                conn.close()
+@app.middleware
+def wait_for_startup(next):
+    # the port is open before the app is warm - a command that arrives in
+    # between waits a moment rather than racing the first loads
+    if not startup.is_ready():
+        startup.wait_until_ready()
+    return next()
 
-    app.client.chat_postMessage(channel=VOTE_RESULTS_CHANNEL_NAME, text=slack_msg)
 
+@app.middleware
+def skip_repeated_requests(req, body, next):
+    key = get_request_key(body)
+    if key is None or claim_request(key):
+        return next()
+    record_repeated_request(key, get_retry_reason(req.headers))
+    return BoltResponse(status=200, body="")
 
-# Initializes your app with your bot token and socket mode handler
-app = App(
-    token=os.environ.get("SLACK_BOT_TOKEN"),
-    signing_secret=os.environ.get("SLACK_SIGNING_SECRET"),
-)
+
+def prune_request_keys_periodically():
+    # keys only matter for as long as Slack keeps retrying
+    while True:
+        time.sleep(REQUEST_DEDUP_TTL_SECONDS)
+        try:
+            with get_connection() as conn:
+                cur = conn.cursor()
+                PRUNE_REQUESTS.execute(cur, [REQUEST_DEDUP_TTL_SECONDS])
+                conn.commit()
+                cur.close()
+        except (Exception, psycopg2.DatabaseError) as error:
+            log.error("request_prune_failed", error=error)
 
 
 @app.event("app_mention")
+@instrument_handler
 def action_button_click(event, say):
     say("dude what do you want")
 
 
+tally_publisher = TallyPublisher(
+    app.client, VOTE_RESULTS_CHANNEL_NAME, get_vote_tally_str, VOTE_TALLY_HEADER
+)
+
+# user ID -> name lookups without a users.list call per vote
+user_directory = UserDirectory(app.client)
+
+# database writes and Slack posts run here after the ack, so a slow query
+# can't hold up Slack's 3 second ack window
+worker_pool = None
+if WORKER_POOL_SIZE > 0:
+    worker_pool = KeyedWorkerPool(WORKER_POOL_SIZE, WORKER_QUEUE_SIZE)
+    registry.add_collector(collect_worker_pool_metrics(worker_pool))
+
+
+def run_after_ack(channel_id, respond, func, *args):
+    """Queue func behind earlier work for the same channel.
+
+    Returns False (after telling the player) if the queue is full.
+    """
+    if worker_pool is None:
+        func(*args)
+        return True
+    if worker_pool.submit(channel_id, func, *args):
+        return True
+    respond(BUSY_MSG)
+    return False
+
+
+@app.event("user_change")
+@instrument_handler
+def handle_user_change(event):
+    user_directory.update_user(event["user"])
+
+
+@app.event("team_join")
+@instrument_handler
+def handle_team_join(event):
+    user_directory.update_user(event["user"])
+
+
 def translate_user_id_to_name(user_id):
     # token should be passed automatically
     # (specified token when initializing app)
-    users_list = app.client.users_list()
-    for user in users_list["members"]:
-        if user["id"] == user_id:
-            return (user["id"], user["real_name"])
-    return ("aw shucks", "could not find a user name for this user ID")
+    name = user_directory.get_name(user_id)
+    # an unknown voter keeps their own row, under their ID
+    return (user_id, name or user_id)
+
+
+# set on startup unless VOTE_JOURNAL_PATH is empty, see start_vote_journal
+vote_journal = None
+
+
+def submit_vote(channel_id, respond, voter_id, target_name, vote_type):
+    """Journal a vote, or queue its database write when there's no journal.
+
+    Returns False (after telling the player) if the vote wasn't taken.
+    """
+    if vote_journal is None:
+        update = update_kill_vote if vote_type == VoteType.KILL else update_prayer
+        return run_after_ack(channel_id, respond, update, voter_id, target_name)
+    try:
+        vote_journal.append(voter_id, target_name, get_vote_type_str(vote_type))
+    except sqlite3.Error as error:
+        log.error("vote_not_journaled", error=error)
+        respond(VOTE_NOT_RECORDED_MSG)
+        return False
+    return True
 
 
 def update_kill_vote(voting_player, target_player):
@@ -193,25 +465,34 @@ def update_kill_vote(voting_player, target_player):
 
 
 @app.command("/kill")
+@instrument_handler
 def handle_kill_vote(ack, respond, command):
     # Acknowledge command request
     ack()
-    user_to_kill = command["text"]
     voting_player = command["user_id"]
-    matches = USRNAME_REGEX.findall(user_to_kill)
     if command["channel_name"] != MAIN_CHANNEL_NAME:
-        respond("You can't do that in this channel.")
-    else:
-        # only 1 target can be specified - second case makes sure the regex match
-        # contains only 1 user id
-        if len(matches) == 1 and len(matches[0].split()) == 1:
-            respond(
-                f"<@{voting_player}> has voted to kill {user_to_kill}",
-                response_type="in_channel",
-            )
-            update_kill_vote(voting_player, user_to_kill)
-        else:
-            respond("Try again - you didn't specify a valid player.")
+        respond(WRONG_CHANNEL_MSG)
+        return
+
+    if not roster.loaded:
+        load_roster_from_database()
+    user_to_kill, error_msg = get_kill_target(command["text"], roster)
+    if error_msg is not None:
+        respond(error_msg)
+        return
+
+    # the vote is journaled (or queued) before the channel hears about it
+    if submit_vote(
+        command["channel_id"],
+        respond,
+        voting_player,
+        user_to_kill,
+        VoteType.KILL,
+    ):
+        respond(
+            f"<@{voting_player}> has voted to kill {user_to_kill}",
+            response_type="in_channel",
+        )
 
 
 def update_prayer(praying_player, prayer_target):
@@ -222,435 +503,665 @@ def update_prayer(praying_player, prayer_target):
 
 
 @app.command("/prayto")
+@instrument_handler
 def handle_prayer(ack, respond, command):
     ack()
-    prayer_targets = command["text"].split()
     praying_player = command["user_id"]
 
     # no check for which channel because praying is allowed anywhere
-    # check that only 1 user specified
-    if len(prayer_targets) == 1:
-        uppercase_target = prayer_targets[0].upper()
+    if not roster.loaded:
+        load_roster_from_database()
+    prayer_target, error_msg = get_prayer_target(command["text"], roster)
+    if error_msg is not None:
+        respond(error_msg)
+        return
+
+    if submit_vote(
+        command["channel_id"],
+        respond,
+        praying_player,
+        prayer_target,
+        VoteType.PRAYER,
+    ):
         respond(
-            f"<@{praying_player}> is praying to {uppercase_target}",
+            f"<@{praying_player}> is praying to {prayer_target}",
             response_type="in_channel",
         )
-        update_prayer(praying_player, uppercase_target)
+
+
+# moderators only: /roster add @player [role], /roster kill @player,
+# /roster revive @player, or just /roster to list everyone
+@app.command("/roster")
+@instrument_handler
+def handle_roster(ack, respond, command):
+    ack()
+    if command["user_id"] not in MODERATOR_USER_IDS:
+        respond(MODERATOR_ONLY_MSG)
+        return
+
+    action, player_id, role, error_msg = parse_roster_command(command["text"])
+    if error_msg is not None:
+        respond(error_msg)
+        return
+    if action is None:
+        if not roster.loaded:
+            load_roster_from_database()
+        respond(format_roster(roster))
+        return
+
+    run_after_ack(
+        command["channel_id"], respond, update_roster, action, player_id, role, respond
+    )
+
+
+# moderators only: many vote changes applied as one transaction, e.g.
+# /modvotes kill @voter @target; pray @voter zeus; remove @voter; clear
+# or /modvotes import <link to a shared text file of them>
+@app.command("/modvotes")
+@instrument_handler
+def handle_moderator_votes(ack, respond, command):
+    ack()
+    if command["user_id"] not in MODERATOR_USER_IDS:
+        respond(MODERATOR_ONLY_MSG)
+        return
+
+    if not roster.loaded:
+        load_roster_from_database()
+    file_id = parse_vote_import(command["text"])
+    if file_id is not None:
+        # the download waits on Slack, so it happens after the ack too
+        run_after_ack(
+            command["channel_id"], respond, import_vote_operations, file_id, respond
+        )
+        return
+
+    operations, error_msg = parse_vote_operations(command["text"], roster)
+    if error_msg is not None:
+        respond(error_msg)
+        return
+    run_after_ack(
+        command["channel_id"], respond, apply_vote_operations, operations, respond
+    )
+
+
+def import_vote_operations(file_id, respond):
+    try:
+        text = download_text_file(app.client, file_id)
+    except Exception as error:
+        log.error("vote_import_failed", error=error)
+        respond(f"Couldn't read that file: {error}")
+        return
+    operations, error_msg = parse_vote_operations(text, roster)
+    if error_msg is not None:
+        respond(error_msg)
+        return
+    apply_vote_operations(operations, respond)
+
+
+def apply_vote_operations(operations, respond):
+    clear_all, removed_voter_ids, votes = collapse_vote_operations(operations)
+    # a journaled vote written after this would undo a clear or a removal
+    if vote_journal is not None and not vote_journal.wait_until_empty(
+        VOTE_JOURNAL_DRAIN_SECONDS
+    ):
+        respond(VOTE_JOURNAL_BUSY_MSG)
+        return
+
+    cast_at = time.time()
+    rows = [
+        (
+            target_name,
+            user_directory.get_name(voter_id) or voter_id,
+            vote_type,
+            voter_id,
+            cast_at,
+        )
+        for voter_id, (vote_type, target_name) in votes.items()
+    ]
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            if clear_all:
+                DELETE_ALL_VOTES.execute(cur)
+            elif removed_voter_ids:
+                DELETE_VOTES.execute(cur, [list(removed_voter_ids)])
+            if rows:
+                upsert_votes(cur, rows)
+            notify_change(cur, VOTE_BATCH_CHANGE)
+            conn.commit()
+            cur.close()
+    except (Exception, psycopg2.DatabaseError) as error:
+        log.error("vote_operations_failed", error=error)
+        respond(VOTES_NOT_APPLIED_MSG)
+        return
+
+    # one tally reload and one tally post for the whole batch
+    if not CHANGE_FEED_ENABLED:
+        load_vote_tally_from_database()
+    send_database_state_to_slack()
+    respond(format_vote_operations_result(clear_all, removed_voter_ids, votes))
+
+
+def update_roster(action, player_id, role, respond):
+    if action == "add":
+        statement, params = ADD_PLAYER, [player_id, role]
     else:
-        respond("Try again - you didn't specify a valid player.")
+        statement, params = SET_PLAYER_ALIVE, [action == "revive", player_id]
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            statement.execute(cur, params)
+            row = cur.fetchone()
+            if row is not None:
+                role, alive = row
+                notify_change(cur, ROSTER_CHANGE, player_id, role, alive)
+            conn.commit()
+            cur.close()
+    except (Exception, psycopg2.DatabaseError) as error:
+        log.error("roster_update_failed", error=error)
+        return
+
+    if row is None:
+        respond(NOT_ON_ROSTER_MSG)
+        return
+    # with the change feed on, the listener applies it like any other change
+    if not CHANGE_FEED_ENABLED:
+        roster.set_player(player_id, role, alive)
+    respond(format_roster_change(player_id, role, alive))
+
+
+def load_roster_from_database():
+    """rebuild the in-memory roster from the players table"""
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            LOAD_PLAYERS.execute(cur)
+            roster.load(cur.fetchall())
+            cur.close()
+        log.info("roster_loaded")
+    except (Exception, psycopg2.DatabaseError) as error:
+        log.error("roster_load_failed", error=error)
+
+
+# moderators only: /startday opens the next game day, /endday closes it,
+# archiving its votes and posting its final tally
+@app.command("/startday")
+@instrument_handler
+def handle_start_day(ack, respond, command):
+    ack()
+    if command["user_id"] not in MODERATOR_USER_IDS:
+        respond(MODERATOR_ONLY_MSG)
+        return
+    run_after_ack(command["channel_id"], respond, start_day, respond)
+
+
+@app.command("/endday")
+@instrument_handler
+def handle_end_day(ack, respond, command):
+    ack()
+    if command["user_id"] not in MODERATOR_USER_IDS:
+        respond(MODERATOR_ONLY_MSG)
+        return
+    run_after_ack(command["channel_id"], respond, end_day, respond)
+
+
+# /dayresults for the last finished day, /dayresults 2 for day 2
+@app.command("/dayresults")
+@instrument_handler
+def handle_day_results(ack, respond, command):
+    ack()
+    day_num = parse_day_num(command["text"])
+    run_after_ack(command["channel_id"], respond, show_day_results, day_num, respond)
+
+
+def start_day(respond):
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            GET_OPEN_DAY.execute(cur)
+            if cur.fetchone() is not None:
+                respond(DAY_IN_PROGRESS_MSG)
+                return
+            START_DAY.execute(cur)
+            (day_num,) = cur.fetchone()
+            # day_num comes from the database, so it's safe to format in
+            cur.execute(f"""CREATE TABLE IF NOT EXISTS votes_history_day_{day_num}
+                    PARTITION OF votes_history FOR VALUES IN ({day_num});""")
+            conn.commit()
+            cur.close()
+    except (Exception, psycopg2.DatabaseError) as error:
+        log.error("day_start_failed", error=error)
+        respond(PHASE_NOT_CHANGED_MSG)
+        return
+    respond(format_day_started(day_num), response_type="in_channel")
+
+
+def end_day(respond):
+    # a journaled vote written after this would land in the next day
+    if vote_journal is not None and not vote_journal.wait_until_empty(
+        VOTE_JOURNAL_DRAIN_SECONDS
+    ):
+        respond(VOTE_JOURNAL_BUSY_MSG)
+        return
+
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            LOCK_OPEN_DAY.execute(cur)
+            row = cur.fetchone()
+            if row is None:
+                respond(NO_DAY_IN_PROGRESS_MSG)
+                return
+            (day_num,) = row
+            END_DAY.execute(cur, [day_num])
+            results = cur.fetchall()
+            CLOSE_DAY.execute(cur, [day_num])
+            notify_change(cur, VOTE_BATCH_CHANGE)
+            conn.commit()
+            cur.close()
+    except (Exception, psycopg2.DatabaseError) as error:
+        log.error("day_end_failed", error=error)
+        respond(PHASE_NOT_CHANGED_MSG)
+        return
+
+    # reloaded here even with the change feed on, so the pinned tally is
+    # cleared right away rather than after the listener catches up
+    load_vote_tally_from_database()
+    send_database_state_to_slack(immediately=True)
+    respond(format_day_results(day_num, results), response_type="in_channel")
+
+
+def show_day_results(day_num, respond):
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            DAY_RESULTS.execute(cur, [day_num])
+            rows = cur.fetchall()
+            cur.close()
+    except (Exception, psycopg2.DatabaseError) as error:
+        log.error("day_results_failed", error=error)
+        return
+    if not rows:
+        respond(NO_DAY_RESULTS_MSG)
+        return
+    # a day nobody voted in still has its game_phases row
+    results = [row[1:] for row in rows if row[1] is not None]
+    respond(format_day_results(rows[0][0], results))
 
 
 @app.command("/tictacmove")
-def handle_tictacmove(ack, respond, command):
+@instrument_handler
+def handle_tictacmove(ack, respond, command, context):
     ack()
     if command["channel_name"] not in TIC_TAC_CHANNEL_NAMES:
-        respond("You can't do that in this channel.")
+        respond(WRONG_CHANNEL_MSG)
     else:
         move_data = command["text"].split()
         if len(move_data) == 2:
             row_num = int(move_data[0])
             col_num = int(move_data[1])
-            if (
-                row_num >= 0
-                and row_num < BOARD_HEIGHT
-                and col_num >= 0
-                and col_num < BOARD_WIDTH
-            ):
+            if row_num >= 0 and col_num >= 0:
                 player = command["user_id"]
-                make_tic_tac_toe_move(player, row_num, col_num, respond)
-            else:
-                respond(
-                    "Try again - your move row and column were too large or too small."
+                # each channel has its own game, so the upper bounds are
+                # checked against that game's board size
+                bot_user_id = None
+                if command["channel_name"] in TIC_TAC_BOT_CHANNEL_NAMES:
+                    bot_user_id = context.bot_user_id
+                # moves for one channel queue up behind each other, so they
+                # still reach the database in the order they arrived
+                run_after_ack(
+                    command["channel_id"],
+                    respond,
+                    make_tic_tac_toe_move,
+                    command["channel_id"],
+                    player,
+                    row_num,
+                    col_num,
+                    respond,
+                    bot_user_id,
                 )
+            else:
+                respond(OUT_OF_BOUNDS_MSG)
         else:
-            respond("Try again - you didn't provide a move in proper format.")
+            respond(BAD_MOVE_FORMAT_MSG)
+
+
+@app.command("/tictachint")
+@instrument_handler
+def handle_tic_tac_hint(ack, respond, command):
+    ack()
+    if command["channel_name"] not in TIC_TAC_CHANNEL_NAMES:
+        respond(WRONG_CHANNEL_MSG)
+        return
+
+    game = game_cache.get(command["channel_id"])
+    if game is None:
+        try:
+            with get_connection() as conn:
+                cur = conn.cursor()
+                game = lock_and_get_game(cur, command["channel_id"], lock=False)
+                conn.commit()
+                cur.close()
+            game_cache.store(game)
+        except (Exception, psycopg2.DatabaseError) as error:
+            log.error("game_load_failed", error=error)
+    if game is None:
+        return
+
+    respond(format_hint(game))
 
 
 # used for debugging the reset function - this slack command
 # will be disabled before the app is put to use by the public
+# optionally takes "height width win_length" to start a different size of game
 @app.command("/restart-tic-tac")
+@instrument_handler
 def handle_tic_tac_restart(ack, respond, command):
     ack()
     if command["channel_name"] not in TIC_TAC_CHANNEL_NAMES:
-        respond("You can't do that in this channel.")
-    else:
-        reset_board_state()
-        respond("Board should be reset now.")
+        respond(WRONG_CHANNEL_MSG)
+        return
+
+    board_size, valid = parse_board_size(command["text"])
+    if not valid:
+        respond(BAD_BOARD_SIZE_MSG)
+        return
+
+    # queued with the channel's moves so it can't jump ahead of them
+    if run_after_ack(
+        command["channel_id"], respond, restart_game, command["channel_id"], board_size
+    ):
+        respond(RESTARTED_MSG)
+
+
+def restart_game(game_id, board_size):
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            # wait for any in-flight move to finish before wiping the board
+            game = lock_and_get_game(cur, game_id)
+            if board_size is not None:
+                game.height, game.width, game.win_length = board_size
+            reset_board_state(cur, game, TicTacMove.X)
+            conn.commit()
+            cur.close()
+        game_cache.store(game)
+    except (Exception, psycopg2.DatabaseError) as error:
+        log.error("game_restart_failed", error=error)
 
 
+# takes an optional 1-indexed page number, e.g. /tictacscoreboard 2
 @app.command("/tictacscoreboard")
+@instrument_handler
 def handle_tic_tac_scoreboard(ack, respond, command):
     ack()
     # allow in any channel
-    sql = """SELECT player_id, num_wins from tic_tac_win ORDER BY num_wins DESC"""
-    slack_msg = "===CURRENT TIC TAC TOE SCOREBOARD===\n"
-    try:
-        conn = psycopg2.connect(os.environ["DATABASE_URL"])
-        cur = conn.cursor()
-        cur.execute(sql)
-        conn.commit()
+    page_num = parse_page_num(command["text"])
 
-        print(f"Getting win count")
+    if not leaderboard.loaded:
+        load_leaderboard_from_database()
 
-        row = cur.fetchone()
+    respond(format_scoreboard(leaderboard, page_num, command["user_id"]))
 
-        while row is not None:
-            target_str = f"*PLAYER:* <@{row[0]}>"
-            numvotes_str = f"| *WINS:* {row[1]}"
-            slack_msg += target_str.ljust(30) + numvotes_str.rjust(14) + "\n"
-            row = cur.fetchone()
 
-        cur.close()
+def load_leaderboard_from_database():
+    """rebuild the in-memory leaderboard from the tic_tac_win table"""
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            LOAD_WINS.execute(cur)
+            leaderboard.load(cur.fetchall())
+            cur.close()
+        log.info("leaderboard_loaded")
     except (Exception, psycopg2.DatabaseError) as error:
-        print(error)
-    finally:
-        if conn is not None:
-            conn.close()
-    respond(slack_msg)
-
-
-def convert_move_str_to_enum(move_str):
-    if move_str == "OPEN":
-        return TicTacMove.OPEN
-    elif move_str == "X":
-        return TicTacMove.X
-    elif move_str == "O":
-        return TicTacMove.O
-    else:
-        print(
-            f"ERROR: move_str was none of the permitted types - it was instead {move_str}"
-        )
+        log.error("leaderboard_load_failed", error=error)
 
 
-def update_curr_move_team(team_letter_str):
-    conn = None
-    sql = """UPDATE tic_tac_curr_team
-                SET letter = %s;"""
-    try:
-        conn = psycopg2.connect(os.environ["DATABASE_URL"])
-        cur = conn.cursor()
-        cur.execute(sql, [team_letter_str])
-        conn.commit()
+# the helpers below all take a cursor so that one move can read, validate
+# and write the whole game inside a single transaction
 
-        print(f"Updating curr team to be {team_letter_str}")
 
-        cur.close()
-    except (Exception, psycopg2.DatabaseError) as error:
-        print(error)
-    finally:
-        if conn is not None:
-            conn.close()
+# loads the channel's game (creating it on first use), locking its row until
+# the transaction ends so that concurrent moves are applied one at a time
+# (pass lock=False for read-only lookups that shouldn't wait on a move)
+def lock_and_get_game(cur, game_id, lock=True):
+    blank_game = TicTacGame(game_id, BOARD_HEIGHT, BOARD_WIDTH, WIN_LENGTH)
+    get_game = LOCK_GAME if lock else GET_GAME
+    # both statements go in one round trip
+    execute_together(
+        cur,
+        [
+            (
+                CREATE_GAME,
+                [
+                    game_id,
+                    blank_game.height,
+                    blank_game.width,
+                    blank_game.win_length,
+                    blank_game.packed_cells(),
+                    convert_move_enum_to_str(blank_game.curr_team),
+                ],
+            ),
+            (get_game, [game_id]),
+        ],
+    )
 
+    game = TicTacGame.from_row(game_id, cur.fetchone())
+    log.debug("game_loaded", sample=True, game_id=game_id, version=game.version)
+    return game
 
-# looks up whether the current turn is for O or X
-# then sets the other team to be the team for the next turn
-def get_and_update_curr_move_team():
-    conn = None
-    curr_team_str = None
-    try:
-        """look up whether it is a turn for team X or team O"""
-        conn = psycopg2.connect(os.environ["DATABASE_URL"])
-        cur = conn.cursor()
-        cur.execute(f"SELECT * FROM tic_tac_curr_team;")
 
-        print("Getting team for current move")
+def update_board_state(cur, game):
+    """write the whole game back as one row"""
+    SAVE_GAME.execute(
+        cur,
+        [
+            game.height,
+            game.width,
+            game.win_length,
+            game.packed_cells(),
+            convert_move_enum_to_str(game.curr_team),
+            game.move_count,
+            game.game_id,
+        ],
+    )
+    game.version += 1
+    notify_change(cur, GAME_CHANGE, game.game_id, *get_game_change_fields(game))
 
-        row = cur.fetchone()
+    log.debug("game_saved", sample=True, game_id=game.game_id, version=game.version)
 
-        while row is not None:
-            curr_team_str = row[0]
-            row = cur.fetchone()
 
-        cur.close()
-    except (Exception, psycopg2.DatabaseError) as error:
-        print(error)
-    finally:
-        if conn is not None:
-            conn.close()
-
-        if curr_team_str == "X":
-            print(f"Current team is {curr_team_str}")
-            update_curr_move_team("O")
-            return TicTacMove.X
-        elif curr_team_str == "O":
-            print(f"Current team is {curr_team_str}")
-            update_curr_move_team("X")
-            return TicTacMove.O
-        else:
-            print("ERROR: constructed move type was neither X nor O")
+def reset_board_state(cur, game, next_team):
+    """set all board tiles to state OPEN"""
+    game.reset(next_team)
+    update_board_state(cur, game)
 
+    log.info("game_reset", game_id=game.game_id)
 
-# returns (whether_game_won, winner)
-# winner is arbitrary if whether_game_won is False
-def whether_triple(board_state, start_index, offset):
-    if (
-        (board_state[start_index] != TicTacMove.OPEN)
-        and (board_state[start_index] == board_state[start_index + offset])
-        and (board_state[start_index] == board_state[start_index + 2 * offset])
-    ):
-        return True, board_state[start_index]
-    else:
-        for tile in board_state:
-            if tile == TicTacMove.OPEN:
-                return False, TicTacMove.OPEN
-        # in this case, there's no winner, and the board is full
-        return TIE_STR, TicTacMove.OPEN
-
-
-# lst_of_checked_triples is a list of the form (whether_game_won, winner)
-# in tic tac toe, it is NOT possible for more than one player to be a winner at the same time
-def get_winner(lst_of_checked_triples):
-    for result in lst_of_checked_triples:
-        # check if there are any wins
-        if result[0] == True:
-            return result
-    for result in lst_of_checked_triples:
-        # now check if there is a tie (only valid when there is no win)
-        if result[0] == TIE_STR:
-            return result
-    return False, TicTacMove.OPEN
-
-
-def check_for_vert_win(board_state):
-    offset = 3
-    # vert win states start from tiles 0, 1, 2
-    lst_to_check = [whether_triple(board_state, i, offset) for i in range(3)]
-    return get_winner(lst_to_check)
-
-
-def check_for_horiz_win(board_state):
-    offset = 1
-    # horiz win states start from tiles 0, 3, 6
-    lst_to_check = [whether_triple(board_state, i, offset) for i in [0, 3, 6]]
-    return get_winner(lst_to_check)
-
-
-def check_for_diag_win(board_state):
-    return get_winner(
-        [whether_triple(board_state, 0, 4), whether_triple(board_state, 2, 2)]
-    )
 
+def record_win(cur, player):
+    """record 1 additional tic tac toe win for player, returning their new total"""
+    RECORD_WIN.execute(cur, [player])
+    num_wins = cur.fetchone()[0]
+    # the total rather than "+1", so applying it twice can't double count
+    notify_change(cur, WIN_CHANGE, player, num_wins)
 
-def check_for_win(board_state):
-    return get_winner(
-        [
-            check_for_vert_win(board_state),
-            check_for_horiz_win(board_state),
-            check_for_diag_win(board_state),
-        ]
-    )
+    log.info("win_recorded", player=player, num_wins=num_wins)
+    return num_wins
 
 
-def record_win(player):
-    conn = None
+def run_migrations():
+    # see migrations/ - creates or upgrades every table the app uses
     try:
-        """record 1 additional tic tac toe win for player"""
-        conn = psycopg2.connect(os.environ["DATABASE_URL"])
-        cur = conn.cursor()
-        sql = """INSERT INTO tic_tac_win(player_id, num_wins)
-             VALUES(%s, %s)
-             ON CONFLICT (player_id)
-             DO UPDATE
-                SET num_wins = tic_tac_win.num_wins + 1;"""
-        cur.execute(sql, [player, 1])
+        migrate(os.environ["DATABASE_URL"])
+    except (Exception, psycopg2.DatabaseError) as error:
+        log.error("migrations_failed", error=error)
 
-        # commit the changes to the database
-        conn.commit()
 
-        print(f"Recording a win for {player}")
+def make_tic_tac_toe_move(game_id, player, row_num, col_num, respond, bot_user_id=None):
+    error_msg = None
+    slack_msg = ""
+    win_totals = []
+    try:
+        # the whole move is one transaction - the game row stays locked from
+        # the read until the commit, so two players can't both claim a square
+        with get_connection() as conn:
+            cur = conn.cursor()
+            game = lock_and_get_game(cur, game_id)
+            error_msg, slack_msg, winners = apply_move(
+                game, player, row_num, col_num, bot_user_id
+            )
+            if error_msg is None:
+                # record a win for each winning player (the bot's reply
+                # can win too) in the same transaction as the move
+                for winner in winners:
+                    win_totals.append((winner, record_win(cur, winner)))
+                update_board_state(cur, game)
+                conn.commit()
+            cur.close()
+    except (Exception, psycopg2.DatabaseError) as error:
+        log.error("move_failed", error=error)
+        return
 
-        row = cur.fetchone()
+    # only wins that were actually committed reach the leaderboard
+    for winner, num_wins in win_totals:
+        leaderboard.set_wins(winner, num_wins)
+    game_cache.store(game)
 
-        while row is not None:
-            curr_team_str = row[0]
-            row = cur.fetchone()
+    # respond only once the lock on the game has been released
+    if error_msg is not None:
+        respond(error_msg)
+        return
+    respond(slack_msg, response_type="in_channel")
 
-        cur.close()
-    except (Exception, psycopg2.DatabaseError) as error:
-        print(error)
-    finally:
-        if conn is not None:
-            conn.close()
 
+def apply_vote_change(voter_user_id, vote_type, target_name):
+    vote_tally.record_vote(voter_user_id, target_name, vote_type)
 
-def update_board_state(row_num, col_num, curr_team):
-    conn = None
-    try:
-        """record new state induced by current move"""
-        conn = psycopg2.connect(os.environ["DATABASE_URL"])
-        cur = conn.cursor()
-        sql = """INSERT INTO tic_tac_board(tile_state, square_id)
-             VALUES(%s, %s)
-             ON CONFLICT (square_id)
-             DO UPDATE
-                SET tile_state = excluded.tile_state;"""
-        cur.execute(
-            sql, [convert_move_enum_to_str(curr_team), row_num * BOARD_WIDTH + col_num]
-        )
 
-        # commit the changes to the database
-        conn.commit()
+def apply_game_change(game_id, *fields):
+    game_cache.store(get_game_from_change(game_id, *fields))
 
-        print(
-            f"Updating board state at row {row_num} and col {col_num} to be {curr_team}"
-        )
 
-        cur.close()
-    except (Exception, psycopg2.DatabaseError) as error:
-        print(error)
-    finally:
-        if conn is not None:
-            conn.close()
-
-
-def convert_move_enum_to_str(tile):
-    if tile == TicTacMove.OPEN:
-        return "_"
-    elif tile == TicTacMove.X:
-        return "X"
-    elif tile == TicTacMove.O:
-        return "O"
-    else:
-        print(
-            "ERROR: When constructing board string, a tile was neither X nor O nor OPEN"
-        )
+# every handler is safe to replay - see change_feed.apply_change
+CHANGE_HANDLERS = {
+    VOTE_CHANGE: apply_vote_change,
+    WIN_CHANGE: leaderboard.set_wins,
+    GAME_CHANGE: apply_game_change,
+    ROSTER_CHANGE: roster.set_player,
+    VOTE_BATCH_CHANGE: load_vote_tally_from_database,
+}
 
 
-def get_board_str(board_state):
-    board_str = ""
-    for i in range(BOARD_HEIGHT):
-        curr_row_str = "`"
-        for j in range(BOARD_WIDTH):
-            curr_row_str += convert_move_enum_to_str(board_state[j + BOARD_WIDTH * i])
-            curr_row_str += "|"
-        # replace last-column | with `\n
-        curr_row_str = curr_row_str[:-1]
-        curr_row_str += "`\n"
-        board_str += curr_row_str
-    return board_str
-
-
-def reset_board_state():
-    print("Reached beginning of func reset_board_state()")
-    conn = None
-    values_str = "(%s, %s)," * BOARD_WIDTH * BOARD_HEIGHT
-    # remove final comma
-    values_str = values_str[:-1]
-    sql = (
-        """INSERT INTO tic_tac_board(square_id, tile_state)
-             VALUES """
-        + values_str
-        + """ ON CONFLICT (square_id)
-             DO UPDATE
-                SET tile_state = excluded.tile_state;"""
-    )
-    rows_to_insert = [(i, "OPEN") for i in range(BOARD_HEIGHT * BOARD_WIDTH)]
-    values_to_insert = []
-    for i in rows_to_insert:
-        values_to_insert.append(i[0])
-        values_to_insert.append(i[1])
-    print("rows_to_insert has len", len(rows_to_insert))
-    print("rows to insert is", rows_to_insert)
-    print("values to insert is", values_to_insert)
-    print("sql str is", sql)
+def load_games_from_database():
+    """fill the game cache with every channel's game"""
     try:
-        """set all board tiles to state OPEN"""
-        conn = psycopg2.connect(os.environ["DATABASE_URL"])
-        cur = conn.cursor()
-        cur.execute(sql, values_to_insert)
-
-        # commit the changes to the database
-        conn.commit()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            LOAD_GAMES.execute(cur)
+            rows = cur.fetchall()
+            cur.close()
+        for game_id, *fields in rows:
+            game_cache.store(TicTacGame.from_row(game_id, fields))
+        log.info("games_loaded", num_games=len(rows))
+    except (Exception, psycopg2.DatabaseError) as error:
+        log.error("games_load_failed", error=error)
 
-        print("Resetting board state for a new game")
 
-        cur.close()
-    except (Exception, psycopg2.DatabaseError) as error:
-        print(error)
-    finally:
-        if conn is not None:
-            conn.close()
-
-
-def make_tic_tac_toe_move(player, row_num, col_num, respond):
-    slack_msg = f"====CURRENT BOARD===\n"
-    last_move_by_str = f"Last move made by <@{player}>\n"
-    board_state = []
-    board_index = row_num * BOARD_WIDTH + col_num
-    conn = None
+def prepare_pooled_connections():
+    """open every connection the pool can hold and prepare the per-command
+    SQL on each, so the first commands don't pay for either"""
     try:
-        """query data from the tic tac toe table"""
-        conn = psycopg2.connect(os.environ["DATABASE_URL"])
-        cur = conn.cursor()
-        cur.execute(f"SELECT tile_state FROM tic_tac_board ORDER BY square_id ASC")
+        with ExitStack() as stack:
+            # all held at once, so each one is a different connection
+            for _ in range(DB_POOL_MAX_CONN):
+                conn = stack.enter_context(get_connection())
+                cur = conn.cursor()
+                for statement in PREPARED_STATEMENTS:
+                    statement.get_sql(cur)
+                cur.close()
+        log.info(
+            "db_connections_prepared",
+            num_statements=len(PREPARED_STATEMENTS),
+            **get_pool_stats(),
+        )
+    except (Exception, psycopg2.DatabaseError) as error:
+        log.error("db_connections_prepare_failed", error=error)
 
-        print("Getting existing tic tac toe board")
 
-        r = cur.fetchone()
+def reload_caches():
+    # changes sent while the listener was disconnected were lost
+    load_vote_tally_from_database()
+    load_leaderboard_from_database()
+    load_roster_from_database()
+    game_cache.clear()
 
-        while r is not None:
-            board_state.append(convert_move_str_to_enum(r[0]))
-            r = cur.fetchone()
 
-        cur.close()
-    except (Exception, psycopg2.DatabaseError) as error:
-        print(error)
-    finally:
-        if conn is not None:
-            conn.close()
+def start_vote_journal():
+    global vote_journal
+    vote_journal = VoteJournal(
+        VOTE_JOURNAL_PATH,
+        flush_journaled_votes,
+        VOTE_JOURNAL_BATCH_SIZE,
+        VOTE_JOURNAL_MAX_RETRY_SECONDS,
+    )
+    registry.add_collector(collect_vote_journal_metrics(vote_journal))
+    # anything left from the last run is flushed first
+    vote_journal.start()
 
-        if len(board_state) != BOARD_HEIGHT * BOARD_WIDTH:
-            print("ERROR: board_state was not the correct length")
-        else:
 
-            if board_state[board_index] != TicTacMove.OPEN:
-                respond("Try again - that space is already taken.")
-            else:
-                curr_team = get_and_update_curr_move_team()
-                board_state[board_index] = curr_team
-
-                # get next team to use in Slack msg response
-                next_team = TicTacMove.get_opposite(curr_team)
-                next_team_str = f"Next move will be for team `{convert_move_enum_to_str(next_team)}`\n"
-
-                # winner currently not used because X and O team assignments don't matter
-                whether_won, winner = check_for_win(board_state)
-                if whether_won == True:
-                    # record a win for the current player
-                    record_win(player)
-                    # reset the (database) board state
-                    reset_board_state()
-                    # print a blank board to the chat
-                    slack_msg += (
-                        f"This is a new game - <@{player}> won the previous game.\n"
-                    )
-                    slack_msg += next_team_str
-                    slack_msg += BLANK_BOARD_STR
-                    respond(slack_msg, response_type="in_channel")
-                elif whether_won == TIE_STR:
-                    # I know using a string as an third boolean is very
-                    # silly - I'm sorry
-
-                    # reset the (database) board state
-                    reset_board_state()
-
-                    slack_msg += f"The previous game ended in a tie - nobody won.\n"
-                    slack_msg += last_move_by_str
-                    slack_msg += next_team_str
-                    slack_msg += BLANK_BOARD_STR
-                    respond(slack_msg, response_type="in_channel")
-                else:
-                    slack_msg += last_move_by_str
-                    slack_msg += next_team_str
-                    # add a tile and print out the new board
-                    update_board_state(row_num, col_num, curr_team)
-                    board_str = get_board_str(board_state)
-                    slack_msg += board_str
-                    respond(slack_msg, response_type="in_channel")
+def start_change_listener():
+    listener = ChangeListener(
+        os.environ["DATABASE_URL"], CHANGE_HANDLERS, reload_caches
+    )
+    listener.start()
+    # listen before the first load, so no change falls between the two
+    listener.listening.wait(timeout=10)
+
+
+def warm_up_database():
+    with startup.step("migrations"):
+        run_migrations()
+    if CHANGE_FEED_ENABLED:
+        with startup.step("change_listener"):
+            start_change_listener()
+    # every load borrows its own connection, so these warm up the pool too
+    startup.run_in_parallel(
+        {
+            "db_connections": prepare_pooled_connections,
+            "vote_tally": load_vote_tally_from_database,
+            "leaderboard": load_leaderboard_from_database,
+            "roster": load_roster_from_database,
+            "games": load_games_from_database,
+        }
+    )
+
+
+def start_up():
+    """Warm everything the first commands would otherwise load, then
+    start the background work and mark the app ready."""
+    # the Slack and CPU-bound steps don't need the database, so they run
+    # alongside it
+    startup.run_in_parallel(
+        {
+            "database": warm_up_database,
+            "user_directory": user_directory.load,
+            "position_table": get_position_table,
+        }
+    )
+    if VOTE_JOURNAL_PATH:
+        start_vote_journal()
+    threading.Thread(target=reconcile_vote_tally_periodically, daemon=True).start()
+    if REQUEST_DEDUP_DATABASE_ENABLED:
+        threading.Thread(target=prune_request_keys_periodically, daemon=True).start()
+    start_summary_logging()
+    startup.mark_ready()
 
 
 # Start your app
 if __name__ == "__main__":
-    # test_database_connection()
-    app.start(port=int(os.environ.get("PORT", 3000)))
-    print("started up the Bolt server")
+    log.info("app_starting")
+    threading.Thread(target=start_up, name="startup", daemon=True).start()
+    # serves /slack/events plus GET /metrics (Prometheus text format) and
+    # GET /ready, starting before the warm-up is done
+    server.start(app, port=int(os.environ.get("PORT", 3000)), startup=startup)
@@ -0,0 +1,1157 @@
+# first, so the time spent importing everything else is timed as startup
+from startup import Startup
+import asyncio
+import os
+import sqlite3
+import time
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+import asyncpg
+from aiohttp import web
+from slack_bolt import BoltResponse
+from slack_bolt.async_app import AsyncApp
+from slack_sdk import WebClient
+from slack_sdk.web.async_client import AsyncWebClient
+
+from change_feed import (
+    CHANGE_CHANNEL,
+    CHANGE_FEED_ENABLED,
+    CHANGE_FEED_RETRY_SECONDS,
+    GAME_CHANGE,
+    ROSTER_CHANGE,
+    VOTE_BATCH_CHANGE,
+    VOTE_CHANGE,
+    WIN_CHANGE,
+    apply_change,
+    encode_change,
+    get_game_change_fields,
+    get_game_from_change,
+)
+from commands import (
+    BAD_BOARD_SIZE_MSG,
+    BAD_MOVE_FORMAT_MSG,
+    BOARD_HEIGHT,
+    BOARD_WIDTH,
+    BUSY_MSG,
+    DAY_IN_PROGRESS_MSG,
+    KILL_STR,
+    MAIN_CHANNEL_NAME,
+    MODERATOR_ONLY_MSG,
+    MODERATOR_USER_IDS,
+    NO_DAY_IN_PROGRESS_MSG,
+    NO_DAY_RESULTS_MSG,
+    NOT_ON_ROSTER_MSG,
+    OUT_OF_BOUNDS_MSG,
+    PHASE_NOT_CHANGED_MSG,
+    PRAYER_STR,
+    RESTARTED_MSG,
+    TIC_TAC_BOT_CHANNEL_NAMES,
+    TIC_TAC_CHANNEL_NAMES,
+    VOTE_JOURNAL_BUSY_MSG,
+    VOTE_NOT_RECORDED_MSG,
+    VOTE_RESULTS_CHANNEL_NAME,
+    VOTE_TALLY_HEADER,
+    VOTES_NOT_APPLIED_MSG,
+    WIN_LENGTH,
+    WRONG_CHANNEL_MSG,
+    VoteType,
+    apply_move,
+    collapse_vote_operations,
+    format_day_results,
+    format_day_started,
+    format_hint,
+    format_roster,
+    format_roster_change,
+    format_scoreboard,
+    format_vote_operations_result,
+    format_vote_tally,
+    get_kill_target,
+    get_prayer_target,
+    get_vote_type_str,
+    parse_board_size,
+    parse_day_num,
+    parse_page_num,
+    parse_roster_command,
+    parse_vote_import,
+    parse_vote_operations,
+)
+from db import DB_POOL_MAX_CONN, DB_POOL_MIN_CONN, DB_POOL_TIMEOUT_SECONDS
+from leaderboard import Leaderboard
+from log import collect_log_metrics, configure_logging, get_logger, request_id_var
+from metrics import (
+    instrument_handler,
+    instrument_web_client,
+    registry,
+    start_summary_logging,
+    timed_query,
+)
+from migrate import migrate
+from position_table import get_position_table
+from prepared_statements import (
+    ADD_PLAYER,
+    CAST_VOTES,
+    CLAIM_REQUEST,
+    CLOSE_DAY,
+    COUNT_VOTES,
+    CREATE_GAME,
+    DAY_RESULTS,
+    DELETE_ALL_VOTES,
+    DELETE_VOTES,
+    END_DAY,
+    GET_GAME,
+    GET_OPEN_DAY,
+    LOAD_GAMES,
+    LOAD_PLAYERS,
+    LOAD_VOTES,
+    LOAD_WINS,
+    LOCK_GAME,
+    LOCK_OPEN_DAY,
+    PRUNE_REQUESTS,
+    RECORD_WIN,
+    SAVE_GAME,
+    SET_PLAYER_ALIVE,
+    START_DAY,
+)
+from request_dedup import (
+    REQUEST_DEDUP_DATABASE_ENABLED,
+    REQUEST_DEDUP_MAX_ENTRIES,
+    REQUEST_DEDUP_TTL_SECONDS,
+    RecentRequests,
+    get_request_key,
+    get_retry_reason,
+    record_repeated_request,
+)
+from roster import Roster
+from server import METRICS_PATH, READY_PATH, SLACK_EVENTS_PATH
+from slack_files import download_text_file
+from tally_publisher import TallyPublisher
+from tic_tac_game import GameCache, TicTacGame, TicTacMove, convert_move_enum_to_str
+from user_directory import UserDirectory
+from vote_journal import (
+    VOTE_JOURNAL_BATCH_SIZE,
+    VOTE_JOURNAL_DRAIN_SECONDS,
+    VOTE_JOURNAL_MAX_RETRY_SECONDS,
+    VOTE_JOURNAL_PATH,
+    VoteJournal,
+    VoteRejectedError,
+    collect_vote_journal_metrics,
+)
+from vote_tally import VoteTally
+from worker_pool import WORKER_QUEUE_SIZE
+
+# asyncio version of app.py: the same commands and replies, but every
+# request is a coroutine on one event loop instead of a thread blocked on
+# Postgres or Slack, so one dyno can hold hundreds of commands in flight
+#
+#     python async_app.py
+
+startup = Startup()
+configure_logging()
+log = get_logger("async_app")
+registry.add_collector(collect_log_metrics)
+
+# how often the in-memory vote tally is checked against the votes table
+VOTE_TALLY_RECONCILE_SECONDS = float(
+    os.environ.get("VOTE_TALLY_RECONCILE_SECONDS", 600)
+)
+
+leaderboard = Leaderboard()
+vote_tally = VoteTally()
+game_cache = GameCache()
+roster = Roster()
+
+# created on startup, see start_up
+db_pool = None
+db_pool_lock = asyncio.Lock()
+
+app = AsyncApp(
+    token=os.environ.get("SLACK_BOT_TOKEN"),
+    signing_secret=os.environ.get("SLACK_SIGNING_SECRET"),
+    client=(
+        AsyncWebClient(
+            token=os.environ.get("SLACK_BOT_TOKEN"),
+            base_url=os.environ["SLACK_API_URL"],
+        )
+        if os.environ.get("SLACK_API_URL")
+        else None
+    ),
+)
+instrument_web_client(app.client)
+
+# Slack retries a request when our ack is slow - see app.py
+recent_requests = RecentRequests(REQUEST_DEDUP_MAX_ENTRIES, REQUEST_DEDUP_TTL_SECONDS)
+
+# the debounced tally post and the user directory's full reloads already run
+# on their own background threads, so they keep the blocking client and never
+# hold up the event loop
+background_client = instrument_web_client(
+    WebClient(
+        token=os.environ.get("SLACK_BOT_TOKEN"),
+        base_url=os.environ.get("SLACK_API_URL") or WebClient.BASE_URL,
+    )
+)
+tally_publisher = TallyPublisher(
+    background_client,
+    VOTE_RESULTS_CHANNEL_NAME,
+    lambda: format_vote_tally(vote_tally),
+    VOTE_TALLY_HEADER,
+)
+user_directory = UserDirectory(background_client)
+
+
+async def get_db_pool():
+    global db_pool
+    # commands can arrive while startup is still creating it
+    async with db_pool_lock:
+        if db_pool is None:
+            db_pool = await asyncpg.create_pool(
+                os.environ["DATABASE_URL"],
+                min_size=DB_POOL_MIN_CONN,
+                max_size=DB_POOL_MAX_CONN,
+            )
+    return db_pool
+
+
+@asynccontextmanager
+async def get_connection():
+    """Borrow a pooled asyncpg connection for the duration of a with-block."""
+    db_pool = await get_db_pool()
+    async with db_pool.acquire(timeout=DB_POOL_TIMEOUT_SECONDS) as conn:
+        yield conn
+
+
+async def notify_change(conn, kind, *fields):
+    # same as change_feed.notify_change, for asyncpg connections
+    if CHANGE_FEED_ENABLED:
+        await timed_query(
+            conn.execute,
+            "SELECT pg_notify($1, $2);",
+            CHANGE_CHANNEL,
+            encode_change(kind, *fields),
+        )
+
+
+async def claim_request(key):
+    if not recent_requests.claim(key):
+        return False
+    if not REQUEST_DEDUP_DATABASE_ENABLED:
+        return True
+    try:
+        async with get_connection() as conn:
+            status = await timed_query(
+                conn.execute,
+                CLAIM_REQUEST.sql,
+                key,
+            )
+        return status == "INSERT 0 1"
+    except (Exception, asyncpg.PostgresError) as error:
+        # rather do a retry's work twice than drop a command
+        log.error("request_claim_failed", error=error)
+        return True
+
+
+@app.middleware
+async def bind_request_id(body, next):
+    # every log line written while handling this request carries its ID
+    request_id_var.set(get_request_key(body) or uuid.uuid4().hex)
+    return await next()
+
+
+@app.middleware
+async def wait_for_startup(next):
+    # see app.py - commands that arrive mid warm-up wait a moment for it
+    if not startup.is_ready():
+        await asyncio.to_thread(startup.wait_until_ready)
+    return await next()
+
+
+@app.middleware
+async def skip_repeated_requests(req, body, next):
+    key = get_request_key(body)
+    if key is None or await claim_request(key):
+        return await next()
+    record_repeated_request(key, get_retry_reason(req.headers))
+    return BoltResponse(status=200, body="")
+
+
+async def prune_request_keys_periodically():
+    # keys only matter for as long as Slack keeps retrying
+    while True:
+        await asyncio.sleep(REQUEST_DEDUP_TTL_SECONDS)
+        try:
+            async with get_connection() as conn:
+                await timed_query(
+                    conn.execute,
+                    PRUNE_REQUESTS.sql,
+                    REQUEST_DEDUP_TTL_SECONDS,
+                )
+        except (Exception, asyncpg.PostgresError) as error:
+            log.error("request_prune_failed", error=error)
+
+
+# post-ack work for one channel runs in the order the commands arrived,
+# the way worker_pool.py does for app.py
+channel_locks = defaultdict(asyncio.Lock)
+channel_backlog = defaultdict(int)
+# asyncio only keeps weak references to tasks
+background_tasks = set()
+
+
+async def run_in_channel_order(channel_id, func, args):
+    try:
+        async with channel_locks[channel_id]:
+            await func(*args)
+    except Exception as error:
+        registry.inc("worker_pool_errors_total")
+        log.exception("background_work_failed", function=func.__name__, error=error)
+    finally:
+        channel_backlog[channel_id] -= 1
+
+
+async def run_after_ack(channel_id, respond, func, *args):
+    """Schedule func behind earlier work for the same channel.
+
+    Returns False (after telling the player) if too much is already waiting.
+    """
+    if channel_backlog[channel_id] >= WORKER_QUEUE_SIZE:
+        registry.inc("worker_pool_rejected_total")
+        await respond(BUSY_MSG)
+        return False
+    channel_backlog[channel_id] += 1
+    registry.inc("worker_pool_submitted_total")
+    task = asyncio.create_task(run_in_channel_order(channel_id, func, args))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return True
+
+
+def collect_backlog_metrics():
+    return [("worker_pool_queue_depth", (), sum(channel_backlog.values()))]
+
+
+registry.add_collector(collect_backlog_metrics)
+
+
+async def translate_user_id_to_name(user_id):
+    name = user_directory.get_cached_name(user_id)
+    if name is None:
+        # first sight of this user - the lookup blocks, so do it off the loop
+        name = await asyncio.to_thread(user_directory.get_name, user_id)
+    # an unknown voter keeps their own row, under their ID
+    return (user_id, name or user_id)
+
+
+async def write_votes_to_database(votes):
+    """insert [(voter_id, target_name, vote_type, cast_at)] into the votes
+    table in one transaction, returning whether it committed - raises
+    VoteRejectedError if Postgres rejected the votes themselves"""
+    try:
+        # the name lookup can call Slack, so it fails like the write does
+        latest_votes = {}
+        for voter_id, target_name, vote_type, cast_at in votes:
+            voter_user_id, voter_name = await translate_user_id_to_name(voter_id)
+            latest_votes[voter_user_id] = (
+                target_name,
+                voter_name,
+                vote_type,
+                voter_user_id,
+                cast_at,
+            )
+        columns = [list(column) for column in zip(*latest_votes.values())]
+        async with get_connection() as conn:
+            async with conn.transaction():
+                applied = await timed_query(conn.fetch, CAST_VOTES.sql, *columns)
+                for voter_user_id, vote_type, target_name in applied:
+                    await notify_change(
+                        conn, VOTE_CHANGE, voter_user_id, vote_type, target_name
+                    )
+    except (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError) as error:
+        log.error("votes_rejected", error=error)
+        raise VoteRejectedError(error) from error
+    except (Exception, asyncpg.PostgresError) as error:
+        log.error("votes_not_written", error=error)
+        return False
+    # only mirror votes that actually made it into the table - with the
+    # change feed on, the listener applies them in commit order instead
+    if not CHANGE_FEED_ENABLED:
+        for voter_user_id, vote_type, target_name in applied:
+            vote_tally.record_vote(voter_user_id, target_name, vote_type)
+    return True
+
+
+async def cast_vote_to_database(voter_id, target_name, vote_type):
+    try:
+        await write_votes_to_database(
+            [(voter_id, target_name, get_vote_type_str(vote_type), time.time())]
+        )
+    except VoteRejectedError:
+        # already logged - without the journal there's nowhere to keep it
+        pass
+
+
+async def flush_journaled_votes(votes):
+    if not await write_votes_to_database(votes):
+        return False
+    tally_publisher.publish()
+    return True
+
+
+async def load_vote_tally_from_database():
+    """rebuild the in-memory vote tally from the votes table"""
+    try:
+        async with get_connection() as conn:
+            rows = await timed_query(conn.fetch, LOAD_VOTES.sql)
+        vote_tally.load([tuple(row) for row in rows])
+        log.info("vote_tally_loaded")
+    except (Exception, asyncpg.PostgresError) as error:
+        log.error("vote_tally_load_failed", error=error)
+
+
+async def reconcile_vote_tally():
+    """compare the in-memory tally with the database aggregate, reloading on mismatch"""
+    try:
+        async with get_connection() as conn:
+            rows = await timed_query(conn.fetch, COUNT_VOTES.sql)
+    except (Exception, asyncpg.PostgresError) as error:
+        log.error("vote_tally_reconcile_failed", error=error)
+        return
+
+    for vote_type in [PRAYER_STR, KILL_STR]:
+        database_counts = {
+            target_name: count
+            for row_vote_type, target_name, count in rows
+            if row_vote_type == vote_type
+        }
+        if database_counts != vote_tally.get_counts(vote_type):
+            log.warning("vote_tally_drifted", vote_type=vote_type)
+            await load_vote_tally_from_database()
+            return
+
+
+async def reconcile_vote_tally_periodically():
+    while True:
+        await asyncio.sleep(VOTE_TALLY_RECONCILE_SECONDS)
+        await reconcile_vote_tally()
+
+
+async def load_leaderboard_from_database():
+    """rebuild the in-memory leaderboard from the tic_tac_win table"""
+    try:
+        async with get_connection() as conn:
+            rows = await timed_query(conn.fetch, LOAD_WINS.sql)
+        leaderboard.load([tuple(row) for row in rows])
+        log.info("leaderboard_loaded")
+    except (Exception, asyncpg.PostgresError) as error:
+        log.error("leaderboard_load_failed", error=error)
+
+
+@app.event("app_mention")
+@instrument_handler
+async def action_button_click(event, say):
+    await say("dude what do you want")
+
+
+@app.event("user_change")
+@instrument_handler
+async def handle_user_change(event):
+    user_directory.update_user(event["user"])
+
+
+@app.event("team_join")
+@instrument_handler
+async def handle_team_join(event):
+    user_directory.update_user(event["user"])
+
+
+# set on startup unless VOTE_JOURNAL_PATH is empty, see init_app
+vote_journal = None
+
+
+async def submit_vote(channel_id, respond, voter_id, target_name, vote_type):
+    """Journal a vote, or schedule its database write when there's no journal.
+
+    Returns False (after telling the player) if the vote wasn't taken.
+    """
+    if vote_journal is None:
+        update = update_kill_vote if vote_type == VoteType.KILL else update_prayer
+        return await run_after_ack(channel_id, respond, update, voter_id, target_name)
+    try:
+        # the append waits on an fsync, so it runs off the loop
+        await asyncio.to_thread(
+            vote_journal.append, voter_id, target_name, get_vote_type_str(vote_type)
+        )
+    except sqlite3.Error as error:
+        log.error("vote_not_journaled", error=error)
+        await respond(VOTE_NOT_RECORDED_MSG)
+        return False
+    return True
+
+
+async def update_kill_vote(voting_player, target_player):
+    await cast_vote_to_database(voting_player, target_player, VoteType.KILL)
+    tally_publisher.publish()
+
+
+@app.command("/kill")
+@instrument_handler
+async def handle_kill_vote(ack, respond, command):
+    await ack()
+    voting_player = command["user_id"]
+    if command["channel_name"] != MAIN_CHANNEL_NAME:
+        await respond(WRONG_CHANNEL_MSG)
+        return
+
+    if not roster.loaded:
+        await load_roster_from_database()
+    user_to_kill, error_msg = get_kill_target(command["text"], roster)
+    if error_msg is not None:
+        await respond(error_msg)
+        return
+
+    if await submit_vote(
+        command["channel_id"],
+        respond,
+        voting_player,
+        user_to_kill,
+        VoteType.KILL,
+    ):
+        await respond(
+            f"<@{voting_player}> has voted to kill {user_to_kill}",
+            response_type="in_channel",
+        )
+
+
+async def update_prayer(praying_player, prayer_target):
+    await cast_vote_to_database(praying_player, prayer_target, VoteType.PRAYER)
+    tally_publisher.publish()
+
+
+@app.command("/prayto")
+@instrument_handler
+async def handle_prayer(ack, respond, command):
+    await ack()
+    praying_player = command["user_id"]
+
+    # no check for which channel because praying is allowed anywhere
+    if not roster.loaded:
+        await load_roster_from_database()
+    prayer_target, error_msg = get_prayer_target(command["text"], roster)
+    if error_msg is not None:
+        await respond(error_msg)
+        return
+
+    if await submit_vote(
+        command["channel_id"],
+        respond,
+        praying_player,
+        prayer_target,
+        VoteType.PRAYER,
+    ):
+        await respond(
+            f"<@{praying_player}> is praying to {prayer_target}",
+            response_type="in_channel",
+        )
+
+
+@app.command("/roster")
+@instrument_handler
+async def handle_roster(ack, respond, command):
+    await ack()
+    if command["user_id"] not in MODERATOR_USER_IDS:
+        await respond(MODERATOR_ONLY_MSG)
+        return
+
+    action, player_id, role, error_msg = parse_roster_command(command["text"])
+    if error_msg is not None:
+        await respond(error_msg)
+        return
+    if action is None:
+        if not roster.loaded:
+            await load_roster_from_database()
+        await respond(format_roster(roster))
+        return
+
+    await run_after_ack(
+        command["channel_id"], respond, update_roster, action, player_id, role, respond
+    )
+
+
+@app.command("/modvotes")
+@instrument_handler
+async def handle_moderator_votes(ack, respond, command):
+    await ack()
+    if command["user_id"] not in MODERATOR_USER_IDS:
+        await respond(MODERATOR_ONLY_MSG)
+        return
+
+    if not roster.loaded:
+        await load_roster_from_database()
+    file_id = parse_vote_import(command["text"])
+    if file_id is not None:
+        await run_after_ack(
+            command["channel_id"], respond, import_vote_operations, file_id, respond
+        )
+        return
+
+    operations, error_msg = parse_vote_operations(command["text"], roster)
+    if error_msg is not None:
+        await respond(error_msg)
+        return
+    await run_after_ack(
+        command["channel_id"], respond, apply_vote_operations, operations, respond
+    )
+
+
+async def import_vote_operations(file_id, respond):
+    try:
+        text = await asyncio.to_thread(download_text_file, background_client, file_id)
+    except Exception as error:
+        log.error("vote_import_failed", error=error)
+        await respond(f"Couldn't read that file: {error}")
+        return
+    operations, error_msg = parse_vote_operations(text, roster)
+    if error_msg is not None:
+        await respond(error_msg)
+        return
+    await apply_vote_operations(operations, respond)
+
+
+async def apply_vote_operations(operations, respond):
+    clear_all, removed_voter_ids, votes = collapse_vote_operations(operations)
+    # a journaled vote written after this would undo a clear or a removal
+    if vote_journal is not None and not await asyncio.to_thread(
+        vote_journal.wait_until_empty, VOTE_JOURNAL_DRAIN_SECONDS
+    ):
+        await respond(VOTE_JOURNAL_BUSY_MSG)
+        return
+
+    cast_at = time.time()
+    rows = [
+        (
+            target_name,
+            user_directory.get_cached_name(voter_id) or voter_id,
+            vote_type,
+            voter_id,
+            cast_at,
+        )
+        for voter_id, (vote_type, target_name) in votes.items()
+    ]
+    try:
+        async with get_connection() as conn:
+            async with conn.transaction():
+                if clear_all:
+                    await timed_query(conn.execute, DELETE_ALL_VOTES.sql)
+                elif removed_voter_ids:
+                    await timed_query(
+                        conn.execute, DELETE_VOTES.sql, list(removed_voter_ids)
+                    )
+                if rows:
+                    columns = [list(column) for column in zip(*rows)]
+                    await timed_query(conn.fetch, CAST_VOTES.sql, *columns)
+                await notify_change(conn, VOTE_BATCH_CHANGE)
+    except (Exception, asyncpg.PostgresError) as error:
+        log.error("vote_operations_failed", error=error)
+        await respond(VOTES_NOT_APPLIED_MSG)
+        return
+
+    # one tally reload and one tally post for the whole batch
+    if not CHANGE_FEED_ENABLED:
+        await load_vote_tally_from_database()
+    tally_publisher.publish()
+    await respond(format_vote_operations_result(clear_all, removed_voter_ids, votes))
+
+
+async def update_roster(action, player_id, role, respond):
+    if action == "add":
+        statement, params = ADD_PLAYER, [player_id, role]
+    else:
+        statement, params = SET_PLAYER_ALIVE, [action == "revive", player_id]
+    try:
+        async with get_connection() as conn:
+            async with conn.transaction():
+                row = await timed_query(conn.fetchrow, statement.sql, *params)
+                if row is not None:
+                    role, alive = row
+                    await notify_change(conn, ROSTER_CHANGE, player_id, role, alive)
+    except (Exception, asyncpg.PostgresError) as error:
+        log.error("roster_update_failed", error=error)
+        return
+
+    if row is None:
+        await respond(NOT_ON_ROSTER_MSG)
+        return
+    if not CHANGE_FEED_ENABLED:
+        roster.set_player(player_id, role, alive)
+    await respond(format_roster_change(player_id, role, alive))
+
+
+async def load_roster_from_database():
+    """rebuild the in-memory roster from the players table"""
+    try:
+        async with get_connection() as conn:
+            rows = await timed_query(conn.fetch, LOAD_PLAYERS.sql)
+        roster.load([tuple(row) for row in rows])
+        log.info("roster_loaded")
+    except (Exception, asyncpg.PostgresError) as error:
+        log.error("roster_load_failed", error=error)
+
+
+@app.command("/startday")
+@instrument_handler
+async def handle_start_day(ack, respond, command):
+    await ack()
+    if command["user_id"] not in MODERATOR_USER_IDS:
+        await respond(MODERATOR_ONLY_MSG)
+        return
+    await run_after_ack(command["channel_id"], respond, start_day, respond)
+
+
+@app.command("/endday")
+@instrument_handler
+async def handle_end_day(ack, respond, command):
+    await ack()
+    if command["user_id"] not in MODERATOR_USER_IDS:
+        await respond(MODERATOR_ONLY_MSG)
+        return
+    await run_after_ack(command["channel_id"], respond, end_day, respond)
+
+
+@app.command("/dayresults")
+@instrument_handler
+async def handle_day_results(ack, respond, command):
+    await ack()
+    day_num = parse_day_num(command["text"])
+    await run_after_ack(
+        command["channel_id"], respond, show_day_results, day_num, respond
+    )
+
+
+async def start_day(respond):
+    try:
+        async with get_connection() as conn:
+            async with conn.transaction():
+                open_day_num = await timed_query(conn.fetchval, GET_OPEN_DAY.sql)
+                if open_day_num is not None:
+                    await respond(DAY_IN_PROGRESS_MSG)
+                    return
+                day_num = await timed_query(conn.fetchval, START_DAY.sql)
+                await timed_query(
+                    conn.execute,
+                    f"""CREATE TABLE IF NOT EXISTS votes_history_day_{day_num}
+                        PARTITION OF votes_history FOR VALUES IN ({day_num});""",
+                )
+    except (Exception, asyncpg.PostgresError) as error:
+        log.error("day_start_failed", error=error)
+        await respond(PHASE_NOT_CHANGED_MSG)
+        return
+    await respond(format_day_started(day_num), response_type="in_channel")
+
+
+async def end_day(respond):
+    if vote_journal is not None and not await asyncio.to_thread(
+        vote_journal.wait_until_empty, VOTE_JOURNAL_DRAIN_SECONDS
+    ):
+        await respond(VOTE_JOURNAL_BUSY_MSG)
+        return
+
+    try:
+        async with get_connection() as conn:
+            async with conn.transaction():
+                day_num = await timed_query(conn.fetchval, LOCK_OPEN_DAY.sql)
+                if day_num is None:
+                    await respond(NO_DAY_IN_PROGRESS_MSG)
+                    return
+                rows = await timed_query(conn.fetch, END_DAY.sql, day_num)
+                await timed_query(conn.execute, CLOSE_DAY.sql, day_num)
+                await notify_change(conn, VOTE_BATCH_CHANGE)
+    except (Exception, asyncpg.PostgresError) as error:
+        log.error("day_end_failed", error=error)
+        await respond(PHASE_NOT_CHANGED_MSG)
+        return
+
+    await load_vote_tally_from_database()
+    await asyncio.to_thread(tally_publisher.flush)
+    results = [tuple(row) for row in rows]
+    await respond(format_day_results(day_num, results), response_type="in_channel")
+
+
+async def show_day_results(day_num, respond):
+    try:
+        async with get_connection() as conn:
+            rows = await timed_query(conn.fetch, DAY_RESULTS.sql, day_num)
+    except (Exception, asyncpg.PostgresError) as error:
+        log.error("day_results_failed", error=error)
+        return
+    if not rows:
+        await respond(NO_DAY_RESULTS_MSG)
+        return
+    results = [tuple(row)[1:] for row in rows if row["vote_type"] is not None]
+    await respond(format_day_results(rows[0]["day_num"], results))
+
+
+@app.command("/tictacmove")
+@instrument_handler
+async def handle_tictacmove(ack, respond, command, context):
+    await ack()
+    if command["channel_name"] not in TIC_TAC_CHANNEL_NAMES:
+        await respond(WRONG_CHANNEL_MSG)
+        return
+    move_data = command["text"].split()
+    if len(move_data) != 2:
+        await respond(BAD_MOVE_FORMAT_MSG)
+        return
+    row_num = int(move_data[0])
+    col_num = int(move_data[1])
+    if row_num < 0 or col_num < 0:
+        await respond(OUT_OF_BOUNDS_MSG)
+        return
+
+    bot_user_id = None
+    if command["channel_name"] in TIC_TAC_BOT_CHANNEL_NAMES:
+        bot_user_id = context.bot_user_id
+    await run_after_ack(
+        command["channel_id"],
+        respond,
+        make_tic_tac_toe_move,
+        command["channel_id"],
+        command["user_id"],
+        row_num,
+        col_num,
+        respond,
+        bot_user_id,
+    )
+
+
+@app.command("/tictachint")
+@instrument_handler
+async def handle_tic_tac_hint(ack, respond, command):
+    await ack()
+    if command["channel_name"] not in TIC_TAC_CHANNEL_NAMES:
+        await respond(WRONG_CHANNEL_MSG)
+        return
+
+    game = game_cache.get(command["channel_id"])
+    if game is None:
+        try:
+            async with get_connection() as conn:
+                game = await lock_and_get_game(conn, command["channel_id"], lock=False)
+        except (Exception, asyncpg.PostgresError) as error:
+            log.error("game_load_failed", error=error)
+            return
+        game_cache.store(game)
+    await respond(format_hint(game))
+
+
+@app.command("/restart-tic-tac")
+@instrument_handler
+async def handle_tic_tac_restart(ack, respond, command):
+    await ack()
+    if command["channel_name"] not in TIC_TAC_CHANNEL_NAMES:
+        await respond(WRONG_CHANNEL_MSG)
+        return
+
+    board_size, valid = parse_board_size(command["text"])
+    if not valid:
+        await respond(BAD_BOARD_SIZE_MSG)
+        return
+
+    if await run_after_ack(
+        command["channel_id"], respond, restart_game, command["channel_id"], board_size
+    ):
+        await respond(RESTARTED_MSG)
+
+
+async def restart_game(game_id, board_size):
+    try:
+        async with get_connection() as conn:
+            async with conn.transaction():
+                game = await lock_and_get_game(conn, game_id)
+                if board_size is not None:
+                    game.height, game.width, game.win_length = board_size
+                game.reset(TicTacMove.X)
+                await update_board_state(conn, game)
+        game_cache.store(game)
+        log.info("game_reset", game_id=game_id)
+    except (Exception, asyncpg.PostgresError) as error:
+        log.error("game_restart_failed", error=error)
+
+
+@app.command("/tictacscoreboard")
+@instrument_handler
+async def handle_tic_tac_scoreboard(ack, respond, command):
+    await ack()
+    page_num = parse_page_num(command["text"])
+    if not leaderboard.loaded:
+        await load_leaderboard_from_database()
+    await respond(format_scoreboard(leaderboard, page_num, command["user_id"]))
+
+
+# app.py's prepared statements, run as plain SQL - asyncpg prepares and
+# caches every statement itself. It can't send parameters with a
+# multi-statement string, so the insert and select in lock_and_get_game are
+# two round trips inside the caller's transaction
+async def lock_and_get_game(conn, game_id, lock=True):
+    blank_game = TicTacGame(game_id, BOARD_HEIGHT, BOARD_WIDTH, WIN_LENGTH)
+    await timed_query(
+        conn.execute,
+        CREATE_GAME.sql,
+        game_id,
+        blank_game.height,
+        blank_game.width,
+        blank_game.win_length,
+        blank_game.packed_cells(),
+        convert_move_enum_to_str(blank_game.curr_team),
+    )
+    get_game = LOCK_GAME if lock else GET_GAME
+    row = await timed_query(conn.fetchrow, get_game.sql, game_id)
+    return TicTacGame.from_row(game_id, tuple(row))
+
+
+async def update_board_state(conn, game):
+    """write the whole game back as one row"""
+    await timed_query(
+        conn.execute,
+        SAVE_GAME.sql,
+        game.height,
+        game.width,
+        game.win_length,
+        game.packed_cells(),
+        convert_move_enum_to_str(game.curr_team),
+        game.move_count,
+        game.game_id,
+    )
+    game.version += 1
+    await notify_change(conn, GAME_CHANGE, game.game_id, *get_game_change_fields(game))
+
+
+async def record_win(conn, player):
+    """record 1 additional tic tac toe win for player, returning their new total"""
+    num_wins = await timed_query(conn.fetchval, RECORD_WIN.sql, player)
+    await notify_change(conn, WIN_CHANGE, player, num_wins)
+
+    log.info("win_recorded", player=player, num_wins=num_wins)
+    return num_wins
+
+
+async def make_tic_tac_toe_move(
+    game_id, player, row_num, col_num, respond, bot_user_id=None
+):
+    win_totals = []
+    try:
+        async with get_connection() as conn:
+            # the whole move is one transaction holding the game row's lock
+            async with conn.transaction():
+                game = await lock_and_get_game(conn, game_id)
+                error_msg, slack_msg, winners = apply_move(
+                    game, player, row_num, col_num, bot_user_id
+                )
+                if error_msg is None:
+                    for winner in winners:
+                        win_totals.append((winner, await record_win(conn, winner)))
+                    await update_board_state(conn, game)
+    except (Exception, asyncpg.PostgresError) as error:
+        log.error("move_failed", error=error)
+        return
+
+    # only wins that were actually committed reach the leaderboard
+    for winner, num_wins in win_totals:
+        leaderboard.set_wins(winner, num_wins)
+    game_cache.store(game)
+
+    if error_msg is not None:
+        await respond(error_msg)
+        return
+    await respond(slack_msg, response_type="in_channel")
+
+
+def apply_vote_change(voter_user_id, vote_type, target_name):
+    vote_tally.record_vote(voter_user_id, target_name, vote_type)
+
+
+def apply_game_change(game_id, *fields):
+    game_cache.store(get_game_from_change(game_id, *fields))
+
+
+def apply_vote_batch_change():
+    # listener callbacks can't wait, so the reload runs as its own task
+    task = asyncio.create_task(load_vote_tally_from_database())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+# every handler is safe to replay - see change_feed.apply_change
+CHANGE_HANDLERS = {
+    VOTE_CHANGE: apply_vote_change,
+    WIN_CHANGE: leaderboard.set_wins,
+    GAME_CHANGE: apply_game_change,
+    ROSTER_CHANGE: roster.set_player,
+    VOTE_BATCH_CHANGE: apply_vote_batch_change,
+}
+
+
+async def listen_for_changes(listening):
+    # the asyncpg counterpart of change_feed.ChangeListener
+    connected_before = False
+    while True:
+        try:
+            conn = await asyncpg.connect(os.environ["DATABASE_URL"])
+            closed = asyncio.Event()
+            conn.add_termination_listener(lambda conn: closed.set())
+            await conn.add_listener(
+                CHANGE_CHANNEL,
+                lambda conn, pid, channel, payload: apply_change(
+                    payload, CHANGE_HANDLERS
+                ),
+            )
+            if connected_before:
+                # changes sent while we were disconnected were lost
+                await load_vote_tally_from_database()
+                await load_leaderboard_from_database()
+                await load_roster_from_database()
+                game_cache.clear()
+            connected_before = True
+            listening.set()
+            log.info("change_listener_started", channel=CHANGE_CHANNEL)
+            await closed.wait()
+            log.error("change_listener_disconnected")
+        except (Exception, asyncpg.PostgresError) as error:
+            log.error("change_listener_disconnected", error=error)
+        listening.clear()
+        await asyncio.sleep(CHANGE_FEED_RETRY_SECONDS)
+
+
+async def handle_metrics(request):
+    return web.Response(
+        text=registry.render(), headers={"Content-Type": "text/plain; version=0.0.4"}
+    )
+
+
+async def handle_ready(request):
+    if startup.is_ready():
+        return web.Response(text="ready")
+    return web.Response(status=503, text="starting")
+
+
+def start_vote_journal(loop):
+    global vote_journal
+
+    # the journal's flusher is a thread, so it hands each batch to the loop
+    def flush_batch(votes):
+        return asyncio.run_coroutine_threadsafe(
+            flush_journaled_votes(votes), loop
+        ).result()
+
+    vote_journal = VoteJournal(
+        VOTE_JOURNAL_PATH,
+        flush_batch,
+        VOTE_JOURNAL_BATCH_SIZE,
+        VOTE_JOURNAL_MAX_RETRY_SECONDS,
+    )
+    registry.add_collector(collect_vote_journal_metrics(vote_journal))
+    vote_journal.start()
+
+
+async def load_games_from_database():
+    """fill the game cache with every channel's game"""
+    try:
+        async with get_connection() as conn:
+            rows = await timed_query(conn.fetch, LOAD_GAMES.sql)
+        for row in rows:
+            game_cache.store(TicTacGame.from_row(row[0], tuple(row)[1:]))
+        log.info("games_loaded", num_games=len(rows))
+    except (Exception, asyncpg.PostgresError) as error:
+        log.error("games_load_failed", error=error)
+
+
+async def run_migrations():
+    # see migrations/ - uses psycopg2, so it runs on a thread
+    try:
+        await asyncio.to_thread(migrate, os.environ["DATABASE_URL"])
+    except Exception as error:
+        log.error("migrations_failed", error=error)
+
+
+async def warm_up_database(web_app):
+    # the pool opens its DB_POOL_MIN_CONN connections while migrations run
+    await startup.run_concurrently(
+        {"db_connections": get_db_pool(), "migrations": run_migrations()}
+    )
+    if CHANGE_FEED_ENABLED:
+        with startup.step("change_listener"):
+            # listen before the first load, so no change falls between the two
+            listening = asyncio.Event()
+            web_app["background_tasks"]["change_listener"] = asyncio.create_task(
+                listen_for_changes(listening)
+            )
+            try:
+                await asyncio.wait_for(listening.wait(), timeout=10)
+            except asyncio.TimeoutError:
+                log.warning("change_listener_not_ready")
+    await startup.run_concurrently(
+        {
+            "vote_tally": load_vote_tally_from_database(),
+            "leaderboard": load_leaderboard_from_database(),
+            "roster": load_roster_from_database(),
+            "games": load_games_from_database(),
+        }
+    )
+
+
+async def start_up(web_app):
+    """Warm everything the first commands would otherwise load, then
+    start the background work and mark the app ready."""
+    # the position table and the user directory are built with blocking
+    # code, so they run on threads alongside the database steps
+    await startup.run_concurrently(
+        {
+            "database": warm_up_database(web_app),
+            "user_directory": asyncio.to_thread(user_directory.load),
+            "position_table": asyncio.to_thread(get_position_table),
+        }
+    )
+    if VOTE_JOURNAL_PATH:
+        start_vote_journal(asyncio.get_running_loop())
+    background_tasks = web_app["background_tasks"]
+    background_tasks["reconcile"] = asyncio.create_task(
+        reconcile_vote_tally_periodically()
+    )
+    if REQUEST_DEDUP_DATABASE_ENABLED:
+        background_tasks["prune_requests"] = asyncio.create_task(
+            prune_request_keys_periodically()
+        )
+    start_summary_logging()
+    startup.mark_ready()
+
+
+async def init_app(web_app):
+    # name -> task, cancelled on shutdown - filled in by start_up, since
+    # the app can't be changed once it's running
+    web_app["background_tasks"] = {}
+    # warm up behind the server rather than before it starts listening
+    web_app["background_tasks"]["startup"] = asyncio.create_task(start_up(web_app))
+
+
+async def close_app(web_app):
+    for task in web_app["background_tasks"].values():
+        task.cancel()
+    if db_pool is not None:
+        await db_pool.close()
+
+
+def make_web_app():
+    # Bolt's aiohttp app serves /slack/events - GET /metrics and GET /ready
+    # are added to it
+    web_app = app.web_app(path=SLACK_EVENTS_PATH)
+    web_app.add_routes(
+        [web.get(METRICS_PATH, handle_metrics), web.get(READY_PATH, handle_ready)]
+    )
+    web_app.on_startup.append(init_app)
+    web_app.on_cleanup.append(close_app)
+    return web_app
+
+
+if __name__ == "__main__":
+    log.info("app_starting")
+    web.run_app(make_web_app(), port=int(os.environ.get("PORT", 3000)))
@@ -0,0 +1,87 @@
+import sys
+import timeit
+
+# (row step, column step) for horizontal, vertical and both diagonals
+DIRECTIONS = [(0, 1), (1, 0), (1, 1), (1, -1)]
+
+
+class WinDetector:
+    """Win/tie detection for an N x M board with k-in-a-row wins.
+
+    Each player's tiles are an int with bit (row * width + col) set. Every
+    k-long line on the board is precomputed as a mask and indexed by the
+    cells it covers, so checking a move only looks at the (at most 4 * k)
+    lines through that move - the cost doesn't grow with the board.
+    """
+
+    def __init__(self, height, width, win_length):
+        if win_length > max(height, width):
+            raise ValueError(
+                f"a {height}x{width} board can't fit {win_length} in a row"
+            )
+        self.height = height
+        self.width = width
+        self.win_length = win_length
+        self.num_cells = height * width
+        self.full_mask = (1 << self.num_cells) - 1
+        self.lines_through_cell = [[] for _ in range(self.num_cells)]
+        for row in range(height):
+            for col in range(width):
+                for row_step, col_step in DIRECTIONS:
+                    self._add_line(row, col, row_step, col_step)
+
+    def _add_line(self, row, col, row_step, col_step):
+        cells = []
+        for i in range(self.win_length):
+            r = row + i * row_step
+            c = col + i * col_step
+            if not (0 <= r < self.height and 0 <= c < self.width):
+                return
+            cells.append(r * self.width + c)
+        mask = 0
+        for cell in cells:
+            mask |= 1 << cell
+        for cell in cells:
+            self.lines_through_cell[cell].append(mask)
+
+    def is_win(self, player_bits, last_index):
+        # only lines through the last move can have just been completed
+        for mask in self.lines_through_cell[last_index]:
+            if player_bits & mask == mask:
+                return True
+        return False
+
+    def is_full(self, x_bits, o_bits):
+        return (x_bits | o_bits).bit_count() == self.num_cells
+
+
+def benchmark(sizes, number=100000):
+    """Time the whole win/tie check (check_for_win) for a move in the middle
+    of increasingly large boards, as a game does it after placing the tile."""
+    # tic_tac_game imports this module
+    from tic_tac_game import TicTacGame, TicTacMove, check_for_win
+
+    results = []
+    for height, width, win_length in sizes:
+        game = TicTacGame("bench", height, width, win_length)
+        middle = (height // 2) * width + width // 2
+        # a scattered, non-winning position so every line has to be checked
+        for i in range(0, height * width, 3):
+            game.place(i, TicTacMove.X)
+        game.place(middle, TicTacMove.X)
+        detector = game.win_detector
+        seconds = timeit.timeit(
+            lambda: check_for_win(game.x_bits, game.o_bits, middle, detector),
+            number=number,
+        )
+        results.append((height, width, win_length, seconds / number))
+    return results
+
+
+if __name__ == "__main__":
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    sizes = [(3, 3, 3), (7, 7, 4), (15, 15, 5), (31, 31, 5), (63, 63, 5)]
+    for height, width, win_length, per_check in benchmark(sizes, number):
+        print(
+            f"{height}x{width}, {win_length} in a row: {per_check * 1e9:.0f} ns per move check"
+        )
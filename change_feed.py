@@ -0,0 +1,124 @@
+import json
+import os
+import select
+import threading
+import time
+
+import psycopg2
+
+from log import get_logger
+from tic_tac_game import TicTacGame
+
+log = get_logger("change_feed")
+
+# turn on when running more than one web dyno - every write is then
+# broadcast so each process can keep its in-memory caches current
+CHANGE_FEED_ENABLED = os.environ.get("CHANGE_FEED_ENABLED", "0") == "1"
+CHANGE_CHANNEL = "app_changes"
+# an idle listener checks its connection this often
+CHANGE_FEED_IDLE_SECONDS = 30
+CHANGE_FEED_RETRY_SECONDS = 5
+
+VOTE_CHANGE = "vote"
+WIN_CHANGE = "win"
+GAME_CHANGE = "game"
+ROSTER_CHANGE = "roster"
+# many votes changed at once (/modvotes) - reload the tally
+VOTE_BATCH_CHANGE = "vote_batch"
+
+
+def encode_change(kind, *fields):
+    # NOTIFY payloads are capped at 8000 bytes - a 400 square board is
+    # about 200 of them
+    return json.dumps([kind, *fields], separators=(",", ":"))
+
+
+def get_game_change_fields(game):
+    height, width, win_length, cells, curr_team, move_count, version = game.to_row()
+    return [height, width, win_length, cells.hex(), curr_team, move_count, version]
+
+
+def get_game_from_change(
+    game_id, height, width, win_length, cells_hex, curr_team, move_count, version
+):
+    cells = bytes.fromhex(cells_hex)
+    row = (height, width, win_length, cells, curr_team, move_count, version)
+    return TicTacGame.from_row(game_id, row)
+
+
+def notify_change(cur, kind, *fields):
+    """Queue a change notification in cur's transaction.
+
+    Postgres only delivers it if the transaction commits, and delivers
+    notifications in commit order.
+    """
+    if not CHANGE_FEED_ENABLED:
+        return
+    cur.execute(
+        "SELECT pg_notify(%s, %s);", [CHANGE_CHANNEL, encode_change(kind, *fields)]
+    )
+
+
+def apply_change(payload, handlers):
+    """Pass a notification's fields to handlers[kind].
+
+    Every handler must be idempotent, since a process also hears about the
+    changes it made itself.
+    """
+    try:
+        kind, *fields = json.loads(payload)
+        handler = handlers[kind]
+    except (ValueError, KeyError) as error:
+        log.warning("unknown_change_ignored", payload=payload, error=error)
+        return
+    handler(*fields)
+
+
+class ChangeListener:
+    """Background thread that LISTENs for changes on its own connection.
+
+    Notifications sent while the connection is down are lost, so
+    on_reconnect is called (to reload the caches) every time the listener
+    reconnects after the first connection.
+    """
+
+    def __init__(self, dsn, handlers, on_reconnect):
+        self._dsn = dsn
+        self._handlers = handlers
+        self._on_reconnect = on_reconnect
+        self.listening = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name="change-listener", daemon=True).start()
+
+    def _run(self):
+        connected_before = False
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self._dsn)
+                conn.autocommit = True
+                cur = conn.cursor()
+                cur.execute(f"LISTEN {CHANGE_CHANNEL};")
+                if connected_before:
+                    self._on_reconnect()
+                connected_before = True
+                self.listening.set()
+                log.info("change_listener_started", channel=CHANGE_CHANNEL)
+                while True:
+                    readable, _, _ = select.select(
+                        [conn], [], [], CHANGE_FEED_IDLE_SECONDS
+                    )
+                    if not readable:
+                        # nothing for a while - make sure the connection is alive
+                        cur.execute("SELECT 1;")
+                    conn.poll()
+                    while conn.notifies:
+                        apply_change(conn.notifies.pop(0).payload, self._handlers)
+            except (Exception, psycopg2.DatabaseError) as error:
+                log.error("change_listener_disconnected", error=error)
+            finally:
+                self.listening.clear()
+                if conn is not None:
+                    conn.close()
+            time.sleep(CHANGE_FEED_RETRY_SECONDS)
@@ -0,0 +1,493 @@
+import os
+import re
+from enum import Enum
+
+from log import get_logger
+from position_table import get_position_table
+from tic_tac_game import (
+    TIE_STR,
+    TicTacMove,
+    check_for_win,
+    convert_move_enum_to_str,
+    get_board_str,
+)
+
+# command rules and message text shared by app.py and async_app.py - nothing
+# in here touches the database or the Slack API
+
+log = get_logger("commands")
+
+
+class VoteType(Enum):
+    PRAYER = 1
+    KILL = 2
+
+
+# usernames are received by the server as <123ABC>
+USRNAME_PATTERN = "<.+>"
+USRNAME_REGEX = re.compile(USRNAME_PATTERN)
+KILL_CMD_PREFIX = "kill "
+KILL_PREFIX_LEN = len(KILL_CMD_PREFIX)
+KILL_COMMAND = KILL_CMD_PREFIX + USRNAME_PATTERN
+# Slack sends a mention as <@U123ABC> or <@U123ABC|display name> - votes
+# store the bare <@U123ABC> form so every vote for a player lands on the
+# same target
+USER_MENTION_REGEX = re.compile(r"<@([UW][A-Z0-9]+)(?:\|[^>]*)?>")
+# a line of /modvotes: an action, then (for most actions) the voter
+VOTE_OPERATION_REGEX = re.compile(r"(\w+)(?:\s+(<@[^>]*>))?\s*(.*)")
+SLACK_FILE_ID_REGEX = re.compile(r"\bF[A-Z0-9]{6,}\b")
+ROSTER_COMMAND_REGEX = re.compile(
+    r"(add|kill|revive)\s+(<@[^>]*>)(?:\s+(\S+))?", re.IGNORECASE
+)
+
+MAIN_CHANNEL_NAME = "main_chat"
+VOTE_RESULTS_CHANNEL_NAME = "vote-results"
+VOTE_TALLY_HEADER = "=======VOTE TALLY UPDATE=======\n"
+
+PRAYER_STR = "prayer"
+KILL_STR = "kill"
+
+# user IDs (comma separated) allowed to use the moderator commands (/roster,
+# /modvotes, /startday and /endday)
+MODERATOR_USER_IDS = frozenset(
+    user_id
+    for user_id in os.environ.get("MODERATOR_USER_IDS", "").split(",")
+    if user_id
+)
+
+# for tic tac toe game - these set the size of new games, and each channel
+# can start a different size with /restart-tic-tac (e.g. 15x15 five-in-a-row)
+BOARD_HEIGHT = int(os.environ.get("TIC_TAC_BOARD_HEIGHT", 3))
+BOARD_WIDTH = int(os.environ.get("TIC_TAC_BOARD_WIDTH", 3))
+WIN_LENGTH = int(os.environ.get("TIC_TAC_WIN_LENGTH", 3))
+# keeps a rendered board within one Slack message
+MAX_BOARD_CELLS = 400
+TIC_TAC_CHANNEL_NAMES = ["tic-tac-toe-test", "tic-tac-tolympics"]
+# channels where the bot answers every move in a 3x3 game with its own
+TIC_TAC_BOT_CHANNEL_NAMES = [
+    name for name in os.environ.get("TIC_TAC_BOT_CHANNEL_NAMES", "").split(",") if name
+]
+
+# players shown per /tictacscoreboard page
+SCOREBOARD_PAGE_SIZE = int(os.environ.get("SCOREBOARD_PAGE_SIZE", 10))
+
+WRONG_CHANNEL_MSG = "You can't do that in this channel."
+INVALID_PLAYER_MSG = "Try again - you didn't specify a valid player."
+OUT_OF_BOUNDS_MSG = "Try again - your move row and column were too large or too small."
+BAD_MOVE_FORMAT_MSG = "Try again - you didn't provide a move in proper format."
+SPACE_TAKEN_MSG = "Try again - that space is already taken."
+BAD_BOARD_SIZE_MSG = f"Try again - give a height, width and win length with at most {MAX_BOARD_CELLS} squares."
+RESTARTED_MSG = "Board should be reset now."
+BUSY_MSG = "The bot is busy right now - try again in a moment."
+VOTE_NOT_RECORDED_MSG = "Your vote couldn't be recorded - try again."
+NOT_ALIVE_MSG = "Try again - that player isn't alive in this game."
+INVALID_PRAYER_MSG = "Try again - you can only pray to a living player or their role."
+MODERATOR_ONLY_MSG = "Only moderators can do that."
+ROSTER_USAGE_MSG = "Try again - use `/roster add @player [role]`, `/roster kill @player` or `/roster revive @player`."
+NOT_ON_ROSTER_MSG = "That player isn't on the roster - add them first."
+VOTE_OPERATIONS_USAGE_MSG = "Try again - give one vote change per line (or separated by `;`): `kill @voter @target`, `pray @voter target`, `remove @voter` or `clear`, or `import <link to a shared text file>` of them."
+VOTES_NOT_APPLIED_MSG = "The vote changes couldn't be applied - nothing was changed."
+VOTE_JOURNAL_BUSY_MSG = "Recent votes are still being saved - try again in a moment."
+DAY_IN_PROGRESS_MSG = "A day is already in progress - end it with /endday first."
+NO_DAY_IN_PROGRESS_MSG = "No day is in progress - start one with /startday."
+PHASE_NOT_CHANGED_MSG = "The day couldn't be started or ended - try again."
+NO_DAY_RESULTS_MSG = "There are no results for that day - it hasn't ended yet."
+
+
+def parse_user_mention(text):
+    # the user ID if text is exactly one user mention, otherwise None
+    match = USER_MENTION_REGEX.fullmatch(text.strip())
+    return match.group(1) if match else None
+
+
+def format_user_mention(user_id):
+    return f"<@{user_id}>"
+
+
+def get_kill_target(text, roster):
+    """Check /kill's target against the roster.
+
+    Returns (target_name, error_msg). Until moderators add players to the
+    roster, any single user mention is a valid target.
+    """
+    target_id = parse_user_mention(text)
+    if target_id is None:
+        return None, INVALID_PLAYER_MSG
+    if not roster.is_empty() and not roster.is_alive(target_id):
+        return None, NOT_ALIVE_MSG
+    return format_user_mention(target_id), None
+
+
+def get_prayer_target(text, roster):
+    """Check /prayto's target - a living player or a living player's role.
+
+    Returns (target_name, error_msg). With an empty roster any single word
+    is a valid target, like before the roster existed.
+    """
+    target_id = parse_user_mention(text)
+    if target_id is not None:
+        if not roster.is_empty() and not roster.is_alive(target_id):
+            return None, NOT_ALIVE_MSG
+        return format_user_mention(target_id), None
+    prayer_targets = text.split()
+    if len(prayer_targets) != 1:
+        return None, INVALID_PLAYER_MSG
+    target_role = prayer_targets[0].upper()
+    if not roster.is_empty() and not roster.is_alive_role(target_role):
+        return None, INVALID_PRAYER_MSG
+    return target_role, None
+
+
+def parse_roster_command(text):
+    """Parse "add @player [role]", "kill @player" or "revive @player".
+
+    Returns (action, player_id, role, error_msg) - action is None for a
+    bare /roster, which lists the players.
+    """
+    if not text.strip():
+        return None, None, None, None
+    match = ROSTER_COMMAND_REGEX.fullmatch(text.strip())
+    if match is None:
+        return None, None, None, ROSTER_USAGE_MSG
+    action, mention, role = match.groups()
+    action = action.lower()
+    player_id = parse_user_mention(mention)
+    if player_id is None or (role and action != "add"):
+        return None, None, None, ROSTER_USAGE_MSG
+    return action, player_id, role.upper() if role else None, None
+
+
+def parse_vote_operations(text, roster):
+    """Parse /modvotes text: one vote change per line or separated by ";".
+
+    Each is "kill @voter @target", "pray @voter target", "remove @voter"
+    or "clear" (every vote). Targets follow the same rules as /kill and
+    /prayto. Returns (operations, error_msg) - with an error nothing should
+    be applied.
+    """
+    operations = []
+    lines = [line.strip() for line in re.split(r"[;\n]", text) if line.strip()]
+    if not lines:
+        return [], VOTE_OPERATIONS_USAGE_MSG
+    for line_num, line in enumerate(lines, 1):
+        operation, error_msg = parse_vote_operation(line, roster)
+        if error_msg is not None:
+            reason = error_msg.removeprefix("Try again - ")
+            return [], f"Nothing was changed - line {line_num} (`{line}`): {reason}"
+        operations.append(operation)
+    return operations, None
+
+
+def parse_vote_operation(line, roster):
+    match = VOTE_OPERATION_REGEX.fullmatch(line)
+    if match is None:
+        return None, VOTE_OPERATIONS_USAGE_MSG
+    action, mention, rest = match.groups()
+    action = action.lower()
+    if action == "clear" and mention is None and not rest:
+        return ("clear",), None
+    voter_id = parse_user_mention(mention) if mention else None
+    if voter_id is None:
+        return None, VOTE_OPERATIONS_USAGE_MSG
+    if action == "remove" and not rest:
+        return ("remove", voter_id), None
+    if action == "kill":
+        target_name, error_msg = get_kill_target(rest, roster)
+        return ("set", voter_id, KILL_STR, target_name), error_msg
+    if action in ["pray", "prayto"]:
+        target_name, error_msg = get_prayer_target(rest, roster)
+        return ("set", voter_id, PRAYER_STR, target_name), error_msg
+    return None, VOTE_OPERATIONS_USAGE_MSG
+
+
+def parse_vote_import(text):
+    # the file ID from "import <file link or ID>", or None
+    action, _, rest = text.strip().partition(" ")
+    if action.lower() != "import":
+        return None
+    match = SLACK_FILE_ID_REGEX.search(rest)
+    return match.group(0) if match else None
+
+
+def collapse_vote_operations(operations):
+    """Reduce operations (applied in order) to the changes the votes table needs.
+
+    Returns (clear_all, removed_voter_ids, votes) where votes maps each
+    voter left with a vote to (vote_type, target_name).
+    """
+    clear_all = False
+    removed_voter_ids = set()
+    votes = {}
+    for operation in operations:
+        if operation[0] == "clear":
+            clear_all = True
+            removed_voter_ids = set()
+            votes = {}
+        elif operation[0] == "remove":
+            votes.pop(operation[1], None)
+            removed_voter_ids.add(operation[1])
+        else:
+            _, voter_id, vote_type, target_name = operation
+            removed_voter_ids.discard(voter_id)
+            votes[voter_id] = (vote_type, target_name)
+    return clear_all, removed_voter_ids, votes
+
+
+def format_vote_count(num_votes):
+    return f"{num_votes} vote" if num_votes == 1 else f"{num_votes} votes"
+
+
+def format_vote_operations_result(clear_all, removed_voter_ids, votes):
+    changes = []
+    if clear_all:
+        changes.append("cleared every vote")
+    if removed_voter_ids:
+        changes.append(f"removed {format_vote_count(len(removed_voter_ids))}")
+    if votes:
+        changes.append(f"set {format_vote_count(len(votes))}")
+    return f"Vote changes applied: {', '.join(changes)}."
+
+
+def parse_day_num(text):
+    # takes an optional day number, e.g. /dayresults 2 - None means the last day
+    day_data = text.split()
+    if len(day_data) == 1 and day_data[0].isdigit() and int(day_data[0]) > 0:
+        return int(day_data[0])
+    return None
+
+
+def format_day_started(day_num):
+    return f"Day {day_num} has started - get your votes in!"
+
+
+def format_day_results(day_num, results):
+    """Format a finished day's tally from rows of (vote_type, target_name, num_votes)."""
+    slack_msg = f"=======DAY {day_num} FINAL TALLY=======\n"
+    if not results:
+        slack_msg += "Nobody voted.\n"
+    for vote_type in [PRAYER_STR, KILL_STR]:
+        tally = sorted(
+            (
+                (target_name, num_votes)
+                for result_type, target_name, num_votes in results
+                if result_type == vote_type
+            ),
+            key=lambda result: (-result[1], result[0]),
+        )
+        if not tally:
+            continue
+        slack_msg += f"-------*for vote type {vote_type.upper()}*-------\n"
+        for target_name, num_votes in tally:
+            target_str = f"*TARGET:* {target_name}"
+            numvotes_str = f"| *VOTES:* {num_votes}"
+            slack_msg += target_str.ljust(30) + numvotes_str.rjust(14) + "\n"
+    return slack_msg
+
+
+def format_roster(roster):
+    slack_msg = "===ROSTER===\n"
+    players = roster.get_players()
+    if not players:
+        slack_msg += "Nobody has been added yet - use `/roster add @player [role]`.\n"
+    for player_id, role, alive in players:
+        role_str = f" ({role})" if role else ""
+        slack_msg += f"{format_user_mention(player_id)}{role_str} - {'alive' if alive else 'dead'}\n"
+    return slack_msg
+
+
+def format_roster_change(player_id, role, alive):
+    role_str = f" ({role})" if role else ""
+    return f"Roster updated: {format_user_mention(player_id)}{role_str} is {'alive' if alive else 'dead'}."
+
+
+def get_vote_type_str(vote_type):
+    # convert from Python enum to PostGres enum
+    if vote_type == VoteType.KILL:
+        return KILL_STR
+    assert vote_type == VoteType.PRAYER
+    return PRAYER_STR
+
+
+def parse_board_size(text):
+    """Parse "height width win_length" from /restart-tic-tac.
+
+    Returns (board_size, valid) - board_size is None when no size was given.
+    """
+    size_data = text.split()
+    if not size_data:
+        return None, True
+    if len(size_data) == 3 and all(part.isdigit() for part in size_data):
+        height, width, win_length = [int(part) for part in size_data]
+        if 1 <= win_length <= max(height, width) and height * width <= MAX_BOARD_CELLS:
+            return (height, width, win_length), True
+    return None, False
+
+
+def parse_page_num(text):
+    # takes an optional 1-indexed page number, e.g. /tictacscoreboard 2
+    page_data = text.split()
+    if len(page_data) == 1 and page_data[0].isdigit() and int(page_data[0]) > 0:
+        return int(page_data[0]) - 1
+    return 0
+
+
+def format_vote_tally(vote_tally):
+    slack_msg = VOTE_TALLY_HEADER
+
+    for vote_type in [PRAYER_STR, KILL_STR]:
+        slack_msg += f"-------*for vote type {vote_type.upper()}*-------\n"
+        tally = vote_tally.get_tally(vote_type)
+
+        log.debug(
+            "vote_tally_rendered",
+            sample=True,
+            vote_type=vote_type,
+            num_targets=len(tally),
+        )
+
+        for target_name, num_votes, voter_user_ids in tally:
+            target_str = f"*TARGET:* {target_name}"
+            numvotes_str = f"| *VOTES:* {num_votes}"
+            slack_msg += target_str.ljust(30) + numvotes_str.rjust(14) + "\n"
+            user_id_list_str = ", ".join(
+                ["<@" + str(player_id) + ">" for player_id in voter_user_ids]
+            )
+            slack_msg += f"    _brought to you by_: {user_id_list_str}\n"
+
+    return slack_msg
+
+
+def format_scoreboard(leaderboard, page_num, user_id):
+    num_pages = max(1, -(-len(leaderboard) // SCOREBOARD_PAGE_SIZE))
+    slack_msg = (
+        f"===CURRENT TIC TAC TOE SCOREBOARD (page {page_num + 1} of {num_pages})===\n"
+    )
+    for rank, player_id, num_wins in leaderboard.get_page(
+        page_num, SCOREBOARD_PAGE_SIZE
+    ):
+        target_str = f"{rank}. *PLAYER:* <@{player_id}>"
+        numvotes_str = f"| *WINS:* {num_wins}"
+        slack_msg += target_str.ljust(30) + numvotes_str.rjust(14) + "\n"
+
+    own_rank = leaderboard.get_rank(user_id)
+    if own_rank is None:
+        slack_msg += "You haven't won a game yet.\n"
+    else:
+        rank, num_wins = own_rank
+        slack_msg += f"You are ranked #{rank} with {num_wins} wins.\n"
+    return slack_msg
+
+
+def format_hint(game):
+    position_table = get_position_table()
+    if not position_table.covers(game):
+        return "Hints are only available for 3x3 games."
+    best_move = position_table.get_best_move(game.board_state, game.curr_team)
+    if best_move is None:
+        return "There's no hint for this board."
+    row_num, col_num = divmod(best_move, game.width)
+    return f"Best move for team `{convert_move_enum_to_str(game.curr_team)}`: `/tictacmove {row_num} {col_num}`"
+
+
+# classic 3x3 games get their status and rendered board from the
+# precomputed position table, bigger boards fall back to the bitboard check
+def get_move_result(game, board_index):
+    position_table = get_position_table()
+    if position_table.covers(game):
+        status = position_table.get_status(game.board_state)
+        if status is not None:
+            return status
+    whether_won, winner = check_for_win(
+        game.x_bits, game.o_bits, board_index, game.win_detector
+    )
+    return whether_won
+
+
+def render_board(game, board_state):
+    position_table = get_position_table()
+    if position_table.covers(game):
+        board_str = position_table.get_board_str(board_state)
+        if board_str is not None:
+            return board_str
+    return get_board_str(board_state, game.width)
+
+
+# places the current team's tile at board_index, starting a new game if that
+# won or filled the board - returns (whether_won, board right after the move)
+def play_tic_tac_toe_move(game, board_index):
+    curr_team = game.curr_team
+    log.debug(
+        "move_played",
+        sample=True,
+        game_id=game.game_id,
+        index=board_index,
+        team=convert_move_enum_to_str(curr_team),
+    )
+    game.place(board_index, curr_team)
+    board_state = list(game.board_state)
+    next_team = TicTacMove.get_opposite(curr_team)
+
+    whether_won = get_move_result(game, board_index)
+    if whether_won == True or whether_won == TIE_STR:
+        game.reset(next_team)
+    else:
+        game.curr_team = next_team
+        game.move_count += 1
+    return whether_won, board_state
+
+
+def get_move_msg(game, player, whether_won, board_state):
+    slack_msg = f"====CURRENT BOARD===\n"
+    last_move_by_str = f"Last move made by <@{player}>\n"
+    # get next team to use in Slack msg response
+    next_team_str = (
+        f"Next move will be for team `{convert_move_enum_to_str(game.curr_team)}`\n"
+    )
+    if whether_won == True:
+        # print a blank board to the chat
+        slack_msg += f"This is a new game - <@{player}> won the previous game.\n"
+        slack_msg += next_team_str
+        slack_msg += render_board(game, game.board_state)
+    elif whether_won == TIE_STR:
+        # I know using a string as an third boolean is very
+        # silly - I'm sorry
+        slack_msg += f"The previous game ended in a tie - nobody won.\n"
+        slack_msg += last_move_by_str
+        slack_msg += next_team_str
+        slack_msg += render_board(game, game.board_state)
+    else:
+        # print out the new board
+        slack_msg += last_move_by_str
+        slack_msg += next_team_str
+        slack_msg += render_board(game, board_state)
+    return slack_msg
+
+
+def apply_move(game, player, row_num, col_num, bot_user_id=None):
+    """Play player's move (and the bot's reply, if any) on a locked game.
+
+    Returns (error_msg, slack_msg, winners). The caller saves the game and
+    records a win for each of winners unless error_msg is set.
+    """
+    if row_num >= game.height or col_num >= game.width:
+        return OUT_OF_BOUNDS_MSG, "", []
+    board_index = row_num * game.width + col_num
+    if game.board_state[board_index] != TicTacMove.OPEN:
+        return SPACE_TAKEN_MSG, "", []
+
+    winners = []
+    whether_won, board_state = play_tic_tac_toe_move(game, board_index)
+    if whether_won == True:
+        winners.append(player)
+    slack_msg = get_move_msg(game, player, whether_won, board_state)
+
+    # the bot replies straight from the position table
+    position_table = get_position_table()
+    if bot_user_id is not None and whether_won == False and position_table.covers(game):
+        bot_index = position_table.get_best_move(game.board_state, game.curr_team)
+        if bot_index is not None:
+            bot_won, bot_board_state = play_tic_tac_toe_move(game, bot_index)
+            if bot_won == True:
+                winners.append(bot_user_id)
+            slack_msg += get_move_msg(game, bot_user_id, bot_won, bot_board_state)
+    return None, slack_msg, winners
@@ -1,6 +1,15 @@
 from configparser import ConfigParser
+from functools import lru_cache
 
-def config(filename='database.ini', section='postgresql'):
+
+def config(filename="database.ini", section="postgresql"):
+    # a copy, so callers can't change the cached settings
+    return dict(read_section(filename, section))
+
+
+# the file is only read and parsed on the first call for each section
+@lru_cache(maxsize=None)
+def read_section(filename, section):
     # create a parser
     parser = ConfigParser()
     # read config file
@@ -13,6 +22,8 @@ def config(filename='database.ini', section='postgresql'):
         for param in params:
             db[param[0]] = param[1]
     else:
-        raise Exception('Section {0} not found in the {1} file'.format(section, filename))
+        raise Exception(
+            "Section {0} not found in the {1} file".format(section, filename)
+        )
 
-    return db
\ No newline at end of file
+    return db
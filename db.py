@@ -0,0 +1,225 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+
+from log import get_logger
+from metrics import InstrumentedCursor, registry
+from prepared_statements import PreparingConnection
+
+log = get_logger("db")
+
+# pool bounds can be tuned per dyno without a redeploy
+# (Heroku hobby Postgres allows 20 connections total)
+DB_POOL_MIN_CONN = int(os.environ.get("DB_POOL_MIN_CONN", 1))
+DB_POOL_MAX_CONN = int(os.environ.get("DB_POOL_MAX_CONN", 5))
+# how long a handler waits for a free connection before giving up
+DB_POOL_TIMEOUT_SECONDS = float(os.environ.get("DB_POOL_TIMEOUT_SECONDS", 10))
+# connections idle for longer than this get a "SELECT 1" before reuse
+DB_HEALTH_CHECK_IDLE_SECONDS = float(os.environ.get("DB_HEALTH_CHECK_IDLE_SECONDS", 30))
+# waits longer than this get printed so we can see when the pool is too small
+DB_POOL_SLOW_WAIT_SECONDS = float(os.environ.get("DB_POOL_SLOW_WAIT_SECONDS", 0.1))
+
+
+class PoolTimeoutError(psycopg2.OperationalError):
+    pass
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of psycopg2 connections.
+
+    Callers are gated on a semaphore and block (up to a timeout) until a
+    connection is returned. Every returned connection stays open for the
+    next caller - psycopg2's ThreadedConnectionPool closes whatever is
+    returned beyond minconn, so a burst of commands would reconnect (and
+    lose the statements prepared on its connections) every time.
+    """
+
+    def __init__(self, dsn, minconn, maxconn, timeout):
+        self._dsn = dsn
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._timeout = timeout
+        # open connections nobody has checked out, most recently used last
+        self._idle = []
+        # connection -> when it was last returned, for idle connections
+        self._last_used = {}
+        self._idle_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.maxconn = maxconn
+        self.in_use = 0
+        self.checkouts = 0
+        self.reconnects = 0
+        self.timeouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        for _ in range(minconn):
+            self._idle.append(self._connect())
+
+    def _connect(self):
+        # every cursor handed out is timed per statement for /metrics, and
+        # each connection tracks the statements prepared on it
+        return psycopg2.connect(
+            self._dsn,
+            connection_factory=PreparingConnection,
+            cursor_factory=InstrumentedCursor,
+        )
+
+    def _discard(self, conn):
+        self._last_used.pop(conn, None)
+        if not conn.closed:
+            conn.close()
+
+    def _record_wait(self, waited):
+        with self._stats_lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.total_wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        registry.observe("db_pool_wait_seconds", value=waited)
+        if waited > DB_POOL_SLOW_WAIT_SECONDS:
+            log.warning("db_pool_slow_wait", seconds=round(waited, 3))
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        # connections that were just used haven't had a chance to go stale
+        if (
+            last_used is None
+            or time.monotonic() - last_used < DB_HEALTH_CHECK_IDLE_SECONDS
+        ):
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except (Exception, psycopg2.DatabaseError) as error:
+            log.warning("db_connection_discarded", error=error)
+            return False
+
+    def getconn(self):
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self._timeout):
+            with self._stats_lock:
+                self.timeouts += 1
+            raise PoolTimeoutError(
+                f"timed out after {self._timeout}s waiting for a database connection"
+            )
+        try:
+            conn = None
+            with self._idle_lock:
+                if self._idle:
+                    conn = self._idle.pop()
+                    last_used = self._last_used.pop(conn, None)
+            if conn is None:
+                conn = self._connect()
+            elif not self._is_healthy(conn, last_used):
+                # drop the dead connection and open a fresh one in its place
+                self._discard(conn)
+                conn = self._connect()
+                with self._stats_lock:
+                    self.reconnects += 1
+        except BaseException:
+            self._slots.release()
+            raise
+        self._record_wait(time.monotonic() - start)
+        return conn
+
+    def putconn(self, conn, broken=False):
+        try:
+            if broken or conn.closed:
+                self._discard(conn)
+            else:
+                with self._idle_lock:
+                    self._last_used[conn] = time.monotonic()
+                    self._idle.append(conn)
+        finally:
+            with self._stats_lock:
+                self.in_use -= 1
+            self._slots.release()
+
+    def stats(self):
+        with self._stats_lock:
+            avg_wait = self.total_wait_seconds / self.checkouts if self.checkouts else 0
+            return {
+                "max_connections": self.maxconn,
+                "in_use": self.in_use,
+                "checkouts": self.checkouts,
+                "reconnects": self.reconnects,
+                "timeouts": self.timeouts,
+                "total_wait_seconds": self.total_wait_seconds,
+                "avg_wait_seconds": avg_wait,
+                "max_wait_seconds": self.max_wait_seconds,
+            }
+
+    def closeall(self):
+        with self._idle_lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    # created lazily so importing this module doesn't need DATABASE_URL
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    os.environ["DATABASE_URL"],
+                    DB_POOL_MIN_CONN,
+                    DB_POOL_MAX_CONN,
+                    DB_POOL_TIMEOUT_SECONDS,
+                )
+    return _pool
+
+
+@contextmanager
+def get_connection():
+    """Borrow a pooled connection for the duration of a with-block.
+
+    Uncommitted work is rolled back when the block exits, and connections
+    that failed at the connection level are closed instead of reused.
+    """
+    db_pool = get_pool()
+    conn = db_pool.getconn()
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        if not broken and not conn.closed:
+            try:
+                conn.rollback()
+            except (Exception, psycopg2.DatabaseError):
+                broken = True
+        db_pool.putconn(conn, broken=broken)
+
+
+def get_pool_stats():
+    if _pool is None:
+        return {}
+    return _pool.stats()
+
+
+def collect_pool_metrics():
+    return [
+        (f"db_pool_{name}", (), value)
+        for name, value in get_pool_stats().items()
+        if name in ("max_connections", "in_use", "checkouts", "reconnects", "timeouts")
+    ]
+
+
+registry.describe(
+    "db_pool_wait_seconds", "histogram", "Time spent waiting for a pooled connection"
+)
+registry.add_collector(collect_pool_metrics)
@@ -0,0 +1,288 @@
+"""Export the game's tables (or any query) to CSV or JSON Lines for analysis.
+
+Rows are read through a named (server-side) cursor, batch by batch, and
+written out as they arrive, so memory use stays flat however long the vote
+history gets. Output ending in .gz (or --gzip) is compressed as it's written.
+
+    python export.py votes_history --day 3 --output day3.csv
+    python export.py votes --player U012ABCDEF --format jsonl
+    python export.py tic_tac_game --game C0123456 --output games.jsonl.gz
+    python export.py --query "SELECT ..." --output results.csv
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+
+import psycopg2
+
+from tic_tac_game import convert_move_enum_to_str, unpack_cells
+
+# rows fetched from the server per round trip - memory use is about one
+# batch, whatever the size of the export
+DEFAULT_BATCH_SIZE = 2000
+
+
+def format_board(row):
+    """Replace tic_tac_game's packed cells with the board, e.g. "X_O/_X_/O__"."""
+    game_id, height, width, win_length, cells, *rest = row
+    tiles = "".join(
+        convert_move_enum_to_str(tile) for tile in unpack_cells(cells, height * width)
+    )
+    board = "/".join(tiles[i : i + width] for i in range(0, len(tiles), width))
+    return (game_id, height, width, win_length, board, *rest)
+
+
+# name -> (query, {filter: condition}, ORDER BY, row conversion). Conditions
+# take their values from the parameters built in get_filter_params
+TABLES = {
+    # the votes of the day in progress
+    "votes": (
+        """SELECT voter_user_id, voter_name, target_name, vote_type, votecast_time
+             FROM votes""",
+        {"player": "(voter_user_id = %(player)s OR target_name = %(player_mention)s)"},
+        "votecast_time",
+        None,
+    ),
+    # the votes of every finished day
+    "votes_history": (
+        """SELECT day_num, voter_user_id, voter_name, target_name, vote_type, votecast_time
+             FROM votes_history""",
+        {
+            "day": "day_num = %(day)s",
+            "player": "(voter_user_id = %(player)s OR target_name = %(player_mention)s)",
+        },
+        "day_num, votecast_time",
+        None,
+    ),
+    "phase_results": (
+        """SELECT day_num, vote_type, target_name, num_votes
+             FROM phase_results""",
+        {"day": "day_num = %(day)s", "player": "target_name = %(player_mention)s"},
+        "day_num, vote_type, num_votes DESC",
+        None,
+    ),
+    "game_phases": (
+        "SELECT day_num, started_at, ended_at FROM game_phases",
+        {"day": "day_num = %(day)s"},
+        "day_num",
+        None,
+    ),
+    "players": (
+        "SELECT player_id, role, alive, updated_at FROM players",
+        {"player": "player_id = %(player)s"},
+        "player_id",
+        None,
+    ),
+    # each channel's board as of its last move
+    "tic_tac_game": (
+        """SELECT game_id, height, width, win_length, cells AS board, curr_team, move_count, version
+             FROM tic_tac_game""",
+        {"game": "game_id = %(game)s"},
+        "game_id",
+        format_board,
+    ),
+    "tic_tac_win": (
+        "SELECT player_id, num_wins FROM tic_tac_win",
+        {"player": "player_id = %(player)s"},
+        "num_wins DESC, player_id",
+        None,
+    ),
+}
+FILTERS = ["game", "day", "player"]
+
+
+def get_filter_params(args):
+    return {
+        "game": args.game,
+        "day": args.day,
+        "player": args.player,
+        "player_mention": f"<@{args.player}>",
+    }
+
+
+def build_query(table, args):
+    """Return the table's SELECT with the filters given in args, or raise
+    ValueError for a filter the table doesn't have."""
+    query, conditions, order_by, _ = TABLES[table]
+    where = []
+    for name in FILTERS:
+        if getattr(args, name) is None:
+            continue
+        if name not in conditions:
+            raise ValueError(f"{table} can't be filtered by --{name}")
+        where.append(conditions[name])
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    return query + f" ORDER BY {order_by}"
+
+
+def to_json_value(value):
+    if isinstance(value, (bytes, memoryview)):
+        return bytes(value).hex()
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+class CsvWriter:
+    def __init__(self, out):
+        self._writer = csv.writer(out)
+
+    def write_header(self, columns):
+        self._writer.writerow(columns)
+
+    def write_rows(self, columns, rows):
+        self._writer.writerows(rows)
+
+
+class JsonLinesWriter:
+    def __init__(self, out):
+        self._out = out
+
+    def write_header(self, columns):
+        pass
+
+    def write_rows(self, columns, rows):
+        for row in rows:
+            self._out.write(json.dumps(dict(zip(columns, row)), default=to_json_value))
+            self._out.write("\n")
+
+
+WRITERS = {"csv": CsvWriter, "jsonl": JsonLinesWriter}
+
+
+def open_output(path, compress):
+    """A text stream for path ("-" is stdout), gzipped if compress."""
+    if path == "-":
+        if not compress:
+            return io.TextIOWrapper(
+                sys.stdout.buffer, encoding="utf-8", newline="", write_through=True
+            )
+        return io.TextIOWrapper(
+            gzip.GzipFile(fileobj=sys.stdout.buffer, mode="wb"),
+            encoding="utf-8",
+            newline="",
+        )
+    if compress:
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+def export(database_url, query, params, writer, batch_size, convert_row=None):
+    """Stream query's rows to writer, returning how many were written."""
+    conn = psycopg2.connect(database_url)
+    try:
+        # read only - --query runs whatever it's given
+        conn.set_session(readonly=True)
+        # a named cursor is a server-side DECLARE ... CURSOR, so only one
+        # batch is ever held here
+        cur = conn.cursor(name="export")
+        cur.execute(query, params)
+        num_rows = 0
+        columns = None
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if columns is None:
+                # a named cursor only has a description after the first fetch
+                columns = [column.name for column in cur.description]
+                writer.write_header(columns)
+            if not rows:
+                break
+            if convert_row is not None:
+                rows = [convert_row(row) for row in rows]
+            writer.write_rows(columns, rows)
+            num_rows += len(rows)
+        cur.close()
+        conn.rollback()
+    finally:
+        conn.close()
+    return num_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("table", nargs="?", choices=sorted(TABLES))
+    parser.add_argument(
+        "--query", help="export this SELECT instead of a table (no filters)"
+    )
+    parser.add_argument("--game", help="only this channel's game (tic_tac_game)")
+    parser.add_argument(
+        "--day", type=int, help="only this day (votes_history, phase_results...)"
+    )
+    parser.add_argument(
+        "--player", help="only rows for this Slack user ID, as voter, target or player"
+    )
+    parser.add_argument(
+        "--output", default="-", help="file to write, or - for stdout (the default)"
+    )
+    parser.add_argument(
+        "--format",
+        choices=sorted(WRITERS),
+        help="defaults to jsonl for a .jsonl or .jsonl.gz output, csv otherwise",
+    )
+    parser.add_argument(
+        "--gzip",
+        action="store_true",
+        help="compress the output (implied by an output ending in .gz)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="rows fetched per round trip",
+    )
+    parser.add_argument(
+        "--database-url",
+        default=os.environ.get("DATABASE_URL"),
+        help="defaults to DATABASE_URL",
+    )
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("set DATABASE_URL or pass --database-url")
+    if (args.table is None) == (args.query is None):
+        parser.error("give either a table or --query")
+
+    convert_row = None
+    if args.query is not None:
+        if any(getattr(args, name) is not None for name in FILTERS):
+            parser.error("filters only apply to tables - put them in the query")
+        # no parameters, so a % in the query is left alone
+        query, params = args.query, None
+    else:
+        try:
+            query = build_query(args.table, args)
+        except ValueError as error:
+            parser.error(str(error))
+        params = get_filter_params(args)
+        convert_row = TABLES[args.table][3]
+
+    output_format = args.format
+    if output_format is None:
+        output_format = (
+            "jsonl" if args.output.endswith((".jsonl", ".jsonl.gz")) else "csv"
+        )
+    compress = args.gzip or args.output.endswith(".gz")
+
+    out = open_output(args.output, compress)
+    try:
+        num_rows = export(
+            args.database_url,
+            query,
+            params,
+            WRITERS[output_format](out),
+            args.batch_size,
+            convert_row,
+        )
+    finally:
+        out.close()
+    # stderr, so it stays out of an export written to stdout
+    print(f"Exported {num_rows} rows to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
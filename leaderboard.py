@@ -0,0 +1,61 @@
+import threading
+from bisect import bisect_left, insort
+
+
+class Leaderboard:
+    """Tic tac toe wins per player, kept sorted in memory.
+
+    Entries are (-num_wins, player_id) in a sorted list, so a page of the
+    top players is a slice and a player's rank is a binary search for the
+    first entry with their win count. Win counts only ever go up.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = []
+        self._wins = {}
+        self.loaded = False
+
+    def load(self, rows):
+        """Replace the leaderboard with rows of (player_id, num_wins)."""
+        with self._lock:
+            self._wins = dict(rows)
+            self._entries = sorted(
+                (-num_wins, player_id) for player_id, num_wins in self._wins.items()
+            )
+            self.loaded = True
+
+    def set_wins(self, player_id, num_wins):
+        """Raise player_id's count to num_wins, e.g. a total read back from
+        tic_tac_win. Lower counts are ignored, so replaying a stale or
+        repeated total is harmless."""
+        with self._lock:
+            old_wins = self._wins.get(player_id, 0)
+            if num_wins <= old_wins:
+                return
+            if old_wins:
+                del self._entries[bisect_left(self._entries, (-old_wins, player_id))]
+            self._wins[player_id] = num_wins
+            insort(self._entries, (-num_wins, player_id))
+
+    def get_page(self, page_num, page_size):
+        """Return [(rank, player_id, num_wins)] for a 0-indexed page."""
+        start = page_num * page_size
+        with self._lock:
+            page = self._entries[start : start + page_size]
+            # players with the same number of wins share a rank
+            return [
+                (bisect_left(self._entries, (neg_wins,)) + 1, player_id, -neg_wins)
+                for neg_wins, player_id in page
+            ]
+
+    def get_rank(self, player_id):
+        """Return (rank, num_wins), or None if the player hasn't won yet."""
+        with self._lock:
+            num_wins = self._wins.get(player_id)
+            if num_wins is None:
+                return None
+            return bisect_left(self._entries, (-num_wins,)) + 1, num_wins
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,487 @@
+"""End-to-end load test for the Bolt app.
+
+Starts app.py against a fake Slack Web API (served from this process) and a
+throwaway database on a local Postgres server, then has N simulated players
+send signed /kill, /prayto and /tictacmove requests at the same time.
+Prints a JSON report with ack and response latency percentiles, throughput,
+and database connections and Slack API calls per command.
+
+    python loadtest.py --database-url postgresql://localhost/postgres --players 20
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import psycopg2
+
+from tally_publisher import TALLY_PUBLISH_WINDOW_SECONDS
+
+SIGNING_SECRET = "loadtest-signing-secret"
+BOT_USER_ID = "ULOADBOT"
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(
+        len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1)))
+    )
+    return sorted_values[index]
+
+
+def summarize_latencies(latencies):
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 50),
+        "p95_ms": percentile(values, 95),
+        "p99_ms": percentile(values, 99),
+        "max_ms": values[-1] if values else None,
+    }
+
+
+def get_text(content_type, body):
+    """The "text" field of a JSON or form-encoded post, if it has one."""
+    if content_type.startswith("application/json"):
+        fields = json.loads(body or b"{}")
+    else:
+        fields = dict(urllib.parse.parse_qsl(body.decode()))
+    return fields.get("text")
+
+
+class FakeSlack:
+    """Answers Web API calls and collects response_url posts from the app."""
+
+    def __init__(self, player_ids):
+        self.api_calls = Counter()
+        self.response_times = {}
+        self.response_counts = Counter()
+        # the text of the last post to each response URL and Web API method
+        self.response_texts = {}
+        self.api_texts = {}
+        self.last_api_call_at = time.perf_counter()
+        self._lock = threading.Lock()
+        self._ts = 0
+        members = [
+            {"id": player_id, "real_name": player_id} for player_id in player_ids
+        ]
+        fake_slack = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                text = get_text(
+                    self.headers.get("Content-Type", ""),
+                    self.rfile.read(int(self.headers.get("Content-Length") or 0)),
+                )
+                if self.path.startswith("/response/"):
+                    with fake_slack._lock:
+                        fake_slack.response_times.setdefault(
+                            self.path, time.perf_counter()
+                        )
+                        fake_slack.response_counts[self.path] += 1
+                        fake_slack.response_texts[self.path] = text
+                    self._send({"ok": True})
+                    return
+                method = self.path.rsplit("/", 1)[-1]
+                with fake_slack._lock:
+                    fake_slack.api_calls[method] += 1
+                    fake_slack.last_api_call_at = time.perf_counter()
+                    if text is not None:
+                        fake_slack.api_texts[method] = text
+                    fake_slack._ts += 1
+                    ts = f"{fake_slack._ts}.000000"
+                self._send(
+                    {
+                        "ok": True,
+                        "user_id": BOT_USER_ID,
+                        "bot_id": "BLOADBOT",
+                        "team_id": "TLOADTEST",
+                        "channel": "CVOTERESULTS",
+                        "ts": ts,
+                        "members": members,
+                        "items": [],
+                        "response_metadata": {"next_cursor": ""},
+                    }
+                )
+
+            def _send(self, body):
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", get_free_port()), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+
+def create_database(admin_url):
+    name = f"loadtest_{os.getpid()}_{int(time.time())}"
+    conn = psycopg2.connect(admin_url)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(f"CREATE DATABASE {name};")
+    cur.close()
+    conn.close()
+    return name
+
+
+def drop_database(admin_url, name):
+    conn = psycopg2.connect(admin_url)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE);")
+    cur.close()
+    conn.close()
+
+
+def get_database_stats(database_url):
+    conn = psycopg2.connect(database_url)
+    cur = conn.cursor()
+    # sessions counts every connection ever opened to the database (Postgres 14+)
+    cur.execute(
+        "SELECT sessions, xact_commit FROM pg_stat_database WHERE datname = current_database();"
+    )
+    sessions, commits = cur.fetchone()
+    cur.close()
+    conn.close()
+    return {"sessions": sessions, "commits": commits}
+
+
+def wait_for_slack_api_calls(fake_slack, timeout):
+    """Wait for the tally update the app sends after the last vote.
+
+    The tally publisher sends it up to TALLY_PUBLISH_WINDOW_SECONDS after
+    the vote, so this waits that long past the last response. Then it waits
+    until no Web API call has come in for a moment.
+    """
+    quiet_seconds = 0.5
+    deadline = time.perf_counter() + timeout
+    last_response_at = max(fake_slack.response_times.values(), default=0.0)
+    while time.perf_counter() < deadline:
+        now = time.perf_counter()
+        if (
+            now - last_response_at > TALLY_PUBLISH_WINDOW_SECONDS + quiet_seconds
+            and now - fake_slack.last_api_call_at > quiet_seconds
+        ):
+            return
+        time.sleep(0.05)
+
+
+def wait_until_ready(port, process, timeout=60):
+    """Wait for the app's GET /ready to return 200 - it has warmed up."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("the app exited during startup")
+        try:
+            with urllib.request.urlopen(
+                f"http://127.0.0.1:{port}/ready", timeout=1
+            ) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            # refused while the port isn't open yet, 503 while warming up
+            pass
+        time.sleep(0.05)
+    raise RuntimeError(f"the app was not ready on port {port}")
+
+
+def sign(body, timestamp):
+    base = f"v0:{timestamp}:{body}".encode()
+    digest = hmac.new(SIGNING_SECRET.encode(), base, hashlib.sha256).hexdigest()
+    return f"v0={digest}"
+
+
+def make_command(player_id, player_ids, num_games, fake_slack, request_num):
+    kind = random.choice(["/kill", "/prayto", "/tictacmove"])
+    channel_id = "CMAIN"
+    channel_name = "main_chat"
+    if kind == "/kill":
+        text = f"<@{random.choice(player_ids)}>"
+    elif kind == "/prayto":
+        text = random.choice(["zeus", "hera", "apollo"])
+    else:
+        text = f"{random.randrange(3)} {random.randrange(3)}"
+        # several games at once, each in its own channel
+        channel_id = f"CGAME{random.randrange(num_games)}"
+        channel_name = "tic-tac-toe-test"
+    response_path = f"/response/{player_id}/{request_num}"
+    return (
+        kind,
+        {
+            "token": "loadtest",
+            "team_id": "TLOADTEST",
+            "channel_id": channel_id,
+            "channel_name": channel_name,
+            "user_id": player_id,
+            "user_name": player_id,
+            "command": kind,
+            "text": text,
+            "response_url": fake_slack.url + response_path,
+            "trigger_id": f"{player_id}.{request_num}",
+        },
+        response_path,
+    )
+
+
+def send_command(app_url, body, retry_num=0):
+    timestamp = str(int(time.time()))
+    headers = {
+        "Content-Type": "application/x-www-form-urlencoded",
+        "X-Slack-Request-Timestamp": timestamp,
+        "X-Slack-Signature": sign(body, timestamp),
+    }
+    if retry_num:
+        headers["X-Slack-Retry-Num"] = str(retry_num)
+        headers["X-Slack-Retry-Reason"] = "http_timeout"
+    request = urllib.request.Request(app_url, data=body.encode(), headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            response.read()
+            return response.status
+    except Exception as error:
+        return str(error)
+
+
+def run_player(
+    player_id, args, player_ids, fake_slack, app_url, results, retries, lock
+):
+    for request_num in range(args.commands_per_player):
+        kind, payload, response_path = make_command(
+            player_id, player_ids, args.games, fake_slack, request_num
+        )
+        body = urllib.parse.urlencode(payload)
+        start = time.perf_counter()
+        status = send_command(app_url, body)
+        ack_time = time.perf_counter()
+        with lock:
+            results.append((kind, start, ack_time, status, response_path))
+        # the same request again, the way Slack retries one it thinks timed out
+        if random.random() < args.retry_rate:
+            send_command(app_url, body, retry_num=1)
+            with lock:
+                retries.append(response_path)
+        if args.think_time:
+            time.sleep(random.uniform(0, args.think_time))
+
+
+def run_load_test(args):
+    player_ids = [f"UPLAYER{i}" for i in range(args.players)]
+    fake_slack = FakeSlack(player_ids)
+    database_name = create_database(args.database_url)
+    # kept as a URL (like Heroku's DATABASE_URL) since asyncpg only takes URLs
+    database_url = (
+        urllib.parse.urlparse(args.database_url)._replace(path="/" + database_name)
+    ).geturl()
+    app_port = get_free_port()
+    # a fresh vote journal, so nothing left from an earlier run is replayed
+    journal_dir = tempfile.mkdtemp(prefix="loadtest_journal_")
+    process = None
+    try:
+        env = dict(
+            os.environ,
+            PORT=str(app_port),
+            DATABASE_URL=database_url,
+            SLACK_API_URL=fake_slack.url + "/api/",
+            SLACK_BOT_TOKEN="xoxb-loadtest",
+            SLACK_SIGNING_SECRET=SIGNING_SECRET,
+            VOTE_JOURNAL_PATH=os.path.join(journal_dir, "vote_journal.sqlite3"),
+        )
+        app_dir = os.path.dirname(os.path.abspath(__file__))
+        started_at = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(app_dir, args.app)],
+            cwd=app_dir,
+            env=env,
+            stdout=subprocess.DEVNULL if not args.show_app_output else None,
+            stderr=subprocess.DEVNULL if not args.show_app_output else None,
+        )
+        # the app migrates the new database and warms up before it's
+        # ready, so startup isn't part of the first commands' latency
+        wait_until_ready(app_port, process)
+        startup_seconds = time.perf_counter() - started_at
+        app_url = f"http://127.0.0.1:{app_port}/slack/events"
+
+        db_before = get_database_stats(database_url)
+        api_before = Counter(fake_slack.api_calls)
+        results = []
+        retries = []
+        lock = threading.Lock()
+        threads = [
+            threading.Thread(
+                target=run_player,
+                args=(
+                    player_id,
+                    args,
+                    player_ids,
+                    fake_slack,
+                    app_url,
+                    results,
+                    retries,
+                    lock,
+                ),
+            )
+            for player_id in player_ids
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # give the app a moment to finish work that happens after the ack
+        deadline = time.perf_counter() + args.drain_seconds
+        while time.perf_counter() < deadline and len(fake_slack.response_times) < len(
+            results
+        ):
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        # not part of the elapsed time - the app is idle apart from the tally
+        wait_for_slack_api_calls(
+            fake_slack, TALLY_PUBLISH_WINDOW_SECONDS + args.drain_seconds
+        )
+        db_after = get_database_stats(database_url)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        fake_slack.server.shutdown()
+        drop_database(args.database_url, database_name)
+        shutil.rmtree(journal_dir, ignore_errors=True)
+
+    num_commands = len(results)
+    report = {
+        "config": {
+            "app": args.app,
+            "players": args.players,
+            "commands_per_player": args.commands_per_player,
+            "games": args.games,
+            "retry_rate": args.retry_rate,
+        },
+        "commands": num_commands,
+        "errors": sum(1 for result in results if result[3] != 200),
+        "missing_responses": sum(
+            1 for result in results if result[4] not in fake_slack.response_times
+        ),
+        "retries_sent": len(retries),
+        # a retry that ran its handler again answers the command twice
+        "duplicate_responses": sum(
+            count - 1 for count in fake_slack.response_counts.values()
+        ),
+        # from launching the app to GET /ready returning 200
+        "startup_seconds": startup_seconds,
+        "elapsed_seconds": elapsed,
+        "throughput_per_second": num_commands / elapsed if elapsed else None,
+        "ack_latency": {},
+        "response_latency": {},
+        # the stats collector's own connection is subtracted out
+        "db_connections_per_command": (
+            (db_after["sessions"] - db_before["sessions"] - 1) / num_commands
+            if num_commands
+            else None
+        ),
+        "db_commits_per_command": (
+            (db_after["commits"] - db_before["commits"]) / num_commands
+            if num_commands
+            else None
+        ),
+        "slack_api_calls": dict(fake_slack.api_calls - api_before),
+        "slack_api_calls_per_command": (
+            sum((fake_slack.api_calls - api_before).values()) / num_commands
+            if num_commands
+            else None
+        ),
+    }
+    for kind in ["all", "/kill", "/prayto", "/tictacmove"]:
+        matching = [r for r in results if kind == "all" or r[0] == kind]
+        report["ack_latency"][kind] = summarize_latencies(
+            [(ack - start) * 1000 for _, start, ack, _, _ in matching]
+        )
+        report["response_latency"][kind] = summarize_latencies(
+            [
+                (fake_slack.response_times[path] - start) * 1000
+                for _, start, _, _, path in matching
+                if path in fake_slack.response_times
+            ]
+        )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--database-url",
+        default=os.environ.get(
+            "LOADTEST_DATABASE_URL", "postgresql://localhost/postgres"
+        ),
+        help="local Postgres server to create the throwaway database on",
+    )
+    parser.add_argument(
+        "--app",
+        default="app.py",
+        choices=["app.py", "async_app.py"],
+        help="which server to test",
+    )
+    parser.add_argument("--players", type=int, default=20)
+    parser.add_argument("--commands-per-player", type=int, default=10)
+    parser.add_argument(
+        "--games", type=int, default=4, help="concurrent tic tac toe games"
+    )
+    parser.add_argument(
+        "--think-time",
+        type=float,
+        default=0.0,
+        help="max random pause between commands",
+    )
+    parser.add_argument(
+        "--retry-rate",
+        type=float,
+        default=0.0,
+        help="fraction of commands sent a second time as a Slack retry",
+    )
+    parser.add_argument("--drain-seconds", type=float, default=10.0)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--show-app-output", action="store_true")
+    args = parser.parse_args()
+
+    report = run_load_test(args)
+    report_json = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report_json + "\n")
+    else:
+        print(report_json)
+
+
+if __name__ == "__main__":
+    main()
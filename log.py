@@ -0,0 +1,165 @@
+"""Key=value logging that never blocks the thread doing the logging.
+
+Every record goes onto a bounded queue and a background thread writes it
+to stdout, so a slash command never waits on Heroku's log router. If the
+writer falls behind and the queue fills up, new records are dropped (and
+counted) instead.
+
+    log = get_logger("app")
+    log.info("vote_cast", voter=voter_id, target=target_name)
+    log.debug("game_loaded", sample=True, game_id=game_id)
+
+prints
+
+    time=2022-01-31T20:15:02.113Z level=info logger=app request_id=trigger_id:123.456 event=vote_cast voter=U123 target="<@U456>"
+
+The request ID is the Slack request being handled (bound by the apps'
+middleware), and follows the work onto worker threads and asyncio tasks.
+"""
+
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# level for every logger without its own entry in LOG_LEVELS
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# per-logger levels, e.g. "app=DEBUG,slack_bolt=WARNING"
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "")
+# fraction of the high-volume debug events (logged with sample=True) kept
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get("LOG_DEBUG_SAMPLE_RATE", 1))
+# records waiting for the writer thread before new ones are dropped
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+
+def format_value(value):
+    value = str(value)
+    if value and not any(char in value for char in ' "=\n'):
+        return value
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'"{escaped}"'
+
+
+class KeyValueFormatter(logging.Formatter):
+    def format(self, record):
+        fields = [
+            ("time", self.format_time(record.created)),
+            ("level", record.levelname.lower()),
+            ("logger", record.name),
+        ]
+        request_id = getattr(record, "request_id", None)
+        if request_id is not None:
+            fields.append(("request_id", request_id))
+        fields.append(("event", record.getMessage()))
+        fields.extend(getattr(record, "fields", {}).items())
+        if record.exc_text:
+            fields.append(("traceback", record.exc_text))
+        return " ".join(f"{key}={format_value(value)}" for key, value in fields)
+
+    def format_time(self, created):
+        millis = int(created * 1000) % 1000
+        return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(created)) + (
+            f".{millis:03d}Z"
+        )
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records rather than wait for queue space."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # runs on the logging thread, so this is the request being handled
+        record.request_id = request_id_var.get()
+        # everything the writer needs is rendered now - args and exc_info
+        # can hold objects that change (or can't be pickled) later
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class EventLogger(logging.LoggerAdapter):
+    """Logs an event name with keyword arguments as its fields.
+
+    sample=True marks a high-volume event - only LOG_DEBUG_SAMPLE_RATE of
+    them are kept, and the kept ones carry sample_rate so counts can be
+    scaled back up.
+    """
+
+    def log(self, level, event, *args, exc_info=None, sample=False, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        if sample and LOG_DEBUG_SAMPLE_RATE < 1:
+            if random.random() >= LOG_DEBUG_SAMPLE_RATE:
+                return
+            fields["sample_rate"] = LOG_DEBUG_SAMPLE_RATE
+        self.logger.log(
+            level, event, *args, exc_info=exc_info, extra={"fields": fields}
+        )
+
+
+def get_logger(name):
+    return EventLogger(logging.getLogger(name), {})
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor that runs each task in a copy of the submitting
+    thread's context, so the request ID follows it (pass to Bolt as its
+    listener_executor)."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+_handler = None
+
+
+def configure_logging():
+    """Send every logger (Bolt's included) through the queue. Safe to call twice."""
+    global _handler
+    if _handler is not None:
+        return
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _handler = NonBlockingQueueHandler(log_queue)
+    root = logging.getLogger()
+    root.handlers = [_handler]
+    root.setLevel(LOG_LEVEL)
+    for entry in LOG_LEVELS.split(","):
+        if "=" in entry:
+            name, level = entry.split("=", 1)
+            logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(KeyValueFormatter())
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    # write out whatever is still queued when the process exits
+    atexit.register(listener.stop)
+
+
+def collect_log_metrics():
+    if _handler is None:
+        return []
+    return [
+        ("log_queue_depth", (), _handler.queue.qsize()),
+        ("log_records_dropped_total", (), _handler.dropped),
+    ]
@@ -0,0 +1,321 @@
+import functools
+import inspect
+import os
+import re
+import threading
+import time
+
+import psycopg2.extensions
+from slack_sdk.errors import SlackApiError
+
+from log import get_logger
+
+log = get_logger("metrics")
+
+# 0 turns the periodic log summary off
+METRICS_LOG_INTERVAL_SECONDS = float(os.environ.get("METRICS_LOG_INTERVAL_SECONDS", 0))
+
+# seconds - Slack wants an ack within 3
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# SQL is labelled by its first few words so each statement gets one series
+SQL_LABEL_LENGTH = 60
+WHITESPACE_REGEX = re.compile(r"\s+")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.counts[i] += 1
+
+
+class Registry:
+    """Counters, gauges and histograms rendered in Prometheus text format.
+
+    Series are keyed by metric name plus a tuple of (label, value) pairs.
+    Collectors are callables run at render time that return
+    (name, labels, value) gauge samples, for values owned elsewhere.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._types = {}
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._collectors = []
+
+    def describe(self, name, metric_type, help_text):
+        self._types[name] = metric_type
+        self._help[name] = help_text
+
+    def inc(self, name, labels=(), amount=1):
+        with self._lock:
+            key = (name, tuple(labels))
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, labels=(), value=0):
+        with self._lock:
+            self._gauges[(name, tuple(labels))] = value
+
+    def observe(self, name, labels=(), value=0.0, buckets=DEFAULT_BUCKETS):
+        with self._lock:
+            key = (name, tuple(labels))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        with self._lock:
+            gauges = dict(self._gauges)
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                gauges[(name, tuple(labels))] = value
+
+        with self._lock:
+            by_name = {}
+            for (name, labels), value in self._counters.items():
+                by_name.setdefault(name, []).append(
+                    f"{name}{format_labels(labels)} {value}"
+                )
+            for (name, labels), value in gauges.items():
+                by_name.setdefault(name, []).append(
+                    f"{name}{format_labels(labels)} {value}"
+                )
+            for (name, labels), histogram in self._histograms.items():
+                lines = by_name.setdefault(name, [])
+                for upper_bound, count in zip(histogram.buckets, histogram.counts):
+                    bucket_labels = labels + (("le", upper_bound),)
+                    lines.append(f"{name}_bucket{format_labels(bucket_labels)} {count}")
+                inf_labels = labels + (("le", "+Inf"),)
+                lines.append(
+                    f"{name}_bucket{format_labels(inf_labels)} {histogram.count}"
+                )
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+        output = []
+        for name in sorted(by_name):
+            if name in self._help:
+                output.append(f"# HELP {name} {self._help[name]}")
+                output.append(f"# TYPE {name} {self._types[name]}")
+            output.extend(by_name[name])
+        return "\n".join(output) + "\n"
+
+    def summary(self):
+        """(series, count, average ms, total seconds) for every histogram."""
+        with self._lock:
+            rows = []
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                avg = histogram.sum / histogram.count if histogram.count else 0
+                rows.append(
+                    (
+                        f"{name}{format_labels(labels)}",
+                        histogram.count,
+                        round(avg * 1000, 1),
+                        round(histogram.sum, 3),
+                    )
+                )
+            return rows
+
+
+registry = Registry()
+registry.describe(
+    "slack_handler_duration_seconds", "histogram", "Time spent in each Bolt handler"
+)
+registry.describe(
+    "slack_handler_errors_total", "counter", "Exceptions raised by each Bolt handler"
+)
+registry.describe(
+    "db_query_duration_seconds", "histogram", "Time spent executing each SQL statement"
+)
+registry.describe(
+    "db_query_errors_total", "counter", "SQL statements that raised an error"
+)
+registry.describe(
+    "slack_api_call_duration_seconds",
+    "histogram",
+    "Time spent in each Slack Web API method",
+)
+registry.describe(
+    "slack_api_errors_total", "counter", "Slack Web API calls that returned an error"
+)
+registry.describe(
+    "slack_api_rate_limited_total",
+    "counter",
+    "Slack Web API calls rejected with HTTP 429",
+)
+
+
+def instrument_handler(func):
+    """Time a Bolt listener and count the exceptions it raises.
+
+    functools.wraps keeps the listener's signature visible to Bolt, which
+    picks the arguments to pass (ack, respond, command, ...) from it.
+    Coroutine listeners (AsyncApp) get a coroutine wrapper.
+    """
+    labels = (("handler", func.__name__),)
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                registry.inc("slack_handler_errors_total", labels)
+                raise
+            finally:
+                registry.observe(
+                    "slack_handler_duration_seconds",
+                    labels,
+                    time.perf_counter() - start,
+                )
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            registry.inc("slack_handler_errors_total", labels)
+            raise
+        finally:
+            registry.observe(
+                "slack_handler_duration_seconds", labels, time.perf_counter() - start
+            )
+
+    return wrapper
+
+
+def get_sql_label(sql):
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+    return WHITESPACE_REGEX.sub(" ", str(sql)).strip()[:SQL_LABEL_LENGTH]
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """psycopg2 cursor that times every execute (pass as cursor_factory)."""
+
+    def execute(self, sql, vars=None):
+        labels = (("statement", get_sql_label(sql)),)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, vars)
+        except Exception:
+            registry.inc("db_query_errors_total", labels)
+            raise
+        finally:
+            registry.observe(
+                "db_query_duration_seconds", labels, time.perf_counter() - start
+            )
+
+
+async def timed_query(query_func, sql, *args):
+    """Await an asyncpg query method, e.g. timed_query(conn.fetch, sql, ...).
+
+    Records the same series as InstrumentedCursor.
+    """
+    labels = (("statement", get_sql_label(sql)),)
+    start = time.perf_counter()
+    try:
+        return await query_func(sql, *args)
+    except Exception:
+        registry.inc("db_query_errors_total", labels)
+        raise
+    finally:
+        registry.observe(
+            "db_query_duration_seconds", labels, time.perf_counter() - start
+        )
+
+
+def instrument_web_client(client):
+    """Count and time every Web API call made through this client."""
+    original_api_call = client.api_call
+
+    @functools.wraps(original_api_call)
+    def api_call(api_method, *args, **kwargs):
+        labels = (("method", api_method),)
+        start = time.perf_counter()
+        try:
+            return original_api_call(api_method, *args, **kwargs)
+        except SlackApiError as error:
+            registry.inc("slack_api_errors_total", labels)
+            if error.response is not None and error.response.status_code == 429:
+                registry.inc("slack_api_rate_limited_total", labels)
+            raise
+        finally:
+            registry.observe(
+                "slack_api_call_duration_seconds", labels, time.perf_counter() - start
+            )
+
+    if inspect.iscoroutinefunction(original_api_call):
+
+        @functools.wraps(original_api_call)
+        async def async_api_call(api_method, *args, **kwargs):
+            labels = (("method", api_method),)
+            start = time.perf_counter()
+            try:
+                return await original_api_call(api_method, *args, **kwargs)
+            except SlackApiError as error:
+                registry.inc("slack_api_errors_total", labels)
+                if error.response is not None and error.response.status_code == 429:
+                    registry.inc("slack_api_rate_limited_total", labels)
+                raise
+            finally:
+                registry.observe(
+                    "slack_api_call_duration_seconds",
+                    labels,
+                    time.perf_counter() - start,
+                )
+
+        client.api_call = async_api_call
+        return client
+
+    client.api_call = api_call
+    return client
+
+
+def log_summary_periodically():
+    while True:
+        time.sleep(METRICS_LOG_INTERVAL_SECONDS)
+        for series, count, avg_ms, total_seconds in registry.summary():
+            log.info(
+                "metrics_summary",
+                series=series,
+                count=count,
+                avg_ms=avg_ms,
+                total_seconds=total_seconds,
+            )
+
+
+def start_summary_logging():
+    if METRICS_LOG_INTERVAL_SECONDS > 0:
+        threading.Thread(target=log_summary_periodically, daemon=True).start()
@@ -0,0 +1,355 @@
+"""Microbenchmarks for the game logic and message rendering every command runs.
+
+Each benchmark times one function over generated inputs (random boards,
+tallies with hundreds of targets, rosters, command text) and reports the
+median time per input over many short repeats. `run` saves the results as
+a baseline; `compare` measures again and exits with status 1 if any
+benchmark got more than --threshold and --min-delta slower than its
+baseline. Timings depend on the machine, so the baseline isn't committed -
+make it with `run` on the machine that runs `compare` (e.g. on `main`).
+
+    python microbench.py run                   # write microbench_baseline.json
+    python microbench.py compare               # fail on regressions
+    python microbench.py compare --only tally  # just the benchmarks matching "tally"
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import timeit
+
+from commands import (
+    KILL_STR,
+    PRAYER_STR,
+    format_scoreboard,
+    format_vote_tally,
+    get_kill_target,
+    get_move_result,
+    get_prayer_target,
+    parse_user_mention,
+    parse_vote_operations,
+)
+from leaderboard import Leaderboard
+from position_table import get_position_table
+from roster import Roster
+from tic_tac_game import (
+    TicTacGame,
+    TicTacMove,
+    check_for_win,
+    convert_move_enum_to_str,
+    convert_move_str_to_enum,
+    get_bitboards,
+    get_board_str,
+    get_win_detector,
+)
+from vote_tally import VoteTally
+
+DEFAULT_BASELINE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "microbench_baseline.json"
+)
+# inputs generated per benchmark - each timed run goes through all of them
+NUM_INPUTS = 200
+# random inputs are the same on every run, so runs are comparable
+SEED = 2022
+# the median of many short repeats barely moves when a few of them are
+# slowed down by the machine being busy
+REPEATS = 25
+# each repeat aims to take about this long
+REPEAT_SECONDS = 0.04
+# a benchmark that looks slower is measured this many more times before it
+# counts as a regression - a busy machine can slow several runs in a row
+CONFIRM_RUNS = 4
+
+# name -> setup(rng) returning (func, [args, ...])
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def random_board(rng, num_cells):
+    """A board with a random number of X and O tiles, and a played cell in it."""
+    board_state = [TicTacMove.OPEN] * num_cells
+    num_moves = rng.randint(1, num_cells)
+    played = rng.sample(range(num_cells), num_moves)
+    for move_num, index in enumerate(played):
+        board_state[index] = TicTacMove.X if move_num % 2 == 0 else TicTacMove.O
+    return board_state, played[-1]
+
+
+def random_user_id(rng):
+    return "U" + "".join(
+        rng.choice("ABCDEFGHJKLMNPQRSTUVWXYZ0123456789") for _ in range(8)
+    )
+
+
+def check_for_win_inputs(rng, height, width, win_length):
+    detector = get_win_detector(height, width, win_length)
+    inputs = []
+    for _ in range(NUM_INPUTS):
+        board_state, last_index = random_board(rng, height * width)
+        # games keep their bitboards up to date, so building them isn't
+        # part of a move
+        x_bits, o_bits = get_bitboards(board_state)
+        inputs.append((x_bits, o_bits, last_index, detector))
+    return check_for_win, inputs
+
+
+@benchmark("check_for_win_3x3")
+def bench_check_for_win_3x3(rng):
+    return check_for_win_inputs(rng, 3, 3, 3)
+
+
+@benchmark("check_for_win_15x15")
+def bench_check_for_win_15x15(rng):
+    return check_for_win_inputs(rng, 15, 15, 5)
+
+
+@benchmark("get_move_result_3x3")
+def bench_get_move_result_3x3(rng):
+    # what a 3x3 /tictacmove actually runs - a position table lookup
+    get_position_table()
+    inputs = []
+    for _ in range(NUM_INPUTS):
+        game = TicTacGame("C1", height=3, width=3, win_length=3)
+        game.board_state, last_index = random_board(rng, 9)
+        inputs.append((game, last_index))
+    return get_move_result, inputs
+
+
+@benchmark("get_board_str_3x3")
+def bench_get_board_str_3x3(rng):
+    return get_board_str, [(random_board(rng, 9)[0], 3) for _ in range(NUM_INPUTS)]
+
+
+@benchmark("get_board_str_15x15")
+def bench_get_board_str_15x15(rng):
+    return get_board_str, [(random_board(rng, 225)[0], 15) for _ in range(NUM_INPUTS)]
+
+
+@benchmark("convert_move_str_to_enum")
+def bench_convert_move_str_to_enum(rng):
+    return convert_move_str_to_enum, [
+        (rng.choice(["OPEN", "X", "O"]),) for _ in range(NUM_INPUTS)
+    ]
+
+
+@benchmark("convert_move_enum_to_str")
+def bench_convert_move_enum_to_str(rng):
+    return convert_move_enum_to_str, [
+        (rng.choice(list(TicTacMove)),) for _ in range(NUM_INPUTS)
+    ]
+
+
+@benchmark("format_vote_tally_300_targets")
+def bench_format_vote_tally(rng):
+    # the pinned tally message late in a big game: 300 targets, 1000 voters
+    targets = [f"<@{random_user_id(rng)}>" for _ in range(300)]
+    vote_tally = VoteTally()
+    vote_tally.load(
+        (
+            random_user_id(rng),
+            rng.choice([KILL_STR, PRAYER_STR]),
+            rng.choice(targets),
+        )
+        for _ in range(1000)
+    )
+    return format_vote_tally, [(vote_tally,)]
+
+
+@benchmark("format_scoreboard_500_players")
+def bench_format_scoreboard(rng):
+    leaderboard = Leaderboard()
+    player_ids = [random_user_id(rng) for _ in range(500)]
+    leaderboard.load((player_id, rng.randint(1, 50)) for player_id in player_ids)
+    return format_scoreboard, [
+        (leaderboard, rng.randint(0, 49), rng.choice(player_ids))
+        for _ in range(NUM_INPUTS)
+    ]
+
+
+@benchmark("parse_user_mention")
+def bench_parse_user_mention(rng):
+    # what /kill and /prayto get - mostly mentions, some with the name Slack
+    # adds, and some prayers to a role
+    texts = [
+        lambda: f"<@{random_user_id(rng)}>",
+        lambda: f"<@{random_user_id(rng)}|someone> ",
+        lambda: rng.choice(["zeus", "hera", "apollo"]),
+    ]
+    return parse_user_mention, [(rng.choice(texts)(),) for _ in range(NUM_INPUTS)]
+
+
+def roster_of(rng, num_players):
+    roster = Roster()
+    player_ids = [random_user_id(rng) for _ in range(num_players)]
+    roster.load(
+        (player_id, rng.choice(["zeus", "hera", None]), rng.random() < 0.8)
+        for player_id in player_ids
+    )
+    return roster, player_ids
+
+
+@benchmark("get_kill_target_200_players")
+def bench_get_kill_target(rng):
+    roster, player_ids = roster_of(rng, 200)
+    return get_kill_target, [
+        (f"<@{rng.choice(player_ids)}|someone>", roster) for _ in range(NUM_INPUTS)
+    ]
+
+
+@benchmark("get_prayer_target_200_players")
+def bench_get_prayer_target(rng):
+    roster, player_ids = roster_of(rng, 200)
+    return get_prayer_target, [
+        (rng.choice([f"<@{rng.choice(player_ids)}>", "zeus", "apollo"]), roster)
+        for _ in range(NUM_INPUTS)
+    ]
+
+
+@benchmark("parse_vote_operations_100_lines")
+def bench_parse_vote_operations(rng):
+    roster, player_ids = roster_of(rng, 200)
+    lines = [
+        f"kill <@{rng.choice(player_ids)}> <@{rng.choice(player_ids)}>"
+        for _ in range(100)
+    ]
+    return parse_vote_operations, [("\n".join(lines), roster)]
+
+
+def measure(name):
+    """Return the median seconds per input for benchmark name."""
+    func, inputs = BENCHMARKS[name](random.Random(SEED))
+
+    def run_all():
+        for args in inputs:
+            func(*args)
+
+    timer = timeit.Timer(run_all)
+    # autorange finds a number of runs taking at least 0.2s
+    number, seconds = timer.autorange()
+    number = max(1, round(number * REPEAT_SECONDS / seconds))
+    median = statistics.median(timer.repeat(repeat=REPEATS, number=number))
+    return median / number / len(inputs)
+
+
+def select_benchmarks(only):
+    return [name for name in BENCHMARKS if only is None or only in name]
+
+
+def get_environment():
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+    }
+
+
+def run(args):
+    results = {}
+    # with --only, the other benchmarks keep their old baselines
+    if args.only is not None and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            results = json.load(f)["seconds_per_input"]
+    for name in select_benchmarks(args.only):
+        results[name] = measure(name)
+        print(f"{name}: {results[name] * 1e9:.0f} ns")
+    with open(args.baseline, "w") as f:
+        json.dump(
+            {"environment": get_environment(), "seconds_per_input": results},
+            f,
+            indent=2,
+            sort_keys=True,
+        )
+        f.write("\n")
+    print(f"Saved baseline to {args.baseline}")
+
+
+def is_regression(seconds, baseline_seconds, args):
+    # a tiny benchmark can look much slower from a few ns of noise alone
+    return (
+        seconds > baseline_seconds * (1 + args.threshold)
+        and seconds - baseline_seconds > args.min_delta * 1e-9
+    )
+
+
+def compare(args):
+    if not os.path.exists(args.baseline):
+        print(
+            f"No baseline at {args.baseline} - run `python microbench.py run` "
+            "on this machine first (e.g. on main)"
+        )
+        sys.exit(2)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["environment"] != get_environment():
+        print(
+            f"Warning: baseline was measured on {baseline['environment']}, "
+            f"this is {get_environment()} - timings may not be comparable"
+        )
+
+    regressions = []
+    for name in select_benchmarks(args.only):
+        baseline_seconds = baseline["seconds_per_input"].get(name)
+        if baseline_seconds is None:
+            print(f"{name}: no baseline - run `python microbench.py run` to add it")
+            continue
+        seconds = measure(name)
+        for _ in range(CONFIRM_RUNS):
+            if not is_regression(seconds, baseline_seconds, args):
+                break
+            seconds = min(seconds, measure(name))
+        ratio = seconds / baseline_seconds
+        regressed = is_regression(seconds, baseline_seconds, args)
+        print(
+            f"{name}: {seconds * 1e9:.0f} ns (baseline {baseline_seconds * 1e9:.0f} ns, "
+            f"{ratio:.2f}x){' REGRESSION' if regressed else ''}"
+        )
+        if regressed:
+            regressions.append(name)
+
+    if regressions:
+        print(
+            f"{len(regressions)} benchmark(s) more than {args.threshold:.0%} "
+            f"and {args.min_delta:.0f} ns slower: " + ", ".join(regressions)
+        )
+        sys.exit(1)
+    print("No regressions")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("command", choices=["run", "compare"])
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.5,
+        help="with compare, how much slower than the baseline counts as a regression",
+    )
+    parser.add_argument(
+        "--min-delta",
+        type=float,
+        default=50,
+        help="with compare, the fewest nanoseconds per input slower that count as a regression",
+    )
+    parser.add_argument("--only", help="only run benchmarks whose name contains this")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
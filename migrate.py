@@ -0,0 +1,146 @@
+"""Versioned schema migrations for the app's Postgres database.
+
+Applies each SQL file in migrations/ that hasn't been applied yet, in
+filename order and one transaction per file, and records it in the
+schema_migrations table. app.py and async_app.py run this on startup, and
+Heroku runs it as the release phase before new dynos start.
+
+    python migrate.py                       # apply pending migrations
+    python migrate.py --status              # list applied and pending migrations
+    python migrate.py --explain [--analyze] # show the plan of every per-command query
+"""
+
+import argparse
+import os
+
+import psycopg2
+
+from log import get_logger
+from prepared_statements import SAMPLE_CALLS
+
+log = get_logger("migrate")
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+# any constant works - it only has to be the same for every dyno, so two
+# dynos starting at once apply the migrations one after the other
+MIGRATION_LOCK_ID = 2022_0131
+
+CREATE_MIGRATIONS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS schema_migrations (
+    version text PRIMARY KEY,
+    applied_at timestamp NOT NULL DEFAULT now()
+);"""
+
+
+def get_migrations():
+    """Return [(version, path)] for every migration file, oldest first."""
+    return [
+        (filename[: -len(".sql")], os.path.join(MIGRATIONS_DIR, filename))
+        for filename in sorted(os.listdir(MIGRATIONS_DIR))
+        if filename.endswith(".sql")
+    ]
+
+
+def get_applied_versions(cur):
+    cur.execute(CREATE_MIGRATIONS_TABLE_SQL)
+    cur.execute("SELECT version FROM schema_migrations;")
+    return {row[0] for row in cur.fetchall()}
+
+
+def migrate(database_url):
+    """Apply every pending migration, returning the versions applied."""
+    conn = psycopg2.connect(database_url)
+    applied_now = []
+    try:
+        cur = conn.cursor()
+        # session-level, so it is held across the per-migration commits
+        cur.execute("SELECT pg_advisory_lock(%s);", [MIGRATION_LOCK_ID])
+        applied = get_applied_versions(cur)
+        conn.commit()
+        for version, path in get_migrations():
+            if version in applied:
+                continue
+            with open(path) as f:
+                cur.execute(f.read())
+            cur.execute("INSERT INTO schema_migrations(version) VALUES(%s);", [version])
+            conn.commit()
+            applied_now.append(version)
+            log.info("migration_applied", version=version)
+        cur.execute("SELECT pg_advisory_unlock(%s);", [MIGRATION_LOCK_ID])
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    return applied_now
+
+
+def show_status(database_url):
+    conn = psycopg2.connect(database_url)
+    try:
+        cur = conn.cursor()
+        applied = get_applied_versions(cur)
+        conn.rollback()
+        for version, path in get_migrations():
+            print(f"{'applied' if version in applied else 'pending'}  {version}")
+        cur.close()
+    finally:
+        conn.close()
+
+
+def explain(database_url, analyze=False):
+    """Print the plan Postgres picks for each statement the app runs per
+    command (see prepared_statements.py), with its sample parameters.
+
+    With analyze the statements really run (so the plan shows actual rows
+    and buffers), inside a transaction that is rolled back afterwards.
+    """
+    options = "ANALYZE, BUFFERS" if analyze else "COSTS"
+    conn = psycopg2.connect(database_url)
+    try:
+        cur = conn.cursor()
+        for statement, params in SAMPLE_CALLS:
+            cur.execute(
+                f"EXPLAIN ({options}) {statement.adhoc_sql}",
+                statement.get_adhoc_params(params),
+            )
+            print(f"-- {statement.name}")
+            for (line,) in cur.fetchall():
+                print(line)
+            print()
+        conn.rollback()
+        cur.close()
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--database-url",
+        default=os.environ.get("DATABASE_URL"),
+        help="defaults to DATABASE_URL",
+    )
+    parser.add_argument("--status", action="store_true")
+    parser.add_argument("--explain", action="store_true")
+    parser.add_argument(
+        "--analyze",
+        action="store_true",
+        help="with --explain, run the queries (then roll back) for actual timings",
+    )
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("set DATABASE_URL or pass --database-url")
+
+    if args.status:
+        show_status(args.database_url)
+    elif args.explain:
+        explain(args.database_url, analyze=args.analyze)
+    else:
+        applied_now = migrate(args.database_url)
+        for version in applied_now:
+            print(f"Applied migration {version}")
+        if not applied_now:
+            print("Schema is up to date")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+-- the tables the app started with, which were first created by hand -
+-- IF NOT EXISTS lets this run against that hand-made schema too
+DO $$
+BEGIN
+    CREATE TYPE vote_type AS ENUM ('prayer', 'kill');
+EXCEPTION
+    WHEN duplicate_object THEN NULL;
+END
+$$;
+
+CREATE TABLE IF NOT EXISTS votes (
+    voter_user_id text PRIMARY KEY,
+    voter_name text,
+    target_name text,
+    vote_type vote_type,
+    votecast_time timestamp DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS tic_tac_win (
+    player_id text PRIMARY KEY,
+    num_wins integer NOT NULL
+);
@@ -0,0 +1,12 @@
+-- one row per channel's game, board packed 2 bits per square
+-- (replaces tic_tac_board and tic_tac_curr_team, which are left in place)
+CREATE TABLE IF NOT EXISTS tic_tac_game (
+    game_id text PRIMARY KEY,
+    height integer NOT NULL,
+    width integer NOT NULL,
+    win_length integer NOT NULL,
+    cells bytea NOT NULL,
+    curr_team text NOT NULL,
+    move_count integer NOT NULL DEFAULT 0,
+    version bigint NOT NULL DEFAULT 0
+);
@@ -0,0 +1,12 @@
+-- the vote tally counts votes per target within a vote type
+-- (WHERE vote_type = ... GROUP BY target_name, or GROUP BY both), which
+-- this index answers with an index-only scan
+CREATE INDEX IF NOT EXISTS votes_vote_type_target_name_idx
+    ON votes (vote_type, target_name);
+
+-- scoreboard pages read the top players in (num_wins DESC, player_id)
+-- order, the same order as the in-memory leaderboard - player_id makes
+-- it covering and breaks ties the same way
+DROP INDEX IF EXISTS tic_tac_win_num_wins_idx;
+CREATE INDEX IF NOT EXISTS tic_tac_win_num_wins_player_id_idx
+    ON tic_tac_win (num_wins DESC, player_id);
@@ -0,0 +1,10 @@
+-- request keys (event_id / trigger_id) claimed by any dyno, so a Slack
+-- retry that lands on a different dyno than the first attempt is still
+-- recognized - see request_dedup.py, which also prunes old rows
+CREATE TABLE IF NOT EXISTS slack_requests (
+    request_key text PRIMARY KEY,
+    received_at timestamp NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS slack_requests_received_at_idx
+    ON slack_requests (received_at);
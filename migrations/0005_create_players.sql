@@ -0,0 +1,8 @@
+-- the mafia game's roster, managed by moderators with /roster - /kill and
+-- /prayto targets are checked against the living players (roster.py)
+CREATE TABLE IF NOT EXISTS players (
+    player_id text PRIMARY KEY,
+    role text,
+    alive boolean NOT NULL DEFAULT true,
+    updated_at timestamp NOT NULL DEFAULT now()
+);
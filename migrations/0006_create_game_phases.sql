@@ -0,0 +1,33 @@
+-- game days, opened with /startday and closed with /endday - at most one
+-- is open at a time
+CREATE TABLE IF NOT EXISTS game_phases (
+    day_num integer PRIMARY KEY,
+    started_at timestamp NOT NULL DEFAULT now(),
+    ended_at timestamp
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS game_phases_one_open_idx
+    ON game_phases ((true)) WHERE ended_at IS NULL;
+
+-- every vote that was live when a day ended; votes itself only holds the
+-- current day. /startday creates each day's partition (votes_history_day_N),
+-- which /endday then fills, so old days can be detached or dropped without
+-- touching the rest
+CREATE TABLE IF NOT EXISTS votes_history (
+    day_num integer NOT NULL,
+    voter_user_id text NOT NULL,
+    voter_name text,
+    target_name text,
+    vote_type vote_type,
+    votecast_time timestamp,
+    PRIMARY KEY (day_num, voter_user_id)
+) PARTITION BY LIST (day_num);
+
+-- each day's final tally, counted once when the day ends
+CREATE TABLE IF NOT EXISTS phase_results (
+    day_num integer NOT NULL REFERENCES game_phases (day_num),
+    vote_type vote_type NOT NULL,
+    target_name text NOT NULL,
+    num_votes integer NOT NULL,
+    PRIMARY KEY (day_num, vote_type, target_name)
+);
@@ -0,0 +1,138 @@
+import threading
+import time
+
+from log import get_logger
+from tic_tac_game import (
+    TIE_STR,
+    TicTacMove,
+    check_for_win,
+    get_bitboards,
+    get_board_str,
+    get_win_detector,
+)
+
+log = get_logger("position_table")
+
+# the table only covers classic tic tac toe
+TABLE_HEIGHT = 3
+TABLE_WIDTH = 3
+TABLE_WIN_LENGTH = 3
+TABLE_NUM_CELLS = TABLE_HEIGHT * TABLE_WIDTH
+
+
+def get_position_index(board_state):
+    # base 3 number with one digit per square (0 = OPEN, 1 = X, 2 = O)
+    index = 0
+    for tile in reversed(board_state):
+        index = index * 3 + (tile.value - 1)
+    return index
+
+
+class PositionTable:
+    """Every reachable 3x3 position, solved once.
+
+    Positions are numbered by get_position_index (3^9 of them), and for each
+    reachable one the table stores the game status, the rendered board and -
+    for every team that can be on move there - the minimax best move, so
+    moves, hints and bot replies never search at request time.
+    """
+
+    def __init__(self):
+        start = time.perf_counter()
+        self._detector = get_win_detector(TABLE_HEIGHT, TABLE_WIDTH, TABLE_WIN_LENGTH)
+        # index -> True (won), TIE_STR or False (still going)
+        self._status = {}
+        # index -> rendered board
+        self._board_strs = {}
+        # (index, team on move) -> minimax score, doubles as the transposition table
+        self._scores = {}
+        # (index, team on move) -> best square to play
+        self._best_moves = {}
+
+        empty = [TicTacMove.OPEN] * TABLE_NUM_CELLS
+        self._add_position(empty, False)
+        # a new game can start with either team, depending on who moved last
+        for first_team in (TicTacMove.X, TicTacMove.O):
+            self._solve(empty, first_team)
+        log.info(
+            "position_table_built",
+            num_positions=len(self._status),
+            seconds=round(time.perf_counter() - start, 3),
+        )
+
+    def _add_position(self, board_state, status):
+        index = get_position_index(board_state)
+        if index not in self._status:
+            self._status[index] = status
+            self._board_strs[index] = get_board_str(board_state, TABLE_WIDTH)
+        return index
+
+    def _solve(self, board_state, to_move):
+        index = get_position_index(board_state)
+        key = (index, to_move)
+        if key in self._scores:
+            return self._scores[key]
+
+        best_score = None
+        best_move = None
+        num_open = board_state.count(TicTacMove.OPEN)
+        for square in range(TABLE_NUM_CELLS):
+            if board_state[square] != TicTacMove.OPEN:
+                continue
+            board_state[square] = to_move
+            # built from the list here - this only runs once, at startup
+            x_bits, o_bits = get_bitboards(board_state)
+            whether_won, winner = check_for_win(x_bits, o_bits, square, self._detector)
+            self._add_position(board_state, whether_won)
+            if whether_won == True:
+                # scores are from X's point of view, and quicker wins score higher
+                score = num_open if to_move == TicTacMove.X else -num_open
+            elif whether_won == TIE_STR:
+                score = 0
+            else:
+                score = self._solve(board_state, TicTacMove.get_opposite(to_move))
+            board_state[square] = TicTacMove.OPEN
+
+            if (
+                best_score is None
+                or (to_move == TicTacMove.X and score > best_score)
+                or (to_move == TicTacMove.O and score < best_score)
+            ):
+                best_score = score
+                best_move = square
+
+        self._scores[key] = best_score
+        self._best_moves[key] = best_move
+        return best_score
+
+    def covers(self, game):
+        return (
+            game.height == TABLE_HEIGHT
+            and game.width == TABLE_WIDTH
+            and game.win_length == TABLE_WIN_LENGTH
+        )
+
+    # the lookups below return None for positions that can't come up in a real game
+
+    def get_status(self, board_state):
+        return self._status.get(get_position_index(board_state))
+
+    def get_board_str(self, board_state):
+        return self._board_strs.get(get_position_index(board_state))
+
+    def get_best_move(self, board_state, to_move):
+        return self._best_moves.get((get_position_index(board_state), to_move))
+
+
+_position_table = None
+_position_table_lock = threading.Lock()
+
+
+def get_position_table():
+    # built on first use (about half a second) and shared afterwards
+    global _position_table
+    if _position_table is None:
+        with _position_table_lock:
+            if _position_table is None:
+                _position_table = PositionTable()
+    return _position_table
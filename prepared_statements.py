@@ -0,0 +1,344 @@
+"""The SQL app.py and async_app.py run, as server-side prepared statements.
+
+Each PreparedStatement is PREPAREd the first time a connection runs it and
+EXECUTEd by name with bound parameters after that, so Postgres parses and
+plans it once per connection instead of on every call. (async_app.py runs
+each one's .sql and gets the same from asyncpg, which prepares and caches
+every statement itself.)
+
+    python prepared_statements.py --database-url postgresql://localhost/postgres
+
+times every statement below run ad hoc against run prepared, inside a
+transaction that is rolled back afterwards.
+"""
+
+import argparse
+import os
+import re
+import time
+
+import psycopg2
+import psycopg2.errors
+
+# prepared statements belong to a server session, which a pooler like
+# PgBouncer in transaction mode doesn't keep - set to 0 behind one
+DB_PREPARED_STATEMENTS_ENABLED = (
+    os.environ.get("DB_PREPARED_STATEMENTS_ENABLED", "1") == "1"
+)
+
+PARAM_REGEX = re.compile(r"\$(\d+)")
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that remembers what has been prepared on it
+    (pass as connection_factory)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statement_names = set()
+
+
+class PreparedStatement:
+    """One statement, written with $1, $2... placeholders and run by name.
+
+    The connection has to be a PreparingConnection - PREPARE isn't undone
+    by a rollback, so a statement stays prepared for the connection's life.
+    """
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+        # the order the parameters appear in, for running it ad hoc with %s
+        self._param_order = [int(num) - 1 for num in PARAM_REGEX.findall(sql)]
+        self.adhoc_sql = PARAM_REGEX.sub("%s", sql)
+        num_params = max(self._param_order, default=-1) + 1
+        self._execute_sql = f"EXECUTE {name}"
+        if num_params:
+            self._execute_sql += f"({', '.join(['%s'] * num_params)})"
+
+    def get_sql(self, cur):
+        """The statement to run with get_params(params), preparing it on
+        cur's connection first if it hasn't been yet."""
+        if not DB_PREPARED_STATEMENTS_ENABLED:
+            return self.adhoc_sql
+        prepared = cur.connection.prepared_statement_names
+        if self.name not in prepared:
+            cur.execute(f"PREPARE {self.name} AS {self.sql}")
+            prepared.add(self.name)
+        return self._execute_sql + ";"
+
+    def get_params(self, params):
+        if not DB_PREPARED_STATEMENTS_ENABLED:
+            return self.get_adhoc_params(params)
+        return list(params)
+
+    def get_adhoc_params(self, params):
+        """params in the order adhoc_sql's %s placeholders take them."""
+        return [params[index] for index in self._param_order]
+
+    def execute(self, cur, params=()):
+        execute_together(cur, [(self, params)])
+
+
+def execute_together(cur, calls):
+    """Run [(statement, params)] in one round trip - the results are the
+    last statement's."""
+    sql = "".join(statement.get_sql(cur) for statement, _ in calls)
+    all_params = []
+    for statement, params in calls:
+        all_params += statement.get_params(params)
+    try:
+        cur.execute(sql, all_params)
+    except psycopg2.errors.InvalidSqlStatementName:
+        # something deallocated them (e.g. DISCARD ALL) - prepare again
+        # next time rather than failing on this connection forever
+        cur.connection.prepared_statement_names.clear()
+        raise
+
+
+# each voter has one row - a vote only replaces an older one, so a vote
+# replayed from the journal (or two dynos' votes arriving out of order)
+# can't undo a newer vote. The batch is sent as one array per column so
+# any number of votes is the same statement.
+CAST_VOTES = PreparedStatement(
+    "cast_votes",
+    """INSERT INTO votes(target_name, voter_name, vote_type, voter_user_id, votecast_time)
+         SELECT target_name, voter_name, vote_type::vote_type, voter_user_id, to_timestamp(cast_at)
+           FROM unnest($1::text[], $2::text[], $3::text[], $4::text[], $5::float8[])
+             AS batch(target_name, voter_name, vote_type, voter_user_id, cast_at)
+         ON CONFLICT (voter_user_id)
+         DO UPDATE
+            SET target_name = excluded.target_name,
+                vote_type = excluded.vote_type,
+                votecast_time = excluded.votecast_time,
+                voter_user_id = excluded.voter_user_id,
+                voter_name = excluded.voter_name
+          WHERE votes.votecast_time <= excluded.votecast_time
+         RETURNING voter_user_id, vote_type, target_name;""",
+)
+LOAD_VOTES = PreparedStatement(
+    "load_votes",
+    "SELECT voter_user_id, vote_type, target_name FROM votes ORDER BY votecast_time ASC;",
+)
+COUNT_VOTES = PreparedStatement(
+    "count_votes",
+    "SELECT vote_type, target_name, COUNT(*) FROM votes GROUP BY vote_type, target_name;",
+)
+CREATE_GAME = PreparedStatement(
+    "create_game",
+    """INSERT INTO tic_tac_game(game_id, height, width, win_length, cells, curr_team, move_count, version)
+         VALUES($1, $2, $3, $4, $5, $6, 0, 0)
+         ON CONFLICT (game_id) DO NOTHING;""",
+)
+GET_GAME = PreparedStatement(
+    "get_game",
+    """SELECT height, width, win_length, cells, curr_team, move_count, version
+         FROM tic_tac_game
+         WHERE game_id = $1;""",
+)
+LOCK_GAME = PreparedStatement(
+    "lock_game",
+    """SELECT height, width, win_length, cells, curr_team, move_count, version
+         FROM tic_tac_game
+         WHERE game_id = $1 FOR UPDATE;""",
+)
+SAVE_GAME = PreparedStatement(
+    "save_game",
+    """UPDATE tic_tac_game
+          SET height = $1,
+              width = $2,
+              win_length = $3,
+              cells = $4,
+              curr_team = $5,
+              move_count = $6,
+              version = version + 1
+        WHERE game_id = $7;""",
+)
+RECORD_WIN = PreparedStatement(
+    "record_win",
+    """INSERT INTO tic_tac_win(player_id, num_wins)
+         VALUES($1, 1)
+         ON CONFLICT (player_id)
+         DO UPDATE
+            SET num_wins = tic_tac_win.num_wins + 1
+         RETURNING num_wins;""",
+)
+
+# everything above, for preparing a connection up front
+PREPARED_STATEMENTS = [
+    CAST_VOTES,
+    LOAD_VOTES,
+    COUNT_VOTES,
+    CREATE_GAME,
+    GET_GAME,
+    LOCK_GAME,
+    SAVE_GAME,
+    RECORD_WIN,
+]
+
+# the rest run at startup, per moderator command or in the background, so
+# they're only prepared on a connection the first time it runs them
+
+LOAD_WINS = PreparedStatement(
+    "load_wins", "SELECT player_id, num_wins FROM tic_tac_win;"
+)
+LOAD_GAMES = PreparedStatement(
+    "load_games",
+    """SELECT game_id, height, width, win_length, cells, curr_team, move_count, version
+         FROM tic_tac_game;""",
+)
+# /modvotes
+DELETE_ALL_VOTES = PreparedStatement("delete_all_votes", "DELETE FROM votes;")
+DELETE_VOTES = PreparedStatement(
+    "delete_votes", "DELETE FROM votes WHERE voter_user_id = ANY($1::text[]);"
+)
+# /roster - adding a player who is already on the roster brings them back to
+# life, keeping their role unless a new one is given
+ADD_PLAYER = PreparedStatement(
+    "add_player",
+    """INSERT INTO players(player_id, role, alive)
+         VALUES($1, $2, true)
+         ON CONFLICT (player_id)
+         DO UPDATE
+            SET role = COALESCE(excluded.role, players.role),
+                alive = true,
+                updated_at = now()
+         RETURNING role, alive;""",
+)
+SET_PLAYER_ALIVE = PreparedStatement(
+    "set_player_alive",
+    """UPDATE players
+          SET alive = $1,
+              updated_at = now()
+        WHERE player_id = $2
+       RETURNING role, alive;""",
+)
+LOAD_PLAYERS = PreparedStatement(
+    "load_players", "SELECT player_id, role, alive FROM players;"
+)
+# /startday and /endday - a second /startday racing the first fails on the
+# open-day index
+GET_OPEN_DAY = PreparedStatement(
+    "get_open_day", "SELECT day_num FROM game_phases WHERE ended_at IS NULL;"
+)
+LOCK_OPEN_DAY = PreparedStatement(
+    "lock_open_day",
+    "SELECT day_num FROM game_phases WHERE ended_at IS NULL FOR UPDATE;",
+)
+START_DAY = PreparedStatement(
+    "start_day",
+    """INSERT INTO game_phases(day_num)
+         SELECT COALESCE(MAX(day_num), 0) + 1 FROM game_phases
+         RETURNING day_num;""",
+)
+# moves the live votes into the day's votes_history partition and counts
+# them into phase_results - one statement, so a vote can't land between
+# the copy and the delete
+END_DAY = PreparedStatement(
+    "end_day",
+    """WITH ended_votes AS (
+            DELETE FROM votes
+            RETURNING voter_user_id, voter_name, target_name, vote_type, votecast_time
+         ), archived_votes AS (
+            INSERT INTO votes_history(day_num, voter_user_id, voter_name, target_name, vote_type, votecast_time)
+            SELECT $1::integer, voter_user_id, voter_name, target_name, vote_type, votecast_time
+              FROM ended_votes
+         )
+         INSERT INTO phase_results(day_num, vote_type, target_name, num_votes)
+         SELECT $1::integer, vote_type, target_name, COUNT(*)
+           FROM ended_votes
+          GROUP BY vote_type, target_name
+         RETURNING vote_type, target_name, num_votes;""",
+)
+CLOSE_DAY = PreparedStatement(
+    "close_day", "UPDATE game_phases SET ended_at = now() WHERE day_num = $1;"
+)
+# a finished day's results - the last finished day when no day is given
+DAY_RESULTS = PreparedStatement(
+    "day_results",
+    """SELECT game_phases.day_num, vote_type, target_name, num_votes
+         FROM game_phases
+         LEFT JOIN phase_results USING (day_num)
+        WHERE game_phases.ended_at IS NOT NULL
+          AND game_phases.day_num = COALESCE(
+              $1::integer,
+              (SELECT MAX(day_num) FROM game_phases WHERE ended_at IS NOT NULL)
+          );""",
+)
+# see request_dedup.py
+CLAIM_REQUEST = PreparedStatement(
+    "claim_request",
+    """INSERT INTO slack_requests(request_key)
+         VALUES($1)
+         ON CONFLICT (request_key) DO NOTHING;""",
+)
+PRUNE_REQUESTS = PreparedStatement(
+    "prune_requests",
+    """DELETE FROM slack_requests
+        WHERE received_at < now() - $1 * interval '1 second';""",
+)
+
+# (statement, sample parameters) for the timing comparison, and for
+# migrate.py --explain
+SAMPLE_CALLS = [
+    (
+        CAST_VOTES,
+        [["<@UBENCH2>"], ["bench"], ["kill"], ["UBENCH1"], [1_650_000_000.0]],
+    ),
+    (LOAD_VOTES, []),
+    (COUNT_VOTES, []),
+    (CREATE_GAME, ["CBENCH", 3, 3, 3, b"\x00\x00\x00", "X"]),
+    (GET_GAME, ["CBENCH"]),
+    (LOCK_GAME, ["CBENCH"]),
+    (SAVE_GAME, [3, 3, 3, b"\x00\x00\x00", "X", 0, "CBENCH"]),
+    (RECORD_WIN, ["UBENCH1"]),
+]
+
+
+def compare_timings(database_url, iterations):
+    """Print the mean time per call of each statement run ad hoc and prepared."""
+    conn = psycopg2.connect(database_url, connection_factory=PreparingConnection)
+    try:
+        cur = conn.cursor()
+        for statement, params in SAMPLE_CALLS:
+            adhoc_sql = statement.adhoc_sql
+            adhoc_params = statement.get_adhoc_params(params)
+            # PREPAREs it, and takes the first row's insert out of the timings
+            prepared_sql = statement.get_sql(cur)
+            cur.execute(prepared_sql, params)
+            adhoc = prepared = 0.0
+            # alternated, so both pay the same for the dead rows that
+            # repeated upserts pile up
+            for _ in range(iterations):
+                start = time.perf_counter()
+                cur.execute(adhoc_sql, adhoc_params)
+                adhoc += time.perf_counter() - start
+                start = time.perf_counter()
+                cur.execute(prepared_sql, params)
+                prepared += time.perf_counter() - start
+            print(
+                f"{statement.name}: ad hoc {adhoc / iterations * 1e6:.0f} us, prepared "
+                f"{prepared / iterations * 1e6:.0f} us ({adhoc / prepared:.2f}x)"
+            )
+        conn.rollback()
+        cur.close()
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--database-url",
+        default=os.environ.get("DATABASE_URL"),
+        help="defaults to DATABASE_URL - the schema must be migrated",
+    )
+    parser.add_argument("--iterations", type=int, default=1000)
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("set DATABASE_URL or pass --database-url")
+    compare_timings(args.database_url, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from log import get_logger
+from metrics import registry
+from prepared_statements import CLAIM_REQUEST
+
+log = get_logger("request_dedup")
+
+# Slack retries a request it didn't get an ack for up to 3 times, the last
+# one about 5 minutes after the first
+REQUEST_DEDUP_TTL_SECONDS = float(os.environ.get("REQUEST_DEDUP_TTL_SECONDS", 600))
+REQUEST_DEDUP_MAX_ENTRIES = int(os.environ.get("REQUEST_DEDUP_MAX_ENTRIES", 10000))
+# turn on when running more than one web dyno - a retry can land on a
+# different dyno than the first attempt, so keys are also claimed in the
+# slack_requests table
+REQUEST_DEDUP_DATABASE_ENABLED = (
+    os.environ.get("REQUEST_DEDUP_DATABASE_ENABLED", "0") == "1"
+)
+
+
+def get_request_key(body):
+    """Slack's ID for a request - every retry of it carries the same one.
+
+    Events have an event_id, slash commands and interactions a trigger_id.
+    Returns None for anything else, which is never deduplicated.
+    """
+    for field in ("event_id", "trigger_id"):
+        if body.get(field):
+            return f"{field}:{body[field]}"
+    return None
+
+
+def get_retry_reason(headers):
+    # Bolt lower-cases header names and keeps every value in a list
+    if not headers.get("x-slack-retry-num"):
+        return None
+    return (headers.get("x-slack-retry-reason") or ["unknown"])[0]
+
+
+class RecentRequests:
+    """Request keys seen in the last ttl seconds, oldest dropped first.
+
+    Holds at most max_entries keys, so a burst can push a key out early -
+    its retry is then handled as if it were new, like before this existed.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._seen_at = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, key):
+        """Remember key, returning False if it was already seen."""
+        now = time.monotonic()
+        with self._lock:
+            seen_at = self._seen_at.get(key)
+            if seen_at is not None and now - seen_at < self._ttl:
+                return False
+            self._seen_at[key] = now
+            self._seen_at.move_to_end(key)
+            # keys are in the order they were claimed, so expired ones are
+            # all at the front
+            while self._seen_at:
+                oldest_key, oldest_at = next(iter(self._seen_at.items()))
+                if (
+                    now - oldest_at < self._ttl
+                    and len(self._seen_at) <= self._max_entries
+                ):
+                    break
+                self._seen_at.popitem(last=False)
+            return True
+
+    def __len__(self):
+        return len(self._seen_at)
+
+
+def claim_request_in_database(cur, key):
+    """Claim key in the slack_requests table, returning False if another
+    process (or this one, before a restart) already has."""
+    CLAIM_REQUEST.execute(cur, [key])
+    return cur.rowcount == 1
+
+
+def record_repeated_request(key, retry_reason):
+    registry.inc(
+        "slack_requests_deduplicated_total",
+        (("retry_reason", retry_reason or "none"),),
+    )
+    log.info("repeated_request_skipped", request_key=key, retry_reason=retry_reason)
+
+
+registry.describe(
+    "slack_requests_deduplicated_total",
+    "counter",
+    "Repeated Slack requests acked without running their handler again",
+)
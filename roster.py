@@ -0,0 +1,69 @@
+import threading
+
+
+class Roster:
+    """Players in the mafia game and their roles, mirrored from the players table.
+
+    Alive players and the roles they hold are kept in sets, so checking a
+    /kill or /prayto target is a constant-time lookup that runs before any
+    database write.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # player_id -> (role, alive)
+        self._players = {}
+        self._alive = set()
+        # upper-cased role -> alive players holding it
+        self._alive_by_role = {}
+        self.loaded = False
+
+    def load(self, rows):
+        """Replace the roster with rows of (player_id, role, alive)."""
+        with self._lock:
+            self._players = {}
+            self._alive = set()
+            self._alive_by_role = {}
+            for player_id, role, alive in rows:
+                self._set_player(player_id, role, alive)
+            self.loaded = True
+
+    def set_player(self, player_id, role, alive):
+        """Store a player's whole row, so applying one twice is harmless."""
+        with self._lock:
+            self._set_player(player_id, role, alive)
+
+    def _set_player(self, player_id, role, alive):
+        old_role, old_alive = self._players.get(player_id, (None, False))
+        if old_alive:
+            self._alive.discard(player_id)
+            if old_role:
+                holders = self._alive_by_role[old_role.upper()]
+                holders.discard(player_id)
+                if not holders:
+                    del self._alive_by_role[old_role.upper()]
+        self._players[player_id] = (role, alive)
+        if alive:
+            self._alive.add(player_id)
+            if role:
+                self._alive_by_role.setdefault(role.upper(), set()).add(player_id)
+
+    def is_empty(self):
+        return not self._players
+
+    def is_alive(self, player_id):
+        return player_id in self._alive
+
+    def is_alive_role(self, role):
+        return role.upper() in self._alive_by_role
+
+    def get_players(self):
+        """Return [(player_id, role, alive)] with the living first."""
+        with self._lock:
+            return sorted(
+                (
+                    (player_id, role, alive)
+                    for player_id, (role, alive) in self._players.items()
+                ),
+                key=lambda player: (not player[2], player[0]),
+            )
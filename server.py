@@ -0,0 +1,84 @@
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from slack_bolt.request import BoltRequest
+
+from log import get_logger
+from metrics import registry
+
+log = get_logger("server")
+
+SLACK_EVENTS_PATH = "/slack/events"
+METRICS_PATH = "/metrics"
+# 200 once startup has warmed the app up, 503 until then
+READY_PATH = "/ready"
+
+
+def make_request_handler(app, startup):
+    class SlackRequestHandler(BaseHTTPRequestHandler):
+        """Serves Slack requests plus the app's own GET endpoints on one port.
+
+        Mirrors Bolt's development server, except that every request gets
+        its own thread.
+        """
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            request_path, _, _ = self.path.partition("?")
+            if request_path == METRICS_PATH:
+                self._send_response(
+                    200,
+                    {"Content-Type": ["text/plain; version=0.0.4"]},
+                    registry.render(),
+                )
+            elif request_path == READY_PATH:
+                if startup.is_ready():
+                    self._send_response(200, {}, "ready")
+                else:
+                    self._send_response(503, {}, "starting")
+            else:
+                self._send_response(404, {})
+
+        def do_POST(self):
+            request_path, _, query = self.path.partition("?")
+            if request_path != SLACK_EVENTS_PATH:
+                self._send_response(404, {})
+                return
+
+            len_header = self.headers.get("Content-Length") or 0
+            request_body = self.rfile.read(int(len_header)).decode("utf-8")
+            bolt_req = BoltRequest(
+                body=request_body,
+                query=query,
+                # email.message.Message's mapping interface is dict compatible
+                headers=self.headers,
+            )
+            bolt_resp = app.dispatch(bolt_req)
+            self._send_response(bolt_resp.status, bolt_resp.headers, bolt_resp.body)
+
+        def _send_response(self, status, headers, body=""):
+            self.send_response(status)
+            response_body = body if isinstance(body, str) else json.dumps(body)
+            body_bytes = response_body.encode("utf-8")
+            for key, values in headers.items():
+                for value in values:
+                    self.send_header(key, value)
+            self.send_header("Content-Length", str(len(body_bytes)))
+            self.end_headers()
+            self.wfile.write(body_bytes)
+
+    return SlackRequestHandler
+
+
+class SlackHTTPServer(ThreadingHTTPServer):
+    # pending connections the OS holds before resetting new ones - the
+    # socketserver default of 5 is overflowed by a burst of slash commands
+    request_queue_size = 128
+
+
+def start(app, port, startup):
+    server = SlackHTTPServer(("0.0.0.0", port), make_request_handler(app, startup))
+    log.info("server_started", port=port)
+    server.serve_forever()
@@ -0,0 +1,25 @@
+import urllib.request
+
+# vote imports are a few hundred short lines at most
+MAX_TEXT_FILE_BYTES = 1_000_000
+
+
+class SlackFileError(Exception):
+    pass
+
+
+def download_text_file(client, file_id, max_bytes=MAX_TEXT_FILE_BYTES):
+    """Return the text of a file shared in Slack (needs the files:read scope)."""
+    file_info = client.files_info(file=file_id)["file"]
+    if file_info.get("size", 0) > max_bytes:
+        raise SlackFileError(f"{file_info.get('name', file_id)} is too big to import")
+    # private file URLs take the bot token as a bearer token
+    request = urllib.request.Request(
+        file_info["url_private_download"],
+        headers={"Authorization": f"Bearer {client.token}"},
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        data = response.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise SlackFileError(f"{file_info.get('name', file_id)} is too big to import")
+    return data.decode("utf-8")
@@ -0,0 +1,109 @@
+"""Cold start: what runs between the dyno booting and the app being warm.
+
+The apps start serving as soon as the port is bound, and warm up (migrations,
+database connections, caches, the user directory) concurrently behind it.
+Each step is timed; when the last one finishes the app is marked ready, GET
+/ready starts returning 200, and one startup_complete event logs how long
+every step took.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from log import get_logger
+from metrics import registry
+
+# set when the app first imports this module, so its other imports are timed
+PROCESS_STARTED_AT = time.monotonic()
+
+log = get_logger("startup")
+
+# startups slower than this log a warning - the first commands are slow
+# until the app is warm
+STARTUP_TARGET_SECONDS = float(os.environ.get("STARTUP_TARGET_SECONDS", 10))
+# how long a Slack request that arrives mid warm-up waits for it, before
+# being handled anyway (anything still cold is loaded on demand)
+STARTUP_READY_WAIT_SECONDS = float(os.environ.get("STARTUP_READY_WAIT_SECONDS", 2))
+
+
+class Startup:
+    """Times the steps of startup and says whether the app is warm yet."""
+
+    def __init__(self):
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        # step name -> seconds, in the order the steps finished
+        self.timings = {"imports": time.monotonic() - PROCESS_STARTED_AT}
+
+    @contextmanager
+    def step(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.timings[name] = time.monotonic() - start
+
+    def run_in_parallel(self, steps):
+        """Run {name: func} on a thread each and wait for all of them - a
+        step that raises is logged and the others carry on."""
+
+        def run(name, func):
+            with self.step(name):
+                try:
+                    func()
+                except Exception as error:
+                    log.error("startup_step_failed", step=name, error=error)
+
+        with ThreadPoolExecutor(max_workers=len(steps)) as executor:
+            for name, func in steps.items():
+                executor.submit(run, name, func)
+
+    async def run_concurrently(self, steps):
+        """run_in_parallel for {name: coroutine} on the running event loop."""
+
+        async def run(name, coroutine):
+            with self.step(name):
+                try:
+                    await coroutine
+                except Exception as error:
+                    log.error("startup_step_failed", step=name, error=error)
+
+        await asyncio.gather(*(run(name, coro) for name, coro in steps.items()))
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def wait_until_ready(self, timeout=STARTUP_READY_WAIT_SECONDS):
+        return self._ready.wait(timeout)
+
+    def mark_ready(self):
+        total_seconds = time.monotonic() - PROCESS_STARTED_AT
+        self._ready.set()
+        for name, seconds in self.timings.items():
+            registry.set_gauge("startup_step_seconds", (("step", name),), seconds)
+        registry.set_gauge("startup_seconds", value=total_seconds)
+        step_fields = {
+            f"{name}_seconds": round(seconds, 3)
+            for name, seconds in self.timings.items()
+        }
+        log.log(
+            logging.WARNING if total_seconds > STARTUP_TARGET_SECONDS else logging.INFO,
+            "startup_complete",
+            total_seconds=round(total_seconds, 3),
+            target_seconds=STARTUP_TARGET_SECONDS,
+            **step_fields,
+        )
+
+
+registry.describe(
+    "startup_seconds", "gauge", "Time from the process starting to the app being warm"
+)
+registry.describe(
+    "startup_step_seconds", "gauge", "Time each step of startup took (steps overlap)"
+)
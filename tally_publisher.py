@@ -0,0 +1,122 @@
+import os
+import threading
+
+from slack_sdk.errors import SlackApiError
+
+from log import get_logger
+
+log = get_logger("tally_publisher")
+
+# votes arriving within this many seconds of each other share one tally update
+TALLY_PUBLISH_WINDOW_SECONDS = float(os.environ.get("TALLY_PUBLISH_WINDOW_SECONDS", 5))
+# chat.update errors meaning the pinned message is gone, so a new one is posted
+MESSAGE_GONE_ERRORS = ("message_not_found", "cant_update_message")
+
+
+class TallyPublisher:
+    """Keeps a single pinned tally message up to date in a channel.
+
+    publish() only schedules an update - every call made before the window
+    closes is folded into one render and one chat.update. flush() renders
+    and updates right away, e.g. at the end of a phase. A rate limited
+    update is tried again once Slack's Retry-After has passed.
+    """
+
+    def __init__(
+        self,
+        client,
+        channel,
+        render,
+        header,
+        window_seconds=TALLY_PUBLISH_WINDOW_SECONDS,
+    ):
+        self._client = client
+        self._channel = channel
+        self._render = render
+        self._header = header
+        self._window_seconds = window_seconds
+        self._timer = None
+        self._timer_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # filled in once the tally message has been posted
+        self._channel_id = None
+        self._ts = None
+
+    def publish(self):
+        with self._timer_lock:
+            if self._timer is not None:
+                # an update is already on its way and will include this change
+                return
+            self._start_timer(self._window_seconds)
+
+    def _retry_after(self, seconds):
+        with self._timer_lock:
+            # any update already scheduled would only be rate limited too
+            if self._timer is not None:
+                self._timer.cancel()
+            self._start_timer(seconds)
+
+    def _start_timer(self, seconds):
+        self._timer = threading.Timer(seconds, self._flush_from_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_from_timer(self):
+        with self._timer_lock:
+            self._timer = None
+        self._send()
+
+    def flush(self):
+        with self._timer_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        self._send()
+
+    def _send(self):
+        with self._flush_lock:
+            text = self._render()
+            try:
+                if self._ts is not None:
+                    try:
+                        self._client.chat_update(
+                            channel=self._channel_id, ts=self._ts, text=text
+                        )
+                        return
+                    except SlackApiError as error:
+                        if error.response.get("error") == "ratelimited":
+                            retry_seconds = int(
+                                error.response.headers.get("Retry-After", 1)
+                            )
+                            log.warning(
+                                "tally_update_rate_limited",
+                                retry_seconds=retry_seconds,
+                            )
+                            self._retry_after(retry_seconds)
+                            return
+                        if error.response.get("error") not in MESSAGE_GONE_ERRORS:
+                            raise
+                        # the pinned message was deleted - start a new one below
+                        log.warning("tally_update_failed", error=error)
+                self._post_and_pin(text)
+            except SlackApiError as error:
+                log.error("tally_publish_failed", error=error)
+
+    def _post_and_pin(self, text):
+        response = self._client.chat_postMessage(channel=self._channel, text=text)
+        self._channel_id = response["channel"]
+        self._ts = response["ts"]
+        self._unpin_old_tallies()
+        self._client.pins_add(channel=self._channel_id, timestamp=self._ts)
+
+    def _unpin_old_tallies(self):
+        # tally messages pinned before a restart would otherwise pile up
+        pinned = self._client.pins_list(channel=self._channel_id)
+        for item in pinned.get("items", []):
+            message = item.get("message", {})
+            if message.get("ts") != self._ts and message.get("text", "").startswith(
+                self._header
+            ):
+                self._client.pins_remove(
+                    channel=self._channel_id, timestamp=message["ts"]
+                )
@@ -0,0 +1,50 @@
+"""Fixtures for the tests that run the app against a real Postgres server.
+
+Set TEST_DATABASE_URL to a server the tests may create databases on, e.g.
+
+    TEST_DATABASE_URL=postgresql://localhost/postgres python -m pytest tests
+
+Each test gets a throwaway, migrated database, dropped again afterwards.
+Without TEST_DATABASE_URL these tests are skipped.
+"""
+
+import os
+import sys
+import urllib.parse
+import uuid
+
+import psycopg2
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loadtest import FakeSlack, drop_database  # noqa: E402
+from migrate import migrate  # noqa: E402
+
+ADMIN_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+
+@pytest.fixture
+def database_url():
+    if not ADMIN_DATABASE_URL:
+        pytest.skip("set TEST_DATABASE_URL to run the tests against Postgres")
+    name = f"test_{uuid.uuid4().hex}"
+    conn = psycopg2.connect(ADMIN_DATABASE_URL)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(f"CREATE DATABASE {name};")
+    cur.close()
+    conn.close()
+    url = urllib.parse.urlparse(ADMIN_DATABASE_URL)._replace(path="/" + name).geturl()
+    try:
+        migrate(url)
+        yield url
+    finally:
+        drop_database(ADMIN_DATABASE_URL, name)
+
+
+@pytest.fixture
+def fake_slack():
+    slack = FakeSlack([])
+    yield slack
+    slack.server.shutdown()
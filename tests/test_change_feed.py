@@ -0,0 +1,197 @@
+"""Two app processes sharing one database through the LISTEN/NOTIFY change
+feed: votes and wins made through either show up in both."""
+
+import os
+import subprocess
+import sys
+import time
+import urllib.parse
+import uuid
+
+import psycopg2
+import pytest
+
+from commands import format_scoreboard, format_vote_tally, parse_page_num
+from leaderboard import Leaderboard
+from loadtest import (
+    SIGNING_SECRET,
+    FakeSlack,
+    get_free_port,
+    send_command,
+    wait_until_ready,
+)
+from vote_tally import VoteTally
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# how long a change may take to reach the other process
+CONVERGE_SECONDS = 10
+# everyone the fake Slack's users.list knows about
+PLAYER_IDS = ["UPROBE"] + [f"UPLAYER{num}" for num in range(1, 5)]
+
+
+class AppProcess:
+    """One app process with its own fake Slack."""
+
+    def __init__(self, app, database_url):
+        self.slack = FakeSlack(PLAYER_IDS)
+        self.port = get_free_port()
+        env = dict(
+            os.environ,
+            PORT=str(self.port),
+            DATABASE_URL=database_url,
+            SLACK_API_URL=self.slack.url + "/api/",
+            SLACK_BOT_TOKEN="xoxb-test",
+            SLACK_SIGNING_SECRET=SIGNING_SECRET,
+            CHANGE_FEED_ENABLED="1",
+            # votes are written straight away rather than journaled
+            VOTE_JOURNAL_PATH="",
+            TALLY_PUBLISH_WINDOW_SECONDS="0.1",
+        )
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(APP_DIR, app)],
+            cwd=APP_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def wait_until_ready(self):
+        wait_until_ready(self.port, self.process)
+
+    def run_command(self, command, user_id, text, channel_name="main_chat"):
+        """Send a slash command and return the app's response to it."""
+        response_path = f"/response/{uuid.uuid4().hex}"
+        body = urllib.parse.urlencode(
+            {
+                "token": "test",
+                "team_id": "TTEST",
+                "channel_id": "C" + channel_name.upper().replace("-", ""),
+                "channel_name": channel_name,
+                "user_id": user_id,
+                "user_name": user_id,
+                "command": command,
+                "text": text,
+                "response_url": self.slack.url + response_path,
+                "trigger_id": uuid.uuid4().hex,
+            }
+        )
+        status = send_command(f"http://127.0.0.1:{self.port}/slack/events", body)
+        assert status == 200
+        deadline = time.monotonic() + CONVERGE_SECONDS
+        while response_path not in self.slack.response_texts:
+            assert time.monotonic() < deadline, f"no response to {command} {text}"
+            time.sleep(0.02)
+        return self.slack.response_texts[response_path]
+
+    def get_published_tally(self, voter_id, text):
+        """Re-cast a vote that changes nothing, and return the tally this
+        process publishes for it - its in-memory tally."""
+        num_published = self._count_tally_posts()
+        self.run_command("/kill", voter_id, text)
+        deadline = time.monotonic() + CONVERGE_SECONDS
+        while self._count_tally_posts() == num_published:
+            assert time.monotonic() < deadline, "the tally was not published"
+            time.sleep(0.02)
+        return self.slack.api_texts.get("chat.update") or self.slack.api_texts.get(
+            "chat.postMessage"
+        )
+
+    def _count_tally_posts(self):
+        return (
+            self.slack.api_calls["chat.update"]
+            + self.slack.api_calls["chat.postMessage"]
+        )
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+        self.slack.server.shutdown()
+
+
+@pytest.fixture(params=["app.py", "async_app.py"])
+def app_processes(request, database_url):
+    processes = [AppProcess(request.param, database_url) for _ in range(2)]
+    try:
+        for process in processes:
+            process.wait_until_ready()
+        yield processes
+    finally:
+        for process in processes:
+            process.stop()
+
+
+def load_expected_state(database_url):
+    """The tally and leaderboard as the database has them."""
+    conn = psycopg2.connect(database_url)
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT voter_user_id, vote_type, target_name FROM votes ORDER BY votecast_time ASC;"
+        )
+        vote_tally = VoteTally()
+        vote_tally.load(cur.fetchall())
+        cur.execute("SELECT player_id, num_wins FROM tic_tac_win;")
+        leaderboard = Leaderboard()
+        leaderboard.load(cur.fetchall())
+        cur.close()
+    finally:
+        conn.close()
+    return vote_tally, leaderboard
+
+
+def play_winning_game(process, channel_name, x_player, o_player):
+    # X takes the top row
+    for player, move in [
+        (x_player, "0 0"),
+        (o_player, "1 0"),
+        (x_player, "0 1"),
+        (o_player, "1 1"),
+        (x_player, "0 2"),
+    ]:
+        process.run_command("/tictacmove", player, move, channel_name)
+
+
+def test_processes_converge_on_the_database(app_processes, database_url):
+    first, second = app_processes
+    # a vote that every tally check below re-casts unchanged
+    probe = ("UPROBE", "<@UPLAYER2>")
+    first.run_command("/kill", *probe)
+
+    first.run_command("/kill", "UPLAYER1", "<@UPLAYER2>")
+    second.run_command("/kill", "UPLAYER3", "<@UPLAYER2>")
+    second.run_command("/prayto", "UPLAYER2", "zeus")
+    first.run_command("/prayto", "UPLAYER4", "hera")
+    # votes changed through the other process
+    second.run_command("/kill", "UPLAYER1", "<@UPLAYER3>")
+    first.run_command("/prayto", "UPLAYER4", "zeus")
+
+    play_winning_game(first, "tic-tac-toe-test", "UPLAYER1", "UPLAYER2")
+    play_winning_game(second, "tic-tac-tolympics", "UPLAYER3", "UPLAYER4")
+    play_winning_game(second, "tic-tac-toe-test", "UPLAYER1", "UPLAYER4")
+
+    _, expected_leaderboard = load_expected_state(database_url)
+    assert expected_leaderboard.get_page(0, 10) == [
+        (1, "UPLAYER1", 2),
+        (2, "UPLAYER3", 1),
+    ]
+    expected_scoreboard = format_scoreboard(
+        expected_leaderboard, parse_page_num(""), "UPLAYER1"
+    )
+
+    for process in app_processes:
+        deadline = time.monotonic() + CONVERGE_SECONDS
+        while True:
+            tally_str = process.get_published_tally(*probe)
+            # read after the probe, which moves its voter to the end
+            expected_tally, _ = load_expected_state(database_url)
+            expected_tally_str = format_vote_tally(expected_tally)
+            scoreboard = process.run_command("/tictacscoreboard", "UPLAYER1", "")
+            if (
+                tally_str == expected_tally_str
+                and scoreboard == expected_scoreboard
+                or time.monotonic() > deadline
+            ):
+                break
+            time.sleep(0.1)
+        assert tally_str == expected_tally_str
+        assert scoreboard == expected_scoreboard
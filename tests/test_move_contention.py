@@ -0,0 +1,107 @@
+"""Concurrent /tictacmove commands on one game, against a real Postgres."""
+
+import importlib
+import threading
+
+import pytest
+
+from commands import SPACE_TAKEN_MSG
+from db import get_pool
+from tic_tac_game import TicTacMove
+
+GAME_ID = "CCONTENTION"
+NUM_THREADS = 8
+MOVES_PER_THREAD = 10
+# a 10x10 board needing 10 in a row, with every move in the top-left 5x5
+# corner - nobody can win and the board never fills, so no move resets it
+BOARD_SIZE = 10
+SQUARES = [(row, col) for row in range(5) for col in range(5)]
+
+
+@pytest.fixture
+def app(database_url, fake_slack):
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("DATABASE_URL", database_url)
+        patch.setenv("SLACK_API_URL", fake_slack.url + "/api/")
+        patch.setenv("SLACK_BOT_TOKEN", "xoxb-test")
+        patch.setenv("SLACK_SIGNING_SECRET", "test-signing-secret")
+        # importing app connects to (the fake) Slack
+        app = importlib.import_module("app")
+        yield app
+        get_pool().closeall()
+
+
+def test_concurrent_moves_are_applied_one_at_a_time(app, monkeypatch):
+    # saved once, at version 1
+    app.restart_game(GAME_ID, (BOARD_SIZE, BOARD_SIZE, BOARD_SIZE))
+
+    # the (move_count, version) each move saved, read back inside its own
+    # transaction - the game row is locked until the commit, so this is
+    # the order the moves were committed in
+    saved = []
+    update_board_state = app.update_board_state
+
+    def record_update_board_state(cur, game):
+        update_board_state(cur, game)
+        cur.execute(
+            "SELECT move_count, version FROM tic_tac_game WHERE game_id = %s;",
+            [game.game_id],
+        )
+        saved.append(cur.fetchone())
+
+    monkeypatch.setattr(app, "update_board_state", record_update_board_state)
+
+    responses = []
+    responses_lock = threading.Lock()
+    start = threading.Barrier(NUM_THREADS)
+
+    def play(thread_num):
+        player = f"UPLAYER{thread_num}"
+        start.wait()
+        # each thread walks the squares from a different starting point, so
+        # most squares are raced for by several threads at once
+        for move_num in range(MOVES_PER_THREAD):
+            square = SQUARES[(thread_num * 3 + move_num) % len(SQUARES)]
+
+            def respond(text, response_type="ephemeral"):
+                with responses_lock:
+                    responses.append((square, text, response_type))
+
+            app.make_tic_tac_toe_move(GAME_ID, player, *square, respond)
+
+    threads = [
+        threading.Thread(target=play, args=(thread_num,))
+        for thread_num in range(NUM_THREADS)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # every move got exactly one response
+    assert len(responses) == NUM_THREADS * MOVES_PER_THREAD
+    applied = [square for square, _, kind in responses if kind == "in_channel"]
+    rejected = [
+        (square, text) for square, text, kind in responses if kind != "in_channel"
+    ]
+    # each square was claimed by exactly one move, and no move was lost
+    assert sorted(applied) == sorted(set(applied))
+    assert set(applied) == set(SQUARES)
+    # every other move found its square taken
+    assert all(text == SPACE_TAKEN_MSG for _, text in rejected)
+    assert len(rejected) == NUM_THREADS * MOVES_PER_THREAD - len(SQUARES)
+
+    # one save per applied move, each exactly one on from the last
+    assert saved == [(num, num + 1) for num in range(1, len(SQUARES) + 1)]
+
+    with app.get_connection() as conn:
+        cur = conn.cursor()
+        game = app.lock_and_get_game(cur, GAME_ID, lock=False)
+        conn.rollback()
+        cur.close()
+    assert (game.move_count, game.version) == (len(SQUARES), len(SQUARES) + 1)
+    for row, col in SQUARES:
+        assert game.board_state[row * BOARD_SIZE + col] != TicTacMove.OPEN
+    # the teams took turns, X first
+    assert game.board_state.count(TicTacMove.X) == (len(SQUARES) + 1) // 2
+    assert game.board_state.count(TicTacMove.O) == len(SQUARES) // 2
@@ -0,0 +1,45 @@
+"""Prepared statements recovering after the server deallocates them."""
+
+import psycopg2
+import psycopg2.errors
+import pytest
+
+from prepared_statements import (
+    CREATE_GAME,
+    GET_GAME,
+    PreparingConnection,
+    execute_together,
+)
+
+GAME_ID = "CPREPARED"
+
+
+def get_game(cur):
+    execute_together(
+        cur,
+        [
+            (CREATE_GAME, [GAME_ID, 3, 3, 3, b"", "X"]),
+            (GET_GAME, [GAME_ID]),
+        ],
+    )
+    return cur.fetchone()
+
+
+def test_deallocated_statements_are_prepared_again(database_url):
+    conn = psycopg2.connect(database_url, connection_factory=PreparingConnection)
+    try:
+        cur = conn.cursor()
+        assert get_game(cur)[:3] == (3, 3, 3)
+        conn.commit()
+
+        # what DISCARD ALL or a pooler handing over another session does
+        cur.execute("DEALLOCATE ALL;")
+        conn.commit()
+        # the first call finds them gone, and only that one fails
+        with pytest.raises(psycopg2.errors.InvalidSqlStatementName):
+            get_game(cur)
+        conn.rollback()
+        assert get_game(cur)[:3] == (3, 3, 3)
+        conn.commit()
+    finally:
+        conn.close()
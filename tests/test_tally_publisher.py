@@ -0,0 +1,91 @@
+"""How the tally publisher handles chat.update failing."""
+
+import time
+
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web import SlackResponse
+
+from tally_publisher import TallyPublisher
+
+HEADER = "Vote tally:"
+
+
+def make_error(error, status_code=200, headers=None):
+    response = SlackResponse(
+        client=None,
+        http_verb="POST",
+        api_url="https://slack.com/api/chat.update",
+        req_args={},
+        data={"ok": False, "error": error},
+        headers=headers or {},
+        status_code=status_code,
+    )
+    return SlackApiError(error, response)
+
+
+class FakeClient:
+    """A Slack client whose chat.update raises each error in update_errors
+    in turn, then succeeds."""
+
+    def __init__(self, update_errors):
+        self.update_errors = list(update_errors)
+        self.calls = []
+
+    def chat_postMessage(self, channel, text):
+        self.calls.append("chat.postMessage")
+        return {"channel": "CMAIN", "ts": str(len(self.calls))}
+
+    def chat_update(self, channel, ts, text):
+        self.calls.append("chat.update")
+        if self.update_errors:
+            raise self.update_errors.pop(0)
+
+    def pins_list(self, channel):
+        self.calls.append("pins.list")
+        return {"items": []}
+
+    def pins_add(self, channel, timestamp):
+        self.calls.append("pins.add")
+
+
+def start_publisher(client):
+    publisher = TallyPublisher(client, "main_chat", lambda: HEADER, HEADER, 0.01)
+    # post and pin the tally message the updates below edit
+    publisher.flush()
+    client.calls.clear()
+    return publisher
+
+
+def test_rate_limited_update_is_retried_after_retry_after():
+    client = FakeClient(
+        [make_error("ratelimited", status_code=429, headers={"Retry-After": "1"})]
+    )
+    publisher = start_publisher(client)
+
+    publisher.flush()
+    assert client.calls == ["chat.update"]
+    time.sleep(0.5)
+    # still waiting out the Retry-After, and nothing was re-posted
+    assert client.calls == ["chat.update"]
+    time.sleep(1)
+    assert client.calls == ["chat.update", "chat.update"]
+
+
+def test_deleted_message_is_posted_again():
+    client = FakeClient([make_error("message_not_found")])
+    publisher = start_publisher(client)
+
+    publisher.flush()
+    assert client.calls == ["chat.update", "chat.postMessage", "pins.list", "pins.add"]
+
+
+def test_other_update_errors_do_not_post_again():
+    client = FakeClient([make_error("internal_error")])
+    publisher = start_publisher(client)
+
+    publisher.flush()
+    assert client.calls == ["chat.update"]
+    # the next vote's update goes to the same message
+    publisher.publish()
+    time.sleep(0.2)
+    assert client.calls == ["chat.update", "chat.update"]
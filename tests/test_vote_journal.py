@@ -0,0 +1,88 @@
+"""The vote journal's retries: votes Postgres rejects are dead-lettered, and
+everything else is retried until it's written."""
+
+import sqlite3
+import threading
+
+from vote_journal import VoteJournal, VoteRejectedError
+
+
+class FakePostgres:
+    """A flush_batch that rejects any batch with an unknown vote type, is
+    unreachable for its first num_outages calls, and then raises an
+    unexpected error for the next num_crashes."""
+
+    def __init__(self, num_outages=0, num_crashes=0):
+        self.num_outages = num_outages
+        self.num_crashes = num_crashes
+        self.written = []
+        self._lock = threading.Lock()
+
+    def flush_batch(self, votes):
+        with self._lock:
+            if self.num_outages:
+                self.num_outages -= 1
+                return False
+            if self.num_crashes:
+                self.num_crashes -= 1
+                raise RuntimeError("the name lookup failed")
+            if any(vote_type not in ("kill", "prayer") for _, _, vote_type, _ in votes):
+                raise VoteRejectedError("invalid input value for enum vote_type")
+            self.written.extend(votes)
+            return True
+
+
+def start_journal(path, postgres):
+    journal = VoteJournal(str(path), postgres.flush_batch, 500, 1)
+    journal.append("UPLAYER1", "<@UPLAYER2>", "kill")
+    journal.append("UPLAYER2", "zeus", "not-a-vote-type")
+    journal.append("UPLAYER3", "hera", "prayer")
+    journal.start()
+    return journal
+
+
+def test_rejected_votes_are_dead_lettered(tmp_path):
+    postgres = FakePostgres()
+    journal = start_journal(tmp_path / "journal.sqlite3", postgres)
+
+    assert journal.wait_until_empty(5)
+    # the good votes on either side of the bad one still got through, in order
+    assert [vote[:3] for vote in postgres.written] == [
+        ("UPLAYER1", "<@UPLAYER2>", "kill"),
+        ("UPLAYER3", "hera", "prayer"),
+    ]
+    assert journal.get_dead_count() == 1
+    conn = sqlite3.connect(tmp_path / "journal.sqlite3")
+    assert conn.execute(
+        "SELECT voter_id, target_name, vote_type, error FROM dead_votes;"
+    ).fetchall() == [
+        (
+            "UPLAYER2",
+            "zeus",
+            "not-a-vote-type",
+            "invalid input value for enum vote_type",
+        )
+    ]
+    conn.close()
+
+
+def test_unreachable_postgres_is_retried(tmp_path):
+    postgres = FakePostgres(num_outages=2)
+    journal = start_journal(tmp_path / "journal.sqlite3", postgres)
+
+    # two failed flushes, retried after 1s and then 1s (the cap)
+    assert journal.wait_until_empty(10)
+    assert postgres.num_outages == 0
+    assert len(postgres.written) == 2
+    assert journal.get_dead_count() == 1
+
+
+def test_unexpected_errors_are_retried(tmp_path):
+    postgres = FakePostgres(num_crashes=1)
+    journal = start_journal(tmp_path / "journal.sqlite3", postgres)
+
+    # the journal thread survives the error, and retries after 1s
+    assert journal.wait_until_empty(5)
+    assert postgres.num_crashes == 0
+    assert len(postgres.written) == 2
+    assert journal.get_dead_count() == 1
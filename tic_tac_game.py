@@ -0,0 +1,230 @@
+import threading
+from enum import Enum
+from functools import lru_cache
+
+from bitboard import WinDetector
+from log import get_logger
+
+log = get_logger("tic_tac_game")
+
+
+class TicTacMove(Enum):
+    OPEN = 1
+    X = 2
+    O = 3
+
+    @staticmethod
+    def get_opposite(e):
+        if e == TicTacMove.X:
+            return TicTacMove.O
+        elif e == TicTacMove.O:
+            return TicTacMove.X
+        else:
+            return TicTacMove.OPEN
+
+
+# each cell is stored in 2 bits: 0 = OPEN, 1 = X, 2 = O
+CELL_BITS = 2
+CELL_MASK = (1 << CELL_BITS) - 1
+
+
+@lru_cache(maxsize=None)
+def get_win_detector(height, width, win_length):
+    # line masks only depend on the board shape, so games of the same size share them
+    return WinDetector(height, width, win_length)
+
+
+def pack_cells(board_state):
+    packed = 0
+    for i, tile in enumerate(board_state):
+        packed |= (tile.value - 1) << (CELL_BITS * i)
+    num_bytes = (CELL_BITS * len(board_state) + 7) // 8
+    return packed.to_bytes(num_bytes, "little")
+
+
+def unpack_cells(cells, num_cells):
+    packed = int.from_bytes(bytes(cells), "little")
+    return [
+        TicTacMove(((packed >> (CELL_BITS * i)) & CELL_MASK) + 1)
+        for i in range(num_cells)
+    ]
+
+
+class TicTacGame:
+    """One tic tac toe game, stored as a single tic_tac_game row.
+
+    The board is packed 2 bits per cell, so loading, saving and resetting a
+    game are single-row operations whatever the board size. Each team's
+    tiles are also kept as a bitboard (see bitboard.py), built when the
+    board is loaded and updated one bit per move by place(), so checking
+    a move for a win never walks the board.
+    """
+
+    def __init__(
+        self,
+        game_id,
+        height,
+        width,
+        win_length,
+        board_state=None,
+        curr_team=TicTacMove.X,
+        move_count=0,
+        version=0,
+    ):
+        self.game_id = game_id
+        self.height = height
+        self.width = width
+        self.win_length = win_length
+        if board_state is None:
+            board_state = [TicTacMove.OPEN] * (height * width)
+        self.board_state = board_state
+        self.curr_team = curr_team
+        self.move_count = move_count
+        self.version = version
+
+    @staticmethod
+    def from_row(game_id, row):
+        height, width, win_length, cells, curr_team_str, move_count, version = row
+        return TicTacGame(
+            game_id,
+            height,
+            width,
+            win_length,
+            unpack_cells(cells, height * width),
+            TicTacMove[curr_team_str],
+            move_count,
+            version,
+        )
+
+    def to_row(self):
+        """The inverse of from_row."""
+        return (
+            self.height,
+            self.width,
+            self.win_length,
+            self.packed_cells(),
+            convert_move_enum_to_str(self.curr_team),
+            self.move_count,
+            self.version,
+        )
+
+    @property
+    def board_state(self):
+        return self._board_state
+
+    @board_state.setter
+    def board_state(self, board_state):
+        self._board_state = board_state
+        self.x_bits, self.o_bits = get_bitboards(board_state)
+
+    def place(self, index, team):
+        """Put team's tile on the open square at index."""
+        self._board_state[index] = team
+        if team == TicTacMove.X:
+            self.x_bits |= 1 << index
+        else:
+            self.o_bits |= 1 << index
+
+    @property
+    def win_detector(self):
+        return get_win_detector(self.height, self.width, self.win_length)
+
+    def packed_cells(self):
+        return pack_cells(self.board_state)
+
+    def reset(self, next_team):
+        self.board_state = [TicTacMove.OPEN] * (self.height * self.width)
+        self.curr_team = next_team
+        self.move_count = 0
+
+
+TIE_STR = "TIE"
+
+
+class GameCache:
+    """Latest known state of each game, for reads that don't need the row lock.
+
+    A newer version always replaces an older one, so updates can arrive
+    more than once or out of order.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._games = {}
+
+    def get(self, game_id):
+        return self._games.get(game_id)
+
+    def store(self, game):
+        with self._lock:
+            cached = self._games.get(game.game_id)
+            if cached is None or game.version > cached.version:
+                self._games[game.game_id] = game
+
+    def clear(self):
+        with self._lock:
+            self._games = {}
+
+
+def convert_move_str_to_enum(move_str):
+    if move_str == "OPEN":
+        return TicTacMove.OPEN
+    elif move_str == "X":
+        return TicTacMove.X
+    elif move_str == "O":
+        return TicTacMove.O
+    else:
+        log.error("unknown_move_str", move_str=move_str)
+
+
+def convert_move_enum_to_str(tile):
+    if tile == TicTacMove.OPEN:
+        return "_"
+    elif tile == TicTacMove.X:
+        return "X"
+    elif tile == TicTacMove.O:
+        return "O"
+    else:
+        log.error("unknown_tile", tile=tile)
+
+
+def get_bitboards(board_state):
+    x_bits = 0
+    o_bits = 0
+    for i, tile in enumerate(board_state):
+        if tile == TicTacMove.X:
+            x_bits |= 1 << i
+        elif tile == TicTacMove.O:
+            o_bits |= 1 << i
+    return x_bits, o_bits
+
+
+# returns (whether_game_won, winner) for the board (as bitboards) right after
+# the move at last_index - whether_game_won is True, False or TIE_STR (board
+# is full); winner is arbitrary if whether_game_won is not True
+def check_for_win(x_bits, o_bits, last_index, win_detector):
+    if x_bits >> last_index & 1:
+        mover, mover_bits = TicTacMove.X, x_bits
+    else:
+        mover, mover_bits = TicTacMove.O, o_bits
+    if mover_bits >> last_index & 1 and win_detector.is_win(mover_bits, last_index):
+        return True, mover
+    if win_detector.is_full(x_bits, o_bits):
+        # in this case, there's no winner, and the board is full
+        return TIE_STR, TicTacMove.OPEN
+    return False, TicTacMove.OPEN
+
+
+# backticks escape Slack markdown formatting (by formatting as "code")
+def get_board_str(board_state, width):
+    board_str = ""
+    for i in range(len(board_state) // width):
+        curr_row_str = "`"
+        for j in range(width):
+            curr_row_str += convert_move_enum_to_str(board_state[j + width * i])
+            curr_row_str += "|"
+        # replace last-column | with `\n
+        curr_row_str = curr_row_str[:-1]
+        curr_row_str += "`\n"
+        board_str += curr_row_str
+    return board_str
@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+
+from slack_sdk.errors import SlackApiError
+
+from log import get_logger
+
+log = get_logger("user_directory")
+
+# full reloads are a safety net - user_change/team_join events keep the
+# directory fresh in between
+USER_DIRECTORY_TTL_SECONDS = float(os.environ.get("USER_DIRECTORY_TTL_SECONDS", 3600))
+USERS_LIST_PAGE_SIZE = 200
+
+
+def get_display_name(user):
+    profile = user.get("profile", {})
+    return user.get("real_name") or profile.get("real_name") or user.get("name")
+
+
+class UserDirectory:
+    """In-process map of Slack user ID -> real name.
+
+    Loaded once with users.list (following every pagination cursor) and
+    then kept current from user_change/team_join events, so resolving a
+    name is a dict lookup rather than a Web API call per vote.
+    """
+
+    def __init__(self, client, ttl_seconds=USER_DIRECTORY_TTL_SECONDS):
+        self._client = client
+        self._ttl_seconds = ttl_seconds
+        self._names = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def load(self):
+        names = {}
+        cursor = None
+        while True:
+            response = self._client.users_list(
+                limit=USERS_LIST_PAGE_SIZE, cursor=cursor
+            )
+            for user in response["members"]:
+                names[user["id"]] = get_display_name(user)
+            cursor = response.get("response_metadata", {}).get("next_cursor")
+            if not cursor:
+                break
+        with self._lock:
+            # swap in the whole map at once so readers never see a partial load
+            self._names = names
+            self._loaded_at = time.monotonic()
+        log.info("user_directory_loaded", num_users=len(names))
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                self.load()
+            except SlackApiError as error:
+                log.error("user_directory_refresh_failed", error=error)
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def update_user(self, user):
+        with self._lock:
+            self._names[user["id"]] = get_display_name(user)
+
+    def get_cached_name(self, user_id):
+        """get_name without waiting on the Web API - None if not cached yet."""
+        if (
+            self._loaded_at is not None
+            and time.monotonic() - self._loaded_at > self._ttl_seconds
+        ):
+            self._refresh_in_background()
+        return self._names.get(user_id)
+
+    def get_name(self, user_id):
+        if self._loaded_at is None:
+            # first lookup after startup has to wait for the initial load
+            self.load()
+        elif time.monotonic() - self._loaded_at > self._ttl_seconds:
+            # serve the slightly stale copy while a fresh one loads
+            self._refresh_in_background()
+
+        name = self._names.get(user_id)
+        if name is None:
+            # someone we haven't heard about yet - one users.info call
+            # instead of reloading the whole workspace
+            try:
+                user = self._client.users_info(user=user_id)["user"]
+            except SlackApiError as error:
+                log.warning("user_lookup_failed", user_id=user_id, error=error)
+                return None
+            self.update_user(user)
+            name = self._names.get(user_id)
+        return name
@@ -0,0 +1,241 @@
+import os
+import sqlite3
+import threading
+import time
+
+from log import get_logger
+from metrics import registry
+
+log = get_logger("vote_journal")
+
+# votes are journaled here before they reach Postgres - empty turns the
+# journal off, so votes are written straight to Postgres after the ack
+VOTE_JOURNAL_PATH = os.environ.get("VOTE_JOURNAL_PATH", "vote_journal.sqlite3")
+# most votes handed to Postgres in one transaction
+VOTE_JOURNAL_BATCH_SIZE = int(os.environ.get("VOTE_JOURNAL_BATCH_SIZE", 500))
+# a failed flush is retried after 1s, then 2s, 4s... up to this
+VOTE_JOURNAL_MAX_RETRY_SECONDS = float(
+    os.environ.get("VOTE_JOURNAL_MAX_RETRY_SECONDS", 30)
+)
+
+CREATE_PENDING_VOTES_SQL = """CREATE TABLE IF NOT EXISTS pending_votes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    voter_id TEXT NOT NULL,
+    target_name TEXT NOT NULL,
+    vote_type TEXT NOT NULL,
+    cast_at REAL NOT NULL
+);"""
+# votes Postgres rejected outright (bad data, a broken constraint) are moved
+# here, so they can be looked at without holding up the votes behind them
+CREATE_DEAD_VOTES_SQL = """CREATE TABLE IF NOT EXISTS dead_votes (
+    id INTEGER PRIMARY KEY,
+    voter_id TEXT NOT NULL,
+    target_name TEXT NOT NULL,
+    vote_type TEXT NOT NULL,
+    cast_at REAL NOT NULL,
+    error TEXT NOT NULL,
+    failed_at REAL NOT NULL
+);"""
+# how long /modvotes waits for earlier votes to reach Postgres first
+VOTE_JOURNAL_DRAIN_SECONDS = 10
+
+
+class VoteRejectedError(Exception):
+    """Raised by flush_batch when Postgres rejected the votes themselves,
+    e.g. a DataError or IntegrityError - unlike a lost connection, sending
+    the same batch again can't succeed."""
+
+
+class VoteJournal:
+    """Votes waiting to be written to Postgres, kept in a local SQLite file.
+
+    append() returns once the vote is committed to the journal (WAL mode
+    with synchronous=FULL, so it survives a crash). A background thread
+    hands the oldest votes to flush_batch and deletes them only once it
+    returns True, retrying with backoff while it returns False (Postgres is
+    down or slow) - anything still journaled when the process stopped is
+    flushed when it starts again.
+
+    flush_batch gets [(voter_id, target_name, vote_type, cast_at)] in the
+    order the votes were cast, and may see a vote again after a crash. If
+    it raises VoteRejectedError the batch's votes are sent one at a time,
+    and each vote that is rejected on its own moves to dead_votes. Any other
+    exception is logged and retried like a False.
+    """
+
+    def __init__(self, path, flush_batch, batch_size, max_retry_seconds):
+        self._flush_batch = flush_batch
+        self._batch_size = batch_size
+        self._max_retry_seconds = max_retry_seconds
+        # autocommit - every append is its own (durable) transaction
+        self._conn = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("PRAGMA synchronous=FULL;")
+        self._conn.execute(CREATE_PENDING_VOTES_SQL)
+        self._conn.execute(CREATE_DEAD_VOTES_SQL)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def start(self):
+        num_pending = self.get_pending_count()
+        if num_pending:
+            log.info("vote_journal_replaying", num_votes=num_pending)
+        threading.Thread(target=self._run, name="vote-journal", daemon=True).start()
+
+    def append(self, voter_id, target_name, vote_type):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO pending_votes(voter_id, target_name, vote_type, cast_at) VALUES(?, ?, ?, ?);",
+                (voter_id, target_name, vote_type, time.time()),
+            )
+        registry.inc("vote_journal_appended_total")
+        self._wakeup.set()
+
+    def get_pending_count(self):
+        with self._lock:
+            (num_pending,) = self._conn.execute(
+                "SELECT COUNT(*) FROM pending_votes;"
+            ).fetchone()
+        return num_pending
+
+    def get_dead_count(self):
+        with self._lock:
+            (num_dead,) = self._conn.execute(
+                "SELECT COUNT(*) FROM dead_votes;"
+            ).fetchone()
+        return num_dead
+
+    def wait_until_empty(self, timeout):
+        """Wait for every journaled vote to reach Postgres, returning False
+        if some were still pending after timeout seconds."""
+        deadline = time.monotonic() + timeout
+        while self.get_pending_count():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _run(self):
+        retry_seconds = 1
+        while True:
+            with self._lock:
+                batch = self._conn.execute(
+                    "SELECT id, voter_id, target_name, vote_type, cast_at FROM pending_votes ORDER BY id LIMIT ?;",
+                    (self._batch_size,),
+                ).fetchall()
+            if not batch:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            try:
+                flushed = self._flush(batch)
+            except Exception as error:
+                # anything unexpected is retried like a failed flush - if
+                # it killed this thread, no vote would reach Postgres again
+                log.error("vote_journal_flush_error", error=error)
+                flushed = False
+
+            if not flushed:
+                registry.inc("vote_journal_flush_failures_total")
+                log.warning(
+                    "vote_journal_flush_failed",
+                    num_votes=len(batch),
+                    retry_seconds=retry_seconds,
+                )
+                time.sleep(retry_seconds)
+                retry_seconds = min(retry_seconds * 2, self._max_retry_seconds)
+                continue
+            retry_seconds = 1
+
+    def _flush(self, batch):
+        try:
+            flushed = self._flush_batch([vote[1:] for vote in batch])
+        except VoteRejectedError:
+            # find the bad votes - the rest still go through, in order
+            return self._flush_one_at_a_time(batch)
+        if flushed:
+            self._delete(batch)
+        return flushed
+
+    def _flush_one_at_a_time(self, batch):
+        """Flush each vote in batch on its own, dead-lettering the ones
+        Postgres rejects. Returns False if Postgres went away part way."""
+        for vote in batch:
+            try:
+                if not self._flush_batch([vote[1:]]):
+                    return False
+            except VoteRejectedError as error:
+                self._dead_letter(vote, error)
+                continue
+            self._delete([vote])
+        return True
+
+    def _delete(self, votes):
+        # votes are flushed oldest first, so everything up to the last one
+        # has been written
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM pending_votes WHERE id <= ?;", (votes[-1][0],)
+            )
+        registry.inc("vote_journal_flushed_total", amount=len(votes))
+        # how long the oldest vote in the batch waited to reach Postgres
+        registry.observe("vote_journal_lag_seconds", value=time.time() - votes[0][4])
+
+    def _dead_letter(self, vote, error):
+        vote_id, voter_id, target_name, vote_type, cast_at = vote
+        with self._lock:
+            # one transaction, so the vote is in exactly one of the tables
+            self._conn.execute("BEGIN;")
+            self._conn.execute(
+                "INSERT INTO dead_votes(id, voter_id, target_name, vote_type, cast_at, error, failed_at) VALUES(?, ?, ?, ?, ?, ?, ?);",
+                (
+                    vote_id,
+                    voter_id,
+                    target_name,
+                    vote_type,
+                    cast_at,
+                    str(error),
+                    time.time(),
+                ),
+            )
+            self._conn.execute("DELETE FROM pending_votes WHERE id = ?;", (vote_id,))
+            self._conn.execute("COMMIT;")
+        registry.inc("vote_journal_dead_letters_total")
+        log.error(
+            "vote_dead_lettered",
+            voter_id=voter_id,
+            target_name=target_name,
+            vote_type=vote_type,
+            cast_at=cast_at,
+            error=error,
+        )
+
+
+def collect_vote_journal_metrics(journal):
+    def collect():
+        return [
+            ("vote_journal_pending", (), journal.get_pending_count()),
+            ("vote_journal_dead_votes", (), journal.get_dead_count()),
+        ]
+
+    return collect
+
+
+registry.describe(
+    "vote_journal_lag_seconds",
+    "histogram",
+    "Time from a vote being journaled to it being committed to Postgres",
+)
+registry.describe(
+    "vote_journal_flush_failures_total",
+    "counter",
+    "Batches of journaled votes that could not be written to Postgres",
+)
+registry.describe(
+    "vote_journal_dead_letters_total",
+    "counter",
+    "Journaled votes Postgres rejected, moved to the dead_votes table",
+)
@@ -0,0 +1,61 @@
+import threading
+
+
+class VoteTally:
+    """Authoritative in-memory copy of the votes table.
+
+    Mirrors the table's rule that each voter has exactly one vote (of any
+    type), so recording a vote moves the voter off whatever target they
+    voted for before. Every operation is O(1) apart from get_tally, which
+    only sorts the targets for display.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # voter_user_id -> (vote_type, target_name)
+        self._votes = {}
+        # vote_type -> target_name -> voters, kept as a dict so the voters
+        # stay in the order they voted (like string_agg did)
+        self._targets = {}
+        self.loaded = False
+
+    def load(self, rows):
+        """Replace the tally with rows of (voter_user_id, vote_type, target_name)."""
+        with self._lock:
+            self._votes = {}
+            self._targets = {}
+            for voter_user_id, vote_type, target_name in rows:
+                self._record(voter_user_id, target_name, vote_type)
+            self.loaded = True
+
+    def record_vote(self, voter_user_id, target_name, vote_type):
+        with self._lock:
+            self._record(voter_user_id, target_name, vote_type)
+
+    def _record(self, voter_user_id, target_name, vote_type):
+        previous = self._votes.get(voter_user_id)
+        if previous is not None:
+            prev_type, prev_target = previous
+            voters = self._targets[prev_type][prev_target]
+            del voters[voter_user_id]
+            if not voters:
+                del self._targets[prev_type][prev_target]
+        self._votes[voter_user_id] = (vote_type, target_name)
+        by_target = self._targets.setdefault(vote_type, {})
+        by_target.setdefault(target_name, {})[voter_user_id] = None
+
+    def get_tally(self, vote_type):
+        """Return [(target_name, num_votes, [voter_user_id, ...])], most votes first."""
+        with self._lock:
+            by_target = self._targets.get(vote_type, {})
+            tally = [
+                (target_name, len(voters), list(voters))
+                for target_name, voters in by_target.items()
+            ]
+        tally.sort(key=lambda entry: entry[1], reverse=True)
+        return tally
+
+    def get_counts(self, vote_type):
+        with self._lock:
+            by_target = self._targets.get(vote_type, {})
+            return {target: len(voters) for target, voters in by_target.items()}
@@ -0,0 +1,93 @@
+import contextvars
+import os
+import queue
+import threading
+import time
+import zlib
+
+from log import get_logger
+from metrics import registry
+
+log = get_logger("worker_pool")
+
+# 0 runs handler work inline on the request thread, like before
+WORKER_POOL_SIZE = int(os.environ.get("WORKER_POOL_SIZE", 4))
+# jobs waiting per worker before new ones are turned away
+WORKER_QUEUE_SIZE = int(os.environ.get("WORKER_QUEUE_SIZE", 100))
+
+
+class KeyedWorkerPool:
+    """Runs post-ack work on a fixed set of threads with bounded queues.
+
+    Each key (a channel or game ID) always maps to the same worker, so work
+    for one game runs in the order it was submitted while different games
+    run in parallel. submit() never blocks - it returns False when that
+    worker's queue is full so the caller can shed the request.
+    """
+
+    def __init__(self, num_workers, max_queue_size):
+        self._queues = [queue.Queue(maxsize=max_queue_size) for _ in range(num_workers)]
+        for worker_num, work_queue in enumerate(self._queues):
+            threading.Thread(
+                target=self._run_worker,
+                args=(work_queue,),
+                name=f"worker-{worker_num}",
+                daemon=True,
+            ).start()
+
+    def submit(self, key, func, *args):
+        # crc32 rather than hash() so a key lands on the same worker every run
+        work_queue = self._queues[zlib.crc32(key.encode()) % len(self._queues)]
+        try:
+            # the job runs in the submitter's context, so it keeps its request ID
+            work_queue.put_nowait(
+                (contextvars.copy_context(), func, args, time.perf_counter())
+            )
+        except queue.Full:
+            registry.inc("worker_pool_rejected_total")
+            return False
+        registry.inc("worker_pool_submitted_total")
+        return True
+
+    def _run_worker(self, work_queue):
+        while True:
+            context, func, args, submitted_at = work_queue.get()
+            registry.observe(
+                "worker_pool_queue_wait_seconds",
+                value=time.perf_counter() - submitted_at,
+            )
+            try:
+                context.run(func, *args)
+            except Exception as error:
+                registry.inc("worker_pool_errors_total")
+                log.exception(
+                    "background_work_failed", function=func.__name__, error=error
+                )
+            finally:
+                work_queue.task_done()
+
+    def get_queue_depths(self):
+        return [work_queue.qsize() for work_queue in self._queues]
+
+
+def collect_worker_pool_metrics(pool):
+    def collect():
+        depths = pool.get_queue_depths()
+        samples = [("worker_pool_queue_depth", (), sum(depths))]
+        samples.extend(
+            ("worker_pool_queue_depth_per_worker", (("worker", i),), depth)
+            for i, depth in enumerate(depths)
+        )
+        return samples
+
+    return collect
+
+
+registry.describe(
+    "worker_pool_queue_wait_seconds",
+    "histogram",
+    "Time handler work waited in the worker queue",
+)
+registry.describe(
+    "worker_pool_rejected_total", "counter", "Handler work turned away by a full queue"
+)